@@ -1,44 +1,40 @@
 """
 Digital Archivist Agent (DAA)
-自主评估人文故事并在Base Sepolia测试网上铸造ERC-721 NFT
+自主评估人文故事并在测试网上铸造ERC-721 NFT（默认 Base Sepolia，见 dmm.chains）
 """
 
 import os
+import sys
 import json
+import time
 from dotenv import load_dotenv
 from web3 import Web3
 from openai import OpenAI
 
+# 将项目根目录添加到 Python 路径，以便导入共享模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmm import accounting, chains, packing, simchain, supervisor, usage
+from dmm.contracts import CONTRACT_ABI, minted_token_id
+from dmm.log import get_logger
+from dmm.prompts import EVALUATION_RUBRIC_ZH, PACKED_RUBRIC_ZH, build_openai_messages, build_packed_messages
+
 # 加载环境变量
 load_dotenv()
 
+log = get_logger("agent")
+
 # ============== 配置区 ==============
 
-# Base Sepolia 测试网 RPC URL
-BASE_SEPOLIA_RPC = os.getenv("BASE_SEPOLIA_RPC", "https://sepolia.base.org")
+# 铸造使用的链（RPC、chain id、合约地址和浏览器见 dmm.chains），默认 Base Sepolia，可用 AGENT_CHAIN 切换
+CHAIN = chains.get(chains.AGENT_CHAIN)
 
 # Agent 私钥（从环境变量加载）
 AGENT_PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 
-# 合约地址（部署后需要更新）
-CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0000000000000000000000000000000000000000")
-
-# 合约 ABI（简化版，仅包含 mintToken 函数）
-CONTRACT_ABI = [
-    {
-        "inputs": [
-            {"internalType": "address", "name": "recipient", "type": "address"},
-            {"internalType": "string", "name": "tokenURI", "type": "string"}
-        ],
-        "name": "mintToken",
-        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
-
 # OpenAI API 配置
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+AI_MODEL = "gpt-4"
 
 # 元数据基础 URL（可以是 IPFS 或其他托管服务）
 METADATA_BASE_URL = "https://ipfs.io/ipfs/"
@@ -48,8 +44,9 @@ SCORE_THRESHOLD = 85
 
 # ============== 初始化 Web3 ==============
 
-web3 = Web3(Web3.HTTPProvider(BASE_SEPOLIA_RPC))
-print(f"🔗 连接到 Base Sepolia: {web3.is_connected()}")
+# AGENT_CHAIN=simulated 时连接进程内模拟链（见 dmm.simchain）
+web3 = simchain.web3(CHAIN.rpc_urls[0])
+log.info("web3.connected", network=CHAIN.key, connected=web3.is_connected())
 
 # ============== AI 评估函数 ==============
 
@@ -63,42 +60,23 @@ def evaluate_story_with_ai(story_text: str) -> dict:
     Returns:
         dict: 包含 score, metadata_title, metadata_description 的字典
     """
-    print("\n📝 开始 AI 评估...")
+    log.info("evaluate.start", provider="openai", story_length=len(story_text))
     
     try:
         client = OpenAI(api_key=OPENAI_API_KEY)
         
-        prompt = f"""
-你是一位专业的文学评论家和文化档案管理员。请评估以下人文故事的价值，
-并以 JSON 格式返回评估结果。
-
-评分标准（0-100）：
-- 情感深度和真实性 (30分)
-- 文化和历史价值 (25分)
-- 叙事质量和结构 (20分)
-- 原创性和独特性 (15分)
-- 社会意义和影响力 (10分)
-
-故事内容：
-{story_text}
-
-请以严格的 JSON 格式返回（不要包含任何markdown格式）：
-{{
-    "score": [0-100的整数],
-    "metadata_title": "[简短标题，最多50字符]",
-    "metadata_description": "[详细描述，总结故事的核心价值和特点，100-200字符]"
-}}
-"""
-        
+        # 评分标准作为固定的系统消息，故事正文作为唯一的可变部分
+        accounting.check_budget()
+        started = time.perf_counter()
         response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "你是一位专业的文学评论家。请始终返回有效的JSON格式。"},
-                {"role": "user", "content": prompt}
-            ],
+            model=AI_MODEL,
+            messages=build_openai_messages(story_text, EVALUATION_RUBRIC_ZH, "故事内容"),
             temperature=0.7,
             max_tokens=500
         )
+        stats = usage.record_usage("openai", response.usage, (time.perf_counter() - started) * 1000)
+        accounting.record_llm(AI_MODEL, stats)
+        log.info("evaluate.usage", provider="openai", **stats)
         
         result_text = response.choices[0].message.content.strip()
         
@@ -110,23 +88,71 @@ def evaluate_story_with_ai(story_text: str) -> dict:
         
         evaluation = json.loads(result_text.strip())
         
-        print(f"✅ AI 评估完成:")
-        print(f"   评分: {evaluation['score']}/100")
-        print(f"   标题: {evaluation['metadata_title']}")
-        print(f"   描述: {evaluation['metadata_description']}")
+        log.info("evaluate.done", score=evaluation['score'], title=evaluation['metadata_title'])
+        log.debug("evaluate.result", evaluation=evaluation)
         
         return evaluation
         
     except Exception as e:
-        print(f"❌ AI 评估失败: {str(e)}")
+        log.error("evaluate.failed", error=str(e))
         raise
 
 
+def evaluate_stories_with_ai(stories: list) -> list:
+    """
+    批量评估多个故事：短故事打包进同一个提示词（见 dmm.packing），其余单独评估
+    
+    Args:
+        stories: 待评估的故事文本列表
+        
+    Returns:
+        list: 与输入顺序一致的评估结果；打包结果缺失或无效的故事回退为 evaluate_story_with_ai
+    """
+    results = [None] * len(stories)
+    packs, singles = packing.plan(stories)
+    log.info("evaluate.batch_start", stories=len(stories), packs=len(packs), singles=len(singles))
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    
+    for pack in packs:
+        parsed = {}
+        try:
+            accounting.check_budget()
+            started = time.perf_counter()
+            response = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=build_packed_messages([stories[index] for index in pack], PACKED_RUBRIC_ZH, "故事列表"),
+                temperature=0.7,
+                max_tokens=packing.max_tokens(len(pack))
+            )
+            stats = usage.record_usage("openai-packed", response.usage, (time.perf_counter() - started) * 1000)
+            accounting.record_llm(AI_MODEL, stats)
+            log.info("evaluate.usage", provider="openai-packed", **stats)
+            parsed = packing.parse_packed(response.choices[0].message.content, len(pack), fields=packing.FIELDS_ZH)
+        except accounting.BudgetExceeded:
+            raise
+        except Exception as e:
+            log.warning("evaluate.pack_failed", stories=len(pack), error=str(e))
+        packing.record_pack(len(pack), len(parsed))
+        
+        for k, index in enumerate(pack):
+            if k in parsed:
+                results[index] = parsed[k]
+            else:
+                singles.append(index)
+    
+    # 不适合打包或打包结果缺失的故事单独评估
+    for index in sorted(singles):
+        results[index] = evaluate_story_with_ai(stories[index])
+    
+    log.info("evaluate.batch_done", stories=len(stories), packed=len(stories) - len(singles))
+    return results
+
+
 # ============== 链上铸造函数 ==============
 
 def mint_memory_token(recipient_address: str, metadata: dict) -> str:
     """
-    在 Base Sepolia 上铸造 MemoryToken NFT
+    在 AGENT_CHAIN 指定的链上铸造 MemoryToken NFT
     
     Args:
         recipient_address: 接收者地址
@@ -135,17 +161,17 @@ def mint_memory_token(recipient_address: str, metadata: dict) -> str:
     Returns:
         str: 交易哈希
     """
-    print("\n⛓️  准备链上铸造...")
+    log.info("mint.start", recipient=recipient_address)
     
     try:
         # 获取账户
         account = web3.eth.account.from_key(AGENT_PRIVATE_KEY)
         agent_address = account.address
-        print(f"   Agent 地址: {agent_address}")
+        log.debug("mint.agent", agent_address=agent_address)
         
         # 创建合约实例
         contract = web3.eth.contract(
-            address=Web3.to_checksum_address(CONTRACT_ADDRESS),
+            address=Web3.to_checksum_address(CHAIN.contract_address),
             abi=CONTRACT_ABI
         )
         
@@ -170,45 +196,37 @@ def mint_memory_token(recipient_address: str, metadata: dict) -> str:
         # 这里使用模拟的 URI
         token_uri = f"{METADATA_BASE_URL}Qm{metadata['score']}{metadata['metadata_title'][:10]}"
         
-        print(f"   Token URI: {token_uri}")
-        print(f"   接收者: {recipient_address}")
+        log.debug("mint.metadata", metadata=token_metadata, token_uri=token_uri)
         
         # 构建交易
-        nonce = web3.eth.get_transaction_count(agent_address)
+        nonce = web3.eth.get_transaction_count(agent_address, 'pending')
         
         transaction = contract.functions.mintToken(
             Web3.to_checksum_address(recipient_address),
             token_uri
         ).build_transaction({
-            'chainId': 84532,  # Base Sepolia Chain ID
+            'chainId': CHAIN.chain_id,
             'gas': 300000,
             'gasPrice': web3.eth.gas_price,
             'nonce': nonce,
         })
         
-        # 签名交易
-        signed_txn = web3.eth.account.sign_transaction(transaction, AGENT_PRIVATE_KEY)
-        
-        # 发送交易
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        tx_hash_hex = tx_hash.hex()
-        
-        print(f"   交易已发送: {tx_hash_hex}")
-        print(f"   等待确认...")
-        
-        # 等待交易确认
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        # 签名、发送并等待确认；超过目标确认时间仍未上链时用同一 nonce 提价替换
+        pending, tx_hash_hex, tx_receipt = supervisor.send_and_wait(
+            web3, CHAIN, transaction, AGENT_PRIVATE_KEY, timeout=120)
+        gas_price = next(a['gas_price'] for a in pending.attempts if a['tx_hash'] == tx_hash_hex)
+        accounting.record_gas(tx_receipt['gasUsed'], tx_receipt.get('effectiveGasPrice', gas_price), CHAIN.key)
         
         if tx_receipt['status'] == 1:
-            print(f"✅ 铸造成功!")
-            print(f"   Gas 使用: {tx_receipt['gasUsed']}")
+            log.info("mint.confirmed", tx_hash=tx_hash_hex, gas_used=tx_receipt['gasUsed'],
+                     token_id=minted_token_id(contract, tx_receipt))
             return tx_hash_hex
         else:
-            print(f"❌ 交易失败")
+            log.error("mint.reverted", tx_hash=tx_hash_hex)
             return None
             
     except Exception as e:
-        print(f"❌ 铸造失败: {str(e)}")
+        log.error("mint.failed", error=str(e))
         raise
 
 
@@ -258,7 +276,7 @@ def run_archivist(story_text: str):
                 print(f"   描述: {evaluation['metadata_description']}")
                 print(f"\n🔗 铸造成功:")
                 print(f"   交易哈希: {tx_hash}")
-                print(f"   浏览器: https://sepolia.basescan.org/tx/{tx_hash}")
+                print(f"   浏览器: {CHAIN.tx_url(tx_hash)}")
                 print("=" * 60)
         except Exception as e:
             print(f"\n❌ 流程中止: 铸造失败 - {str(e)}")
@@ -4,41 +4,42 @@ Digital Archivist Agent (DAA) - Claude 版本
 """
 
 import os
+import sys
 import json
+import time
 from dotenv import load_dotenv
 from web3 import Web3
 from anthropic import Anthropic
 
+# 将项目根目录添加到 Python 路径，以便导入共享模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmm import accounting, chains, simchain, supervisor, usage
+from dmm.contracts import CONTRACT_ABI, minted_token_id
+from dmm.log import get_logger
+from dmm.prompts import build_claude_request
+
 # 加载环境变量
 load_dotenv()
 
+log = get_logger("agent")
+
 # ============== 配置区 ==============
 
-BASE_SEPOLIA_RPC = os.getenv("BASE_SEPOLIA_RPC", "https://sepolia.base.org")
+# 铸造使用的链，默认 Base Sepolia，可用 AGENT_CHAIN 切换（见 dmm.chains）
+CHAIN = chains.get(chains.AGENT_CHAIN)
 AGENT_PRIVATE_KEY = os.getenv("PRIVATE_KEY")
-CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0000000000000000000000000000000000000000")
-
-CONTRACT_ABI = [
-    {
-        "inputs": [
-            {"internalType": "address", "name": "recipient", "type": "address"},
-            {"internalType": "string", "name": "tokenURI", "type": "string"}
-        ],
-        "name": "mintToken",
-        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+AI_MODEL = "claude-3-5-sonnet-20241022"
 METADATA_BASE_URL = "https://ipfs.io/ipfs/"
 SCORE_THRESHOLD = 85
 
 # ============== 初始化 ==============
 
-web3 = Web3(Web3.HTTPProvider(BASE_SEPOLIA_RPC))
-print(f"🔗 连接到 Base Sepolia: {web3.is_connected()}")
+# AGENT_CHAIN=simulated 时连接进程内模拟链（见 dmm.simchain）
+web3 = simchain.web3(CHAIN.rpc_urls[0])
+log.info("web3.connected", network=CHAIN.key, connected=web3.is_connected())
 
 # ============== AI 评估函数（Claude 版本）==============
 
@@ -46,41 +47,23 @@ def evaluate_story_with_claude(story_text: str) -> dict:
     """
     使用 Anthropic Claude API 评估故事的价值
     """
-    print("\n📝 开始 AI 评估（使用 Claude）...")
+    log.info("evaluate.start", provider="anthropic", story_length=len(story_text))
     
     try:
         client = Anthropic(api_key=ANTHROPIC_API_KEY)
         
-        prompt = f"""你是一位专业的文学评论家和文化档案管理员。请评估以下人文故事的价值。
-
-评分标准（0-100）：
-- 情感深度和真实性 (30分)
-- 文化和历史价值 (25分)
-- 叙事质量和结构 (20分)
-- 原创性和独特性 (15分)
-- 社会意义和影响力 (10分)
-
-故事内容：
-{story_text}
-
-请以严格的 JSON 格式返回（不要包含任何其他文字）：
-{{
-    "score": [0-100的整数],
-    "metadata_title": "[简短标题，最多50字符]",
-    "metadata_description": "[详细描述，总结故事的核心价值和特点，100-200字符]"
-}}"""
-        
+        # 评分标准作为带缓存标记的固定系统块，故事正文作为唯一的可变部分
+        accounting.check_budget()
+        started = time.perf_counter()
         response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
+            model=AI_MODEL,
             max_tokens=500,
             temperature=0.7,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
+            **build_claude_request(story_text)
         )
+        stats = usage.record_usage("anthropic", response.usage, (time.perf_counter() - started) * 1000)
+        accounting.record_llm(AI_MODEL, stats)
+        log.info("evaluate.usage", provider="anthropic", **stats)
         
         result_text = response.content[0].text.strip()
         
@@ -92,31 +75,29 @@ def evaluate_story_with_claude(story_text: str) -> dict:
         
         evaluation = json.loads(result_text.strip())
         
-        print(f"✅ AI 评估完成:")
-        print(f"   评分: {evaluation['score']}/100")
-        print(f"   标题: {evaluation['metadata_title']}")
-        print(f"   描述: {evaluation['metadata_description']}")
+        log.info("evaluate.done", score=evaluation['score'], title=evaluation['metadata_title'])
+        log.debug("evaluate.result", evaluation=evaluation)
         
         return evaluation
         
     except Exception as e:
-        print(f"❌ AI 评估失败: {str(e)}")
+        log.error("evaluate.failed", error=str(e))
         raise
 
 
 # ============== 链上铸造函数 ==============
 
 def mint_memory_token(recipient_address: str, metadata: dict) -> str:
-    """在 Base Sepolia 上铸造 MemoryToken NFT"""
-    print("\n⛓️  准备链上铸造...")
+    """在 AGENT_CHAIN 指定的链上铸造 MemoryToken NFT"""
+    log.info("mint.start", recipient=recipient_address)
     
     try:
         account = web3.eth.account.from_key(AGENT_PRIVATE_KEY)
         agent_address = account.address
-        print(f"   Agent 地址: {agent_address}")
+        log.debug("mint.agent", agent_address=agent_address)
         
         contract = web3.eth.contract(
-            address=Web3.to_checksum_address(CONTRACT_ADDRESS),
+            address=Web3.to_checksum_address(CHAIN.contract_address),
             abi=CONTRACT_ABI
         )
         
@@ -133,40 +114,36 @@ def mint_memory_token(recipient_address: str, metadata: dict) -> str:
         
         token_uri = f"{METADATA_BASE_URL}Qm{metadata['score']}{metadata['metadata_title'][:10]}"
         
-        print(f"   Token URI: {token_uri}")
-        print(f"   接收者: {recipient_address}")
+        log.debug("mint.metadata", metadata=token_metadata, token_uri=token_uri)
         
-        nonce = web3.eth.get_transaction_count(agent_address)
+        nonce = web3.eth.get_transaction_count(agent_address, 'pending')
         
         transaction = contract.functions.mintToken(
             Web3.to_checksum_address(recipient_address),
             token_uri
         ).build_transaction({
-            'chainId': 84532,
+            'chainId': CHAIN.chain_id,
             'gas': 300000,
             'gasPrice': web3.eth.gas_price,
             'nonce': nonce,
         })
         
-        signed_txn = web3.eth.account.sign_transaction(transaction, AGENT_PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        tx_hash_hex = tx_hash.hex()
-        
-        print(f"   交易已发送: {tx_hash_hex}")
-        print(f"   等待确认...")
-        
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        # 超过目标确认时间仍未上链时用同一 nonce 提价替换
+        pending, tx_hash_hex, tx_receipt = supervisor.send_and_wait(
+            web3, CHAIN, transaction, AGENT_PRIVATE_KEY, timeout=120)
+        gas_price = next(a['gas_price'] for a in pending.attempts if a['tx_hash'] == tx_hash_hex)
+        accounting.record_gas(tx_receipt['gasUsed'], tx_receipt.get('effectiveGasPrice', gas_price), CHAIN.key)
         
         if tx_receipt['status'] == 1:
-            print(f"✅ 铸造成功!")
-            print(f"   Gas 使用: {tx_receipt['gasUsed']}")
+            log.info("mint.confirmed", tx_hash=tx_hash_hex, gas_used=tx_receipt['gasUsed'],
+                     token_id=minted_token_id(contract, tx_receipt))
             return tx_hash_hex
         else:
-            print(f"❌ 交易失败")
+            log.error("mint.reverted", tx_hash=tx_hash_hex)
             return None
             
     except Exception as e:
-        print(f"❌ 铸造失败: {str(e)}")
+        log.error("mint.failed", error=str(e))
         raise
 
 
@@ -210,7 +187,7 @@ def run_archivist(story_text: str):
                 print(f"   描述: {evaluation['metadata_description']}")
                 print(f"\n🔗 铸造成功:")
                 print(f"   交易哈希: {tx_hash}")
-                print(f"   浏览器: https://sepolia.basescan.org/tx/{tx_hash}")
+                print(f"   浏览器: {CHAIN.tx_url(tx_hash)}")
                 print("=" * 60)
         except Exception as e:
             print(f"\n❌ 流程中止: 铸造失败 - {str(e)}")
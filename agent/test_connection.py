@@ -1,24 +1,50 @@
 """
 测试脚本：验证环境配置是否正确
+
+用法:
+    python test_connection.py                     # 逐项检查配置
+    python test_connection.py --probe             # 上游延迟探测（默认只探测 LLM）
+    python test_connection.py --probe --samples 50 --concurrency 1,8,32 \
+        --targets rpc,llm --label us-east --json probe_us_east.json
+    python test_connection.py --probe --image     # 同时探测图片生成（每个样本生成一张 1024x1024 图片，会产生费用）
 """
 
 import os
+import sys
+import json
+import time
+import argparse
+import http.client
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
 from dotenv import load_dotenv
 from web3 import Web3
 
+# 将项目根目录添加到 Python 路径，以便导入共享模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmm import chains, simchain
+from dmm.stats import summarize
+
 # 加载环境变量
 load_dotenv()
 
+# Agent 铸造使用的链（见 dmm.chains）
+CHAIN = chains.get(chains.AGENT_CHAIN)
+
 def test_web3_connection():
     """测试 Web3 连接"""
     print("\n🧪 测试 1: Web3 连接")
     print("-" * 50)
     
-    rpc_url = os.getenv("BASE_SEPOLIA_RPC", "https://sepolia.base.org")
+    rpc_url = CHAIN.rpc_urls[0]
     print(f"RPC URL: {rpc_url}")
     
     try:
-        web3 = Web3(Web3.HTTPProvider(rpc_url))
+        web3 = simchain.web3(rpc_url)
         is_connected = web3.is_connected()
         
         if is_connected:
@@ -31,10 +57,10 @@ def test_web3_connection():
             print(f"   Chain ID: {chain_id}")
             print(f"   当前区块高度: {block_number}")
             
-            if chain_id == 84532:
-                print("   ✅ 确认连接到 Base Sepolia 测试网")
+            if chain_id == CHAIN.chain_id:
+                print(f"   ✅ 确认连接到 {CHAIN.name}")
             else:
-                print(f"   ⚠️  警告: Chain ID {chain_id} 不是 Base Sepolia (84532)")
+                print(f"   ⚠️  警告: Chain ID {chain_id} 不是 {CHAIN.name} ({CHAIN.chain_id})")
             
             return True
         else:
@@ -59,7 +85,7 @@ def test_wallet():
         return False
     
     try:
-        web3 = Web3(Web3.HTTPProvider(os.getenv("BASE_SEPOLIA_RPC", "https://sepolia.base.org")))
+        web3 = simchain.web3(CHAIN.rpc_urls[0])
         account = web3.eth.account.from_key(private_key)
         address = account.address
         
@@ -73,7 +99,7 @@ def test_wallet():
         
         if balance_eth < 0.001:
             print("   ⚠️  警告: 余额较低，可能不足以支付 gas 费用")
-            print("   💡 建议: 访问 Base Sepolia Faucet 获取测试 ETH")
+            print(f"   💡 建议: 访问 {CHAIN.name} Faucet 获取测试 ETH")
         else:
             print("   ✅ 余额充足")
         
@@ -89,15 +115,15 @@ def test_contract():
     print("\n🧪 测试 3: 合约配置")
     print("-" * 50)
     
-    contract_address = os.getenv("CONTRACT_ADDRESS")
+    contract_address = CHAIN.contract_address
     
-    if not contract_address or contract_address == "0x0000000000000000000000000000000000000000":
+    if not CHAIN.has_contract:
         print("⚠️  合约地址未配置")
         print("   请先部署合约，然后在 .env 文件中设置 CONTRACT_ADDRESS")
         return False
     
     try:
-        web3 = Web3(Web3.HTTPProvider(os.getenv("BASE_SEPOLIA_RPC", "https://sepolia.base.org")))
+        web3 = simchain.web3(CHAIN.rpc_urls[0])
         
         # 检查地址格式
         if not web3.is_address(contract_address):
@@ -168,6 +194,266 @@ def test_openai():
         return False
 
 
+# ============== 延迟探测 ==============
+
+PROBE_TARGETS = ("rpc", "llm", "image")
+# 默认探测的目标；图片探测每个样本都是一次完整的图片生成，需要 --image 显式开启
+DEFAULT_PROBE_TARGETS = ("llm",)
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+def _redact_url(url):
+    """隐藏 URL 路径中的 API Key，只保留协议和主机名"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _error_in_body(payload):
+    """
+    HTTP 200 的响应体中携带的错误（JSON-RPC 节点用 {"error": {...}} 返回失败），没有错误时返回 None
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    error = data.get("error") if isinstance(data, dict) else None
+    if not error:
+        return None
+    if isinstance(error, dict):
+        return f"JSON-RPC error {error.get('code')}: {error.get('message')}"
+    return f"Error response: {error}"
+
+
+def _probe_request(url, body, headers=None, timeout=60):
+    """
+    在一条全新的连接上发送一次 POST 请求
+
+    分别计量连接建立（TCP + TLS 握手）、首字节和完整响应的耗时，单位毫秒。
+    响应体中带 error 的 2xx 响应（JSON-RPC 错误）计为失败。
+    """
+    parts = urlsplit(url)
+    conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parts.hostname, parts.port, timeout=timeout)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+
+    payload = json.dumps(body).encode("utf-8")
+    request_headers = {"Content-Type": "application/json"}
+    request_headers.update(headers or {})
+
+    try:
+        started = time.perf_counter()
+        conn.connect()
+        connected = time.perf_counter()
+
+        conn.request("POST", path, body=payload, headers=request_headers)
+        response = conn.getresponse()
+        first_byte = time.perf_counter()
+        payload = response.read()
+        finished = time.perf_counter()
+
+        ok = 200 <= response.status < 300
+        error = _error_in_body(payload) if ok else None
+        sample = {
+            "ok": ok and error is None,
+            "status": response.status,
+            "connect_ms": (connected - started) * 1000,
+            "ttfb_ms": (first_byte - connected) * 1000,
+            "request_ms": (finished - connected) * 1000,
+            "total_ms": (finished - started) * 1000
+        }
+        if error:
+            sample["error"] = error
+        return sample
+    except Exception as e:
+        return {
+            "ok": False,
+            "error": f"{type(e).__name__}: {e}",
+            "total_ms": (time.perf_counter() - started) * 1000
+        }
+    finally:
+        conn.close()
+
+
+def _rpc_operations():
+    """RPC 探测项：eth_chainId / eth_blockNumber / eth_getBalance"""
+    rpc_url = CHAIN.rpc_urls[0]
+
+    address = ZERO_ADDRESS
+    private_key = os.getenv("PRIVATE_KEY")
+    if private_key and private_key != "your_private_key_here":
+        try:
+            address = Web3().eth.account.from_key(private_key).address
+        except Exception:
+            pass
+
+    def rpc_body(method, params):
+        return {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+
+    return rpc_url, {
+        "chain_id": rpc_body("eth_chainId", []),
+        "block_number": rpc_body("eth_blockNumber", []),
+        "get_balance": rpc_body("eth_getBalance", [address, "latest"])
+    }, {}
+
+
+def _llm_operations():
+    """LLM 探测项：max_tokens=1 的最小补全请求"""
+    api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+    model = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+    headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+
+    return f"{api_base}/chat/completions", {
+        "chat_completion": {
+            "model": model,
+            "messages": [{"role": "user", "content": "Say 'test'."}],
+            "max_tokens": 1
+        }
+    }, headers
+
+
+def _image_operations():
+    """图片探测项：与 Web 应用相同的 FLUX.1-schnell 请求"""
+    url = os.getenv("IMAGE_API_URL", "https://api.siliconflow.cn/v1/images/generations")
+    headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+
+    return url, {
+        "generate": {
+            "model": "black-forest-labs/FLUX.1-schnell",
+            "prompt": "an old potter by a glowing kiln at night",
+            "image_size": "1024x1024",
+            "batch_size": 1,
+            "num_inference_steps": 20
+        }
+    }, headers
+
+
+def _summarize_samples(samples, wall_seconds):
+    """汇总一组样本：各阶段分位数、错误率和吞吐量"""
+    ok = [s for s in samples if s["ok"]]
+    errors = {}
+    for s in samples:
+        if not s["ok"]:
+            key = s.get("error") or f"HTTP {s.get('status')}"
+            errors[key] = errors.get(key, 0) + 1
+
+    return {
+        "samples": len(samples),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+        "connect_ms": summarize(s["connect_ms"] for s in ok),
+        "ttfb_ms": summarize(s["ttfb_ms"] for s in ok),
+        "request_ms": summarize(s["request_ms"] for s in ok),
+        "total_ms": summarize(s["total_ms"] for s in ok),
+        "errors": errors
+    }
+
+
+def probe_target(name, samples, concurrency_levels, timeout):
+    """对单个上游在每个并发级别下运行 N 个样本"""
+    builders = {"rpc": _rpc_operations, "llm": _llm_operations, "image": _image_operations}
+    url, operations, headers = builders[name]()
+
+    result = {"endpoint": _redact_url(url), "operations": {}}
+    for op_name, body in operations.items():
+        levels = {}
+        for concurrency in concurrency_levels:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                futures = [pool.submit(_probe_request, url, body, headers, timeout) for _ in range(samples)]
+                results = [f.result() for f in futures]
+            wall = time.perf_counter() - started
+            levels[str(concurrency)] = _summarize_samples(results, wall)
+        result["operations"][op_name] = levels
+
+    return result
+
+
+def print_probe_report(report):
+    """以表格形式打印探测结果"""
+    print("\n" + "=" * 96)
+    print(f"📡 上游延迟探测  标签: {report['label']}  样本数: {report['samples']}")
+    print("=" * 96)
+    header = f"{'目标/操作':<26}{'并发':>6}{'成功':>8}{'吞吐(rps)':>11}" \
+             f"{'连接p50':>10}{'请求p50':>10}{'请求p95':>10}{'请求p99':>10}"
+    print(header)
+    print("-" * 96)
+
+    for target, data in report["targets"].items():
+        for op_name, levels in data["operations"].items():
+            for concurrency, stats in levels.items():
+                connect = stats["connect_ms"].get("p50", 0)
+                request = stats["request_ms"]
+                print(f"{target + '.' + op_name:<26}{concurrency:>6}"
+                      f"{stats['ok']:>5}/{stats['samples']:<3}{stats['throughput_rps']:>10}"
+                      f"{connect:>10}{request.get('p50', 0):>10}"
+                      f"{request.get('p95', 0):>10}{request.get('p99', 0):>10}")
+                for error, count in stats["errors"].items():
+                    print(f"{'':<32}⚠️  {count}x {error[:60]}")
+    print("-" * 96)
+    print("单位: 毫秒。连接 = TCP + TLS 握手；请求 = 发送请求到读完响应。")
+
+
+def run_probe(args):
+    """运行延迟探测并输出报告"""
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in PROBE_TARGETS]
+    if unknown:
+        print(f"❌ 未知的探测目标: {', '.join(unknown)}（可选: {', '.join(PROBE_TARGETS)}）")
+        return 1
+    if args.image and "image" not in targets:
+        targets.append("image")
+    elif "image" in targets and not args.image:
+        print("❌ 图片探测的每个样本都会生成一张图片并产生费用，请加上 --image 显式开启")
+        return 1
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    report = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "host": platform.node(),
+        "samples": args.samples,
+        "concurrency": concurrency_levels,
+        "targets": {}
+    }
+
+    for target in targets:
+        print(f"⏱️  探测 {target} ...")
+        report["targets"][target] = probe_target(target, args.samples, concurrency_levels, args.timeout)
+
+    print_probe_report(report)
+
+    if args.json:
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(output)
+            print(f"\n💾 JSON 报告已保存: {args.json}")
+
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Digital Archivist Agent 环境配置测试 / 上游延迟探测")
+    parser.add_argument("--probe", action="store_true", help="运行上游延迟探测而不是配置检查")
+    parser.add_argument("--targets", default=",".join(DEFAULT_PROBE_TARGETS),
+                        help="探测目标，逗号分隔: rpc,llm,image（image 需要同时指定 --image）")
+    parser.add_argument("--image", action="store_true",
+                        help="同时探测图片生成：每个样本生成一张 1024x1024 图片，会产生费用")
+    parser.add_argument("--samples", type=int, default=10, help="每个操作、每个并发级别的样本数")
+    parser.add_argument("--concurrency", default="1,4,16", help="并发级别，逗号分隔")
+    parser.add_argument("--timeout", type=float, default=60, help="单次请求超时（秒）")
+    parser.add_argument("--label", default=os.getenv("PROBE_LABEL", platform.node()),
+                        help="报告标签，例如部署区域或服务商名称")
+    parser.add_argument("--json", metavar="PATH", help="保存 JSON 报告的路径，'-' 表示输出到标准输出")
+    return parser.parse_args(argv)
+
+
 def main():
     """运行所有测试"""
     print("=" * 60)
@@ -218,6 +504,9 @@ def main():
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.probe:
+        sys.exit(run_probe(args))
     main()
 
 
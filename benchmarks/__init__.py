@@ -0,0 +1,3 @@
+"""
+Digital Memory Museum (DMM) 性能基准测试
+"""
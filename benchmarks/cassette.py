@@ -0,0 +1,446 @@
+"""
+上游录制与回放（cassette）
+
+录制：为每个上游（llm / image / rpc）在本地启动一个转发代理，应用指向代理，代理把请求原样转发给
+真实上游，同时把每次交换（请求体、状态码、响应体、耗时）追加写入 <目录>/<上游>.jsonl。
+鉴权请求头不会转写到文件，RPC 地址（可能包含 API Key）也不记录。
+
+回放：用录下的交换启动本地替身服务，按请求内容匹配录制的响应，并按被匹配那次交换的耗时
+（乘以 latency_scale）延迟返回，因此延迟分布与录制时一致：
+    llm     按 (model, messages) 精确匹配；匹配不到时按 (model, 系统提示词) 轮流取，再退到任意一条
+    image   按 (prompt, 尺寸, 步数, batch_size) 精确匹配，再退到 (尺寸, 步数) 和任意一条；
+            返回的图片数按请求的 batch_size 补齐
+    rpc     按 (method, params) 精确匹配，再退到同一 method 轮流取；eth_sendRawTransaction 返回
+            真实的交易哈希，eth_getTransactionReceipt 在录制得到的确认耗时之后才返回回执
+每组候选按录制顺序轮流取，同样的请求序列得到同样的响应和延迟。
+
+用法（在项目根目录）:
+    python -m benchmarks.cassette record cassettes/siliconflow   # 启动录制代理，打印应用需要的环境变量
+    python -m benchmarks.cassette info cassettes/siliconflow     # 各上游的交换数和耗时分布
+    python -m benchmarks.load_test --record cassettes/siliconflow --endpoints evaluate --concurrency 1
+    python -m benchmarks.load_test --replay cassettes/siliconflow --latency-scale 0.5
+
+录制 /api/mint 会在真实网络上发送交易并消耗 gas。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from eth_utils import keccak
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.stubs import LatencyDistribution, StubServer, _StubHandler, _count
+from dmm.stats import summarize
+
+UPSTREAMS = ("llm", "image", "rpc")
+# 转发给上游的请求头（其余如 Host、Content-Length 由 requests 重新生成）
+FORWARD_HEADERS = ("authorization", "content-type", "accept", "user-agent")
+UPSTREAM_TIMEOUT_S = 180
+# 非 JSON 响应只保留开头部分
+MAX_TEXT_CHARS = 2000
+
+
+def recording_targets() -> dict:
+    """
+    真实上游地址，默认值与 dmm.config / dmm.chains 一致
+
+    这里不能导入那两个模块：它们在导入时读取环境变量，而录制需要先把环境变量改成代理地址
+    """
+    alchemy_key = os.getenv("ALCHEMY_API_KEY", "")
+    rpc_urls = [url.strip() for url in os.getenv("SEPOLIA_RPC", "").split(",") if url.strip()]
+    if not rpc_urls:
+        rpc_urls = [f"https://eth-sepolia.g.alchemy.com/v2/{alchemy_key}" if alchemy_key
+                    else "https://ethereum-sepolia-rpc.publicnode.com"]
+    return {
+        "llm": os.getenv("OPENAI_API_BASE", "https://api.siliconflow.cn/v1"),
+        "image": os.getenv("IMAGE_API_URL", "https://api.siliconflow.cn/v1/images/generations"),
+        "rpc": rpc_urls[0]
+    }
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+# ============== 录制 ==============
+
+class CassetteWriter:
+    """按行追加写入交换记录（多个处理线程共用）"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingHandler(_StubHandler):
+    """转发到真实上游并记录交换"""
+
+    def do_POST(self):
+        _count(self.server)
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        headers = {name: value for name, value in self.headers.items() if name.lower() in FORWARD_HEADERS}
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            response = state["session"].post(state["origin"] + self.path, data=raw, headers=headers,
+                                             timeout=UPSTREAM_TIMEOUT_S)
+            status, content = response.status_code, response.content
+            content_type = response.headers.get("Content-Type", "application/json")
+        except requests.RequestException as e:
+            status, content, content_type = 502, json.dumps({"error": str(e)}).encode("utf-8"), "application/json"
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        entry = {
+            "upstream": state["upstream"],
+            "path": None if state["upstream"] == "rpc" else self.path,
+            "started_at": round(started_at, 6),
+            "latency_ms": round(latency_ms, 3),
+            "request": _parse_json(raw),
+            "status": status
+        }
+        payload = _parse_json(content)
+        if payload is not None:
+            entry["response"] = payload
+        else:
+            entry["response_text"] = content.decode("utf-8", "replace")[:MAX_TEXT_CHARS]
+        state["writer"].write(entry)
+
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def _parse_json(data):
+    try:
+        return json.loads(data) if data else None
+    except ValueError:
+        return None
+
+
+class Recorder(StubServer):
+    """一个上游的录制代理；proxy_url 是应用应该使用的地址（保留真实地址的路径部分）"""
+
+    def __init__(self, upstream, target, directory):
+        parts = urlsplit(target)
+        self.target = target
+        self._path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self.writer = CassetteWriter(os.path.join(directory, f"{upstream}.jsonl"))
+        super().__init__(RecordingHandler, LatencyDistribution(), upstream=upstream,
+                         origin=f"{parts.scheme}://{parts.netloc}", session=requests.Session(),
+                         writer=self.writer)
+
+    @property
+    def proxy_url(self) -> str:
+        return self.url + self._path
+
+    def stop(self):
+        super().stop()
+        self.writer.close()
+
+
+def start_recorders(directory, targets=None) -> dict:
+    """为每个上游启动录制代理，返回 {"llm": Recorder, "image": ..., "rpc": ...}"""
+    targets = targets or recording_targets()
+    return {upstream: Recorder(upstream, targets[upstream], directory).start() for upstream in UPSTREAMS}
+
+
+# ============== 回放 ==============
+
+def load(directory) -> dict:
+    """读取录制目录，返回 {上游: [交换记录]}（按开始时间排序）"""
+    exchanges = {}
+    for upstream in UPSTREAMS:
+        path = os.path.join(directory, f"{upstream}.jsonl")
+        entries = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        exchanges[upstream] = sorted(entries, key=lambda entry: entry["started_at"])
+    return exchanges
+
+
+class _Candidates:
+    """按匹配键分组的录制记录，同一组内按录制顺序轮流取"""
+
+    def __init__(self):
+        self._groups = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def add(self, keys, item):
+        for key in keys:
+            self._groups.setdefault(key, []).append(item)
+
+    def group(self, key) -> list:
+        return list(self._groups.get(key, ()))
+
+    def take(self, keys):
+        """依次尝试各个键（从最具体到最宽泛），返回第一个有候选的组中的下一条"""
+        with self._lock:
+            for key in keys:
+                group = self._groups.get(key)
+                if group:
+                    index = self._cursors.get(key, 0)
+                    self._cursors[key] = index + 1
+                    return group[index % len(group)]
+        return None
+
+
+def _recorded_payload(entry):
+    if "response" in entry:
+        return entry["response"]
+    return {"error": entry.get("response_text", "")}
+
+
+class LLMReplayer:
+    """/chat/completions 的回放"""
+
+    def __init__(self, entries):
+        self.candidates = _Candidates()
+        for entry in entries:
+            self.candidates.add(self._keys(entry.get("request") or {}), entry)
+
+    @staticmethod
+    def _keys(body):
+        messages = body.get("messages") or []
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        model = body.get("model")
+        return [("exact", model, _digest(messages)), ("system", model, _digest(system)), ("any",)]
+
+    def replay(self, body):
+        entry = self.candidates.take(self._keys(body))
+        if entry is None:
+            return None
+        return entry["status"], _recorded_payload(entry), entry["latency_ms"]
+
+
+class ImageReplayer:
+    """/images/generations 的回放"""
+
+    def __init__(self, entries):
+        self.candidates = _Candidates()
+        for entry in entries:
+            self.candidates.add(self._keys(entry.get("request") or {}), entry)
+
+    @staticmethod
+    def _keys(body):
+        shape = (body.get("image_size"), body.get("num_inference_steps"))
+        return [("exact", body.get("prompt"), shape, body.get("batch_size", 1)), ("shape", shape), ("any",)]
+
+    def replay(self, body):
+        entry = self.candidates.take(self._keys(body))
+        if entry is None:
+            return None
+        payload = _recorded_payload(entry)
+        images = payload.get("images") if isinstance(payload, dict) else None
+        batch_size = int(body.get("batch_size", 1))
+        if images and len(images) != batch_size:
+            payload = dict(payload, images=[images[i % len(images)] for i in range(batch_size)])
+        return entry["status"], payload, entry["latency_ms"]
+
+
+class RPCReplayer:
+    """
+    JSON-RPC 的回放（支持批量请求）
+
+    交易回执与发送时间相关：从录制中统计每笔交易从发送到第一次查到回执的耗时，回放时
+    新发送的交易在依次取出的确认耗时（乘以 latency_scale）之后才返回回执
+    """
+
+    def __init__(self, entries, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.candidates = _Candidates()
+        self.receipts = _Candidates()
+        self.confirmations = _Candidates()
+        self.pending = {}
+        self._lock = threading.Lock()
+
+        sent = {}
+        for entry in entries:
+            requests_ = entry.get("request")
+            responses = entry.get("response")
+            if not isinstance(requests_, list):
+                requests_, responses = [requests_], [responses]
+            by_id = {item.get("id"): item for item in responses if isinstance(item, dict)}
+            finished_at = entry["started_at"] + entry["latency_ms"] / 1000
+            for request in requests_:
+                if not isinstance(request, dict):
+                    continue
+                response = by_id.get(request.get("id"))
+                if response is None:
+                    continue
+                method, params = request.get("method"), request.get("params") or []
+                self.candidates.add(self._keys(method, params), (response, entry["latency_ms"]))
+                result = response.get("result")
+                if method == "eth_sendRawTransaction" and result:
+                    sent[result] = finished_at
+                elif method == "eth_getTransactionReceipt" and result:
+                    self.receipts.add([("any",)], result)
+                    sent_at = sent.pop(params[0] if params else None, None)
+                    if sent_at is not None:
+                        self.confirmations.add([("any",)], finished_at - sent_at)
+
+    @staticmethod
+    def _keys(method, params):
+        return [("exact", method, _digest(params)), ("method", method)]
+
+    def replay(self, body):
+        items = body if isinstance(body, list) else [body]
+        results, latency_ms = [], 0.0
+        for item in items:
+            response, item_latency = self._dispatch(item)
+            results.append(response)
+            latency_ms = max(latency_ms, item_latency)
+        return 200, results if isinstance(body, list) else results[0], latency_ms
+
+    def _dispatch(self, item):
+        method, params = item.get("method"), item.get("params") or []
+        recorded = self.candidates.take(self._keys(method, params))
+        if recorded is None:
+            return {"jsonrpc": "2.0", "id": item.get("id"),
+                    "error": {"code": -32601, "message": f"No recorded exchange for {method}"}}, 0.0
+        response, latency_ms = recorded
+        response = dict(response, id=item.get("id"))
+
+        if method == "eth_sendRawTransaction" and params and "result" in response:
+            tx_hash = "0x" + keccak(hexstr=params[0]).hex()
+            delay = self.confirmations.take([("any",)]) or 0.0
+            with self._lock:
+                self.pending[tx_hash] = time.monotonic() + delay * self.latency_scale
+            response["result"] = tx_hash
+        elif method == "eth_getTransactionReceipt" and params:
+            with self._lock:
+                ready_at = self.pending.get(params[0])
+            if ready_at is not None:
+                receipt = self.receipts.take([("any",)]) if time.monotonic() >= ready_at else None
+                response = {"jsonrpc": "2.0", "id": item.get("id"),
+                            "result": dict(receipt, transactionHash=params[0]) if receipt else None}
+        return response, latency_ms
+
+
+class ReplayHandler(_StubHandler):
+    """按请求内容返回录制的响应，延迟取自被匹配的交换"""
+
+    def do_POST(self):
+        _count(self.server)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        state = self.server.state
+        replayed = state["replayer"].replay(body)
+        if replayed is None:
+            self.send_json(502, {"error": {"message": f"No recorded {state['upstream']} exchange"}})
+            return
+        status, payload, latency_ms = replayed
+        time.sleep(latency_ms * state["latency_scale"] / 1000.0)
+        self.send_json(status, payload)
+
+
+def start_replayers(directory, latency_scale=1.0) -> dict:
+    """用录制目录启动回放服务，返回与 stubs.start_stubs() 相同结构的字典"""
+    exchanges = load(directory)
+    if not any(exchanges.values()):
+        raise FileNotFoundError(f"No recorded exchanges in {directory}")
+    replayers = {
+        "llm": LLMReplayer(exchanges["llm"]),
+        "image": ImageReplayer(exchanges["image"]),
+        "rpc": RPCReplayer(exchanges["rpc"], latency_scale)
+    }
+    return {upstream: StubServer(ReplayHandler, LatencyDistribution(), upstream=upstream,
+                                 replayer=replayer, latency_scale=latency_scale).start()
+            for upstream, replayer in replayers.items()}
+
+
+# ============== 命令行 ==============
+
+def describe(directory) -> dict:
+    """录制内容概要：各上游（RPC 按 method）的交换数、错误数和耗时分布"""
+    exchanges = load(directory)
+    report = {}
+    for upstream, entries in exchanges.items():
+        if not entries:
+            continue
+        groups = {}
+        for entry in entries:
+            request = entry.get("request")
+            if upstream == "rpc":
+                label = "batch" if isinstance(request, list) else (request or {}).get("method")
+            else:
+                label = (request or {}).get("model") or upstream
+            groups.setdefault(label, []).append(entry)
+        report[upstream] = {
+            label: dict(summarize([entry["latency_ms"] for entry in group]),
+                        errors=sum(1 for entry in group if entry["status"] >= 400))
+            for label, group in groups.items()
+        }
+    confirmations = RPCReplayer(exchanges["rpc"]).confirmations.group(("any",))
+    if confirmations:
+        report["confirmations_s"] = summarize(confirmations)
+    return report
+
+
+def record(args):
+    recorders = start_recorders(args.directory)
+    print(f"🎙️  录制到 {os.path.abspath(args.directory)}，用以下环境变量启动应用（Ctrl+C 结束）:")
+    print(f"    OPENAI_API_BASE={recorders['llm'].proxy_url}")
+    print(f"    IMAGE_API_URL={recorders['image'].proxy_url}")
+    print(f"    SEPOLIA_RPC={recorders['rpc'].proxy_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for recorder in recorders.values():
+            recorder.stop()
+        print(f"\n💾 已录制: { {name: recorder.requests_served for name, recorder in recorders.items()} }")
+    return 0
+
+
+def info(args):
+    print(json.dumps(describe(args.directory), ensure_ascii=False, indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="上游交换的录制与回放")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="启动录制代理")
+    record_parser.add_argument("directory", help="录制目录")
+    record_parser.set_defaults(handler=record)
+    info_parser = commands.add_parser("info", help="查看录制内容概要")
+    info_parser.add_argument("directory", help="录制目录")
+    info_parser.set_defaults(handler=info)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+端到端压测：Web 应用 + 本地模拟上游
+
+启动进程内的 LLM / 图片 / JSON-RPC 模拟服务，把 web/app.py（或 --server asgi 时的 web/asgi.py）指向它们，
+然后对 /api/evaluate、/api/mint、/api/status、/api/examples 施加并发负载，
+输出吞吐量、延迟分位数、错误率和峰值内存。全程离线运行。
+
+用法（在项目根目录）:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --concurrency 1,16,64 --duration 15 \\
+        --llm-latency lognormal:1200,0.5 --image-latency fixed:3000 --json bench.json
+    python -m benchmarks.load_test --server asgi --concurrency 1,64,256
+    python -m benchmarks.load_test --chain simulated --endpoints mint --block-time 1
+
+--chain simulated 时铸造走进程内 EVM（dmm.simchain，需要 eth-tester；没有 MemoryToken 编译产物时
+使用仓库自带的替身合约 contracts/MemoryTokenStandIn.json），
+签名、发送、收据和事件解析都是真实执行的，JSON-RPC 模拟服务只用于其余接口。
+
+--record DIR 时不启动模拟服务，应用经录制代理访问 .env 中配置的真实上游，交换记录写入 DIR；
+--replay DIR 时用录制的响应和延迟代替模拟服务（--latency-scale 缩放延迟），见 benchmarks/cassette.py:
+    python -m benchmarks.load_test --record cassettes/run1 --endpoints evaluate,status --concurrency 1 --duration 60
+    python -m benchmarks.load_test --replay cassettes/run1 --concurrency 1,16,64
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from werkzeug.serving import make_server
+
+# 将项目根目录添加到 Python 路径，以便导入 web.app 和共享模块
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from benchmarks.cassette import start_recorders, start_replayers
+from benchmarks.stubs import start_stubs
+from dmm.stats import summarize
+
+# 压测专用的测试私钥（Hardhat 默认账户 #0，切勿在真实网络使用）
+BENCH_PRIVATE_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+BENCH_CONTRACT_ADDRESS = "0x" + "42" * 20
+
+ENDPOINTS = ("evaluate", "mint", "status", "examples")
+
+SAMPLE_STORY = (
+    "After my grandmother passed away, I found a handwritten recipe book in her old trunk. "
+    "Each page recorded a dish's preparation method, with small drawings she had sketched herself. "
+    "Each dish carried a story, a memory, grandmother's code of love, left for me to decipher."
+)
+
+SAMPLE_METADATA = {
+    "score": 90,
+    "metadata_title": "Grandmother's Recipe Book",
+    "metadata_description": "A handwritten recipe book turns family meals into a record of love across generations.",
+    "image_url": "http://127.0.0.1/img/1.png",
+    "image_prompt": "An old handwritten recipe book on a kitchen table, warm light",
+    "timestamp": "2026-01-01T00:00:00"
+}
+
+
+# ============== 环境与应用 ==============
+
+def configure_environment(stubs, chain="stub", block_time=2.0):
+    """把应用配置指向本地模拟服务（必须在导入 web.app 之前调用）"""
+    if chain == "simulated":
+        os.environ.update({"MINT_CHAINS": "simulated", "SIM_BLOCK_TIME_S": str(block_time)})
+    os.environ.update({
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_API_BASE": f"{stubs['llm'].url}/v1",
+        "IMAGE_API_URL": f"{stubs['image'].url}/v1/images/generations",
+        "SEPOLIA_RPC": stubs["rpc"].url,
+        "ALCHEMY_API_KEY": "bench",
+        "PRIVATE_KEY": BENCH_PRIVATE_KEY,
+        "CONTRACT_ADDRESS": BENCH_CONTRACT_ADDRESS
+    })
+    # 压测时默认只输出警告及以上的日志，可通过 LOG_LEVEL 覆盖
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # 幂等记录不落盘，多次压测之间互不影响
+    os.environ.setdefault("MINT_IDEMPOTENCY_DB", ":memory:")
+
+
+def configure_recording(recorders):
+    """把上游地址指向录制代理，密钥和合约地址保持 .env 中的真实配置（必须在导入 web.app 之前调用）"""
+    os.environ.update({
+        "OPENAI_API_BASE": recorders["llm"].proxy_url,
+        "IMAGE_API_URL": recorders["image"].proxy_url,
+        "SEPOLIA_RPC": recorders["rpc"].proxy_url
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("MINT_IDEMPOTENCY_DB", ":memory:")
+
+
+def start_app(kind="flask"):
+    """在后台线程中启动应用，返回 (server, base_url)；server 提供 shutdown()"""
+    if kind == "asgi":
+        return start_asgi_app()
+
+    from web.app import app
+
+    # 关闭每个请求一行的访问日志，避免干扰报告输出
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class _UvicornServer:
+    """让 uvicorn 与 werkzeug 服务器一样可以通过 shutdown() 停止"""
+
+    def __init__(self, server, thread):
+        self.server = server
+        self.thread = thread
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def start_asgi_app():
+    """在后台线程的事件循环中用 uvicorn 启动 ASGI 应用"""
+    import uvicorn
+    from web.asgi import app
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="error", access_log=False,
+                                           backlog=2048))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started and thread.is_alive():
+        time.sleep(0.05)
+    return _UvicornServer(server, thread), f"http://127.0.0.1:{port}"
+
+
+def current_rss_mb() -> float:
+    """当前常驻内存（仅 Linux 可用，其它平台返回 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb() -> float:
+    """进程峰值常驻内存（macOS 单位为字节，Linux 为 KB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+# ============== 负载 ==============
+
+def _request_factory(base_url, endpoint):
+    """返回一个在给定 Session 上发送单次请求的函数"""
+    if endpoint == "evaluate":
+        # 每个请求的故事略有不同，模拟服务按故事内容给分，分数因此分布在整个区间内
+        counter = itertools.count(1)
+        return lambda s: s.post(f"{base_url}/api/evaluate",
+                                json={"story_text": f"{SAMPLE_STORY}\n\n#{next(counter)}"}, timeout=300)
+    if endpoint == "mint":
+        # 元数据相同，每个请求带不同的 Idempotency-Key，都会发送新交易而不是返回第一次的结果
+        counter = itertools.count(1)
+        return lambda s: s.post(f"{base_url}/api/mint", json={"metadata": SAMPLE_METADATA},
+                                headers={"Idempotency-Key": f"bench-{next(counter)}"}, timeout=300)
+    if endpoint == "status":
+        return lambda s: s.get(f"{base_url}/api/status", timeout=60)
+    return lambda s: s.get(f"{base_url}/api/examples", timeout=60)
+
+
+def run_level(base_url, endpoint, concurrency, duration):
+    """在给定并发下持续压测 duration 秒"""
+    send = _request_factory(base_url, endpoint)
+    deadline = time.perf_counter() + duration
+    latencies, errors = [], {}
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = send(session)
+                error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = type(e).__name__
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+                else:
+                    latencies.append(elapsed)
+        session.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+
+    total = len(latencies) + sum(errors.values())
+    return {
+        "requests": total,
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+        "latency_ms": summarize(latencies),
+        "errors": errors,
+        "rss_mb": current_rss_mb()
+    }
+
+
+def print_report(report):
+    print("\n" + "=" * 92)
+    print(f"🏋️  端到端压测  服务: {report['server']}  链: {report['chain']}  时长/级别: {report['duration']}s")
+    print("=" * 92)
+    print(f"{'endpoint':<12}{'conc':>6}{'reqs':>8}{'rps':>10}{'err%':>8}"
+          f"{'p50':>10}{'p95':>10}{'p99':>10}{'rss MB':>10}")
+    print("-" * 92)
+    for endpoint, levels in report["results"].items():
+        for concurrency, r in levels.items():
+            lat = r["latency_ms"]
+            print(f"{endpoint:<12}{concurrency:>6}{r['requests']:>8}{r['throughput_rps']:>10}"
+                  f"{r['error_rate'] * 100:>7.1f}%{lat.get('p50', 0):>10}{lat.get('p95', 0):>10}"
+                  f"{lat.get('p99', 0):>10}{r['rss_mb']:>10}")
+            for error, count in r["errors"].items():
+                print(f"{'':<18}⚠️  {count}x {error}")
+    print("-" * 92)
+    print(f"峰值 RSS: {report['peak_rss_mb']} MB（包含模拟服务和压测客户端）")
+    print(f"上游请求数: {report['upstream_requests']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DMM 端到端压测（离线，使用本地模拟上游）")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask",
+                        help="被测应用：flask（web/app.py，多线程）或 asgi（web/asgi.py，uvicorn）")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="压测的接口，逗号分隔")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发级别，逗号分隔")
+    parser.add_argument("--duration", type=float, default=10, help="每个接口、每个并发级别的压测时长（秒）")
+    parser.add_argument("--llm-latency", default="lognormal:800,0.35", help="LLM 延迟分布")
+    parser.add_argument("--image-latency", default="lognormal:2500,0.3", help="图片生成延迟分布")
+    parser.add_argument("--rpc-latency", default="lognormal:40,0.3", help="JSON-RPC 延迟分布")
+    parser.add_argument("--chain", choices=("stub", "simulated"), default="stub",
+                        help="铸造使用的链：stub（JSON-RPC 模拟服务）或 simulated（进程内 EVM）")
+    parser.add_argument("--block-time", type=float, default=2.0, help="模拟出块时间（秒）")
+    parser.add_argument("--seed", type=int, default=7, help="随机种子")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="DIR", help="经录制代理访问真实上游，交换记录写入 DIR")
+    cassette.add_argument("--replay", metavar="DIR", help="用 DIR 中录制的响应和延迟代替模拟服务")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="回放延迟的缩放系数")
+    parser.add_argument("--json", metavar="PATH", help="保存 JSON 报告的路径")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        print(f"❌ 未知的接口: {', '.join(unknown)}（可选: {', '.join(ENDPOINTS)}）")
+        return 1
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    if args.record:
+        stubs = start_recorders(args.record)
+        configure_recording(stubs)
+        latency = {"record": args.record}
+    elif args.replay:
+        stubs = start_replayers(args.replay, args.latency_scale)
+        configure_environment(stubs, args.chain, args.block_time)
+        latency = {"replay": args.replay, "scale": args.latency_scale}
+    else:
+        stubs = start_stubs(args.llm_latency, args.image_latency, args.rpc_latency,
+                            block_time=args.block_time, contract_address=BENCH_CONTRACT_ADDRESS,
+                            seed=args.seed)
+        configure_environment(stubs, args.chain, args.block_time)
+        latency = {"llm": args.llm_latency, "image": args.image_latency,
+                   "rpc": args.rpc_latency, "block_time": args.block_time}
+    server, base_url = start_app(args.server)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "server": args.server,
+        "chain": args.chain,
+        "duration": args.duration,
+        "latency": latency,
+        "results": {}
+    }
+
+    try:
+        for endpoint in endpoints:
+            report["results"][endpoint] = {}
+            for concurrency in levels:
+                print(f"⏱️  {endpoint} @ {concurrency} ...")
+                report["results"][endpoint][str(concurrency)] = run_level(
+                    base_url, endpoint, concurrency, args.duration)
+    finally:
+        server.shutdown()
+        for stub in stubs.values():
+            stub.stop()
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    report["upstream_requests"] = {name: stub.requests_served for name, stub in stubs.items()}
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 JSON 报告已保存: {args.json}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
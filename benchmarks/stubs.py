@@ -0,0 +1,339 @@
+"""
+进程内上游模拟服务
+
+为压测提供本地的 LLM（OpenAI 兼容）、图片生成（SiliconFlow 兼容）和
+以太坊 JSON-RPC 服务。每个服务的响应延迟按可配置的分布随机抽样，
+不需要任何网络或真实密钥。
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_utils import keccak
+
+
+# ============== 延迟分布 ==============
+
+class LatencyDistribution:
+    """
+    延迟分布，单位毫秒
+
+    规格字符串格式:
+        fixed:50              固定 50ms
+        uniform:20,80         20-80ms 均匀分布
+        normal:100,20         均值 100ms、标准差 20ms 的正态分布
+        lognormal:800,0.4     中位数 800ms、sigma 0.4 的对数正态分布（长尾）
+        exp:200               均值 200ms 的指数分布
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: int = None):
+        self.spec = spec
+        self.kind, _, args = spec.partition(":")
+        self.args = [float(a) for a in args.split(",") if a.strip()]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+        if self.kind not in expected or len(self.args) != expected[self.kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                value = self.args[0]
+            elif self.kind == "uniform":
+                value = self._random.uniform(*self.args)
+            elif self.kind == "normal":
+                value = self._random.gauss(*self.args)
+            elif self.kind == "lognormal":
+                median, sigma = self.args
+                value = median * self._random.lognormvariate(0, sigma)
+            else:
+                value = self._random.expovariate(1.0 / self.args[0])
+        return max(value, 0.0)
+
+    def sleep(self):
+        time.sleep(self.sample_ms() / 1000.0)
+
+    def __repr__(self):
+        return f"LatencyDistribution({self.spec!r})"
+
+
+# ============== 基础服务 ==============
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """JSON POST 处理基类，子类实现 handle_json()"""
+
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭 Nagle 避免与客户端延迟 ACK 叠加出 40ms 的假延迟
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        time.sleep(self.server.latency.sample_ms() * self.latency_scale(body) / 1000.0)
+        status, payload = self.handle_json(self.path, body)
+        self.send_json(status, payload)
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端超时或被取消后提前断开，属于正常情况
+            self.close_connection = True
+
+    def do_GET(self):
+        # 图片 URL 指向的静态资源，返回一个最小的 PNG 头即可
+        data = b"\x89PNG\r\n\x1a\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_json(self, path, body):
+        raise NotImplementedError
+
+    def latency_scale(self, body) -> float:
+        """按请求内容缩放抽样得到的延迟，默认不缩放"""
+        return 1.0
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """在后台线程中运行的本地模拟服务"""
+
+    def __init__(self, handler_cls, latency: LatencyDistribution, **state):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.state = state
+        self.httpd.state_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests_served(self) -> int:
+        return self.httpd.state.get("requests", 0)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _count(server):
+    with server.state_lock:
+        server.state["requests"] = server.state.get("requests", 0) + 1
+
+
+# ============== LLM ==============
+
+class LLMHandler(_StubHandler):
+    """
+    OpenAI 兼容的 /chat/completions，返回固定结构的评估 JSON
+
+    同一个故事有固定的基准分（由内容哈希决定），完整评估和预筛
+    （系统提示词包含 "screening"）分别在基准分上加不同大小的噪声，
+    因此两者相关但不完全一致，可用于验证级联评估的一致率统计。
+    """
+
+    def handle_json(self, path, body):
+        _count(self.server)
+        if not path.endswith("/chat/completions"):
+            return 404, {"error": {"message": f"Unknown path {path}"}}
+
+        state = self.server.state
+        messages = body.get("messages") or []
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        story = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+
+        low, high = state["score_range"]
+        base = low + int.from_bytes(keccak(text=story)[:4], "big") % (high - low + 1)
+        with self.server.state_lock:
+            screen_noise = state["random"].gauss(0, 8)
+            full_noise = state["random"].gauss(0, 3)
+            variation = state["random"].randint(1, 10 ** 6)
+
+        if "screening" in system:
+            score = max(0, min(100, round(base + screen_noise)))
+            return 200, self._completion(body, json.dumps({"score": score}), 180, 6)
+
+        score = max(0, min(100, round(base + full_noise)))
+        content = json.dumps({
+            "score": score,
+            "metadata_title": "The Potter's Final Masterpiece",
+            "metadata_description": "An elderly potter fires his last kiln, preserving a dying craft and a lifetime of memory.",
+            "feedback": "Strong emotional core and cultural value; the narrative arc is complete and moving.",
+            # 每次返回不同的提示词，避免图片缓存让压测结果失真
+            "image_prompt": f"An old potter beside a glowing kiln on a rainy night, warm firelight, serene #{variation}"
+        })
+        return 200, self._completion(body, content, 420, 160)
+
+    def _completion(self, body, content, prompt_tokens, completion_tokens):
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+
+# ============== 图片生成 ==============
+
+class ImageHandler(_StubHandler):
+    """
+    SiliconFlow 兼容的 /images/generations
+
+    配置的延迟对应 1024x1024、20 步的单张图片，实际延迟按步数和像素数线性缩放
+    """
+
+    def latency_scale(self, body) -> float:
+        width, _, height = str(body.get("image_size", "1024x1024")).partition("x")
+        try:
+            pixels = int(width) * int(height or width)
+        except ValueError:
+            pixels = 1024 * 1024
+        steps = int(body.get("num_inference_steps", 20))
+        return max(steps / 20 * pixels / (1024 * 1024), 0.05)
+
+    def handle_json(self, path, body):
+        _count(self.server)
+        base = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        with self.server.state_lock:
+            self.server.state["images"] = self.server.state.get("images", 0) + 1
+            index = self.server.state["images"]
+
+        batch_size = int(body.get("batch_size", 1))
+        return 200, {
+            "images": [{"url": f"{base}/img/{index}-{i}.png"} for i in range(batch_size)],
+            "timings": {"inference": 0.1},
+            "seed": index
+        }
+
+
+# ============== JSON-RPC ==============
+
+class RPCHandler(_StubHandler):
+    """
+    最小以太坊 JSON-RPC 节点
+
+    交易发送后经过 block_time 秒才返回回执，用于模拟出块等待
+    """
+
+    def handle_json(self, path, body):
+        if isinstance(body, list):
+            return 200, [self._dispatch(item) for item in body]
+        return 200, self._dispatch(body)
+
+    def _dispatch(self, request):
+        _count(self.server)
+        method = request.get("method")
+        params = request.get("params") or []
+        handler = getattr(self, f"rpc_{method}", None)
+        if handler is None:
+            return {"jsonrpc": "2.0", "id": request.get("id"),
+                    "error": {"code": -32601, "message": f"Method not found: {method}"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": handler(*params)}
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _block_number(self):
+        return self.state["start_block"] + int((time.time() - self.state["started_at"]) / self.state["block_time"])
+
+    def rpc_web3_clientVersion(self):
+        return "DMM-Stub/1.0"
+
+    def rpc_net_version(self):
+        return str(self.state["chain_id"])
+
+    def rpc_eth_chainId(self):
+        return hex(self.state["chain_id"])
+
+    def rpc_eth_blockNumber(self):
+        return hex(self._block_number())
+
+    def rpc_eth_getBalance(self, address, block="latest"):
+        return hex(10 ** 18)
+
+    def rpc_eth_gasPrice(self):
+        return hex(1_500_000_000)
+
+    def rpc_eth_getTransactionCount(self, address, block="latest"):
+        with self.server.state_lock:
+            return hex(self.state["nonce"])
+
+    def rpc_eth_sendRawTransaction(self, raw):
+        tx_hash = "0x" + keccak(hexstr=raw).hex()
+        with self.server.state_lock:
+            self.state["nonce"] += 1
+            self.state["pending"][tx_hash] = time.time()
+        return tx_hash
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash):
+        with self.server.state_lock:
+            sent_at = self.state["pending"].get(tx_hash)
+        if sent_at is None or time.time() - sent_at < self.state["block_time"]:
+            return None
+
+        block_number = self._block_number()
+        return {
+            "transactionHash": tx_hash,
+            "transactionIndex": "0x0",
+            "blockHash": "0x" + keccak(text=str(block_number)).hex(),
+            "blockNumber": hex(block_number),
+            "from": "0x" + "11" * 20,
+            "to": self.state["contract_address"],
+            "cumulativeGasUsed": hex(180_000),
+            "gasUsed": hex(180_000),
+            "effectiveGasPrice": hex(1_500_000_000),
+            "contractAddress": None,
+            "logs": [],
+            "logsBloom": "0x" + "00" * 256,
+            "status": "0x1",
+            "type": "0x0"
+        }
+
+
+# ============== 组装 ==============
+
+def start_stubs(llm_latency="lognormal:800,0.35", image_latency="lognormal:2500,0.3",
+                rpc_latency="lognormal:40,0.3", block_time=2.0, chain_id=11155111,
+                contract_address="0x" + "42" * 20, score_range=(60, 95), seed=7) -> dict:
+    """启动全部模拟服务，返回 {"llm": StubServer, "image": ..., "rpc": ...}"""
+    return {
+        "llm": StubServer(LLMHandler, LatencyDistribution(llm_latency, seed),
+                          random=random.Random(seed), score_range=score_range).start(),
+        "image": StubServer(ImageHandler, LatencyDistribution(image_latency, seed)).start(),
+        "rpc": StubServer(RPCHandler, LatencyDistribution(rpc_latency, seed),
+                          chain_id=chain_id, block_time=block_time, start_block=5_000_000,
+                          started_at=time.time(), nonce=0, pending={},
+                          contract_address=contract_address).start()
+    }
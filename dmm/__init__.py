@@ -0,0 +1,11 @@
+"""
+Digital Memory Museum (DMM) | 数字记忆博物馆 - 共享模块
+Web 应用（web/app.py、web/asgi.py）与 Agent（agent/*.py）共用的评估、计量等逻辑
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+# 各模块在导入时读取环境变量，因此在这里最先加载项目根目录的 .env
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
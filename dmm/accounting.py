@@ -0,0 +1,379 @@
+"""
+用量与费用核算
+
+按请求和客户端记录每次上游调用的消耗：LLM 的输入/输出/缓存 token、图片生成张数、
+铸造交易的 gas，按配置的单价折算为美元写入本地 SQLite，并在调用昂贵的上游接口之前
+检查客户端和全局在滚动窗口内的花费是否超出预算。
+
+明细由后台线程批量写入（与 dmm.archive 相同），记录用量不会阻塞请求线程或 ASGI 事件循环；
+尚未写入的明细在预算检查时一并计入。预算检查本身读取 SQLite，ASGI 版本在线程池中调用。
+
+客户端标识默认是连接地址。请求头都可以由调用方任意填写，轮换它们就能每次拿到新的预算，因此：
+- X-Client-Key 只有与 CLIENT_KEYS 中配置的密钥匹配时才生效，客户端记为该密钥对应的名称
+- X-Forwarded-For 只在配置了 TRUSTED_PROXY_HOPS（应用前面的可信代理层数）时使用，
+  取从右数第 N 个地址（由最外层可信代理写入），更靠左的部分可由调用方伪造，一律忽略
+命令行 Agent 等没有请求上下文的调用记为 ACCOUNTING_DEFAULT_CLIENT。
+当前请求的客户端保存在 contextvars 中，多线程（Flask）和协程（ASGI）下都互不干扰；
+后台任务需用 client_scope() 显式绑定发起请求的客户端。
+
+环境变量:
+    ACCOUNTING_DB              SQLite 文件路径，默认 :memory:（仅当前进程）；
+                               Web 应用和 Agent 指向同一文件时可在管理接口看到全部花费
+    ACCOUNTING_RETENTION_S     明细保留时间（秒），默认 604800（7 天）
+    ACCOUNTING_DEFAULT_CLIENT  没有请求上下文时的客户端标识，默认 local
+    CLIENT_KEYS                客户端密钥，JSON，{"<密钥>": "<客户端名称>"}，默认不配置
+    TRUSTED_PROXY_HOPS         应用前面的可信反向代理层数（如 Vercel、Nginx 为 1），默认 0（不信任 X-Forwarded-For）
+    MODEL_PRICES               各模型单价（美元/百万 token），JSON，
+                               如 {"Qwen/Qwen3-Next-80B-A3B-Instruct": {"input": 0.14, "output": 0.57, "cached": 0.07}}
+    IMAGE_PRICE_USD            每张图片的价格（美元），默认 0
+    ETH_PRICE_USD              gas 折算价格（美元/ETH），默认 0（测试网）
+    BUDGET_WINDOW_S            预算的滚动窗口（秒），默认 86400
+    CLIENT_BUDGET_USD          单个客户端在窗口内的预算，0 表示不限，默认 0
+    GLOBAL_BUDGET_USD          所有客户端在窗口内的总预算，0 表示不限，默认 0
+"""
+
+import atexit
+import contextvars
+import hmac
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from dmm import metrics
+from dmm.log import get_logger
+
+log = get_logger("accounting")
+
+ACCOUNTING_DB = os.getenv("ACCOUNTING_DB", ":memory:")
+ACCOUNTING_RETENTION_S = float(os.getenv("ACCOUNTING_RETENTION_S", str(7 * 86400)))
+ACCOUNTING_DEFAULT_CLIENT = os.getenv("ACCOUNTING_DEFAULT_CLIENT", "local")
+CLIENT_KEYS = json.loads(os.getenv("CLIENT_KEYS", "{}") or "{}")
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+MODEL_PRICES = json.loads(os.getenv("MODEL_PRICES", "{}") or "{}")
+IMAGE_PRICE_USD = float(os.getenv("IMAGE_PRICE_USD", "0"))
+ETH_PRICE_USD = float(os.getenv("ETH_PRICE_USD", "0"))
+BUDGET_WINDOW_S = float(os.getenv("BUDGET_WINDOW_S", "86400"))
+CLIENT_BUDGET_USD = float(os.getenv("CLIENT_BUDGET_USD", "0"))
+GLOBAL_BUDGET_USD = float(os.getenv("GLOBAL_BUDGET_USD", "0"))
+
+CLIENT_HEADER = "X-Client-Key"
+MAX_CLIENT_ID_LENGTH = 64
+# 每写入这么多条记录清理一次过期明细
+PRUNE_EVERY = 500
+# 后台线程单个事务写入的最大条数
+WRITE_BATCH_MAX = 200
+
+COST_USD = metrics.REGISTRY.counter(
+    "dmm_cost_usd_total", "Estimated upstream spend in USD", ("kind",))
+BUDGET_REJECTIONS = metrics.REGISTRY.counter(
+    "dmm_budget_rejections_total", "Requests rejected because a budget was exhausted", ("scope",))
+
+
+class BudgetExceeded(Exception):
+    """客户端或全局预算已用完，在调用上游之前抛出"""
+
+    status_code = 429
+
+    def __init__(self, scope, client, spent, limit):
+        self.scope = scope
+        self.client = client
+        self.spent = spent
+        self.limit = limit
+        super().__init__(f"{scope} budget exhausted: ${spent:.4f} of ${limit:.4f} "
+                         f"in the last {BUDGET_WINDOW_S:.0f}s")
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "Budget exceeded",
+            "scope": self.scope,
+            "spent_usd": round(self.spent, 6),
+            "budget_usd": self.limit,
+            "window_s": BUDGET_WINDOW_S
+        }
+
+
+def authenticated_client(client_key):
+    """X-Client-Key 与 CLIENT_KEYS 中的某个密钥匹配时返回对应的客户端名称，否则返回 None"""
+    if not client_key:
+        return None
+    for key, name in CLIENT_KEYS.items():
+        if hmac.compare_digest(str(client_key), str(key)):
+            return str(name)
+    return None
+
+
+def client_address(forwarded_for=None, remote_addr=None):
+    """
+    客户端地址：没有可信代理时就是连接地址；配置了 TRUSTED_PROXY_HOPS 时
+    取 X-Forwarded-For 从右数第 TRUSTED_PROXY_HOPS 个地址（地址数不足时视为伪造，使用连接地址）
+    """
+    if TRUSTED_PROXY_HOPS > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",")]
+        if len(hops) >= TRUSTED_PROXY_HOPS and hops[-TRUSTED_PROXY_HOPS]:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return remote_addr
+
+
+def client_id(client_key=None, forwarded_for=None, remote_addr=None) -> str:
+    """已认证的客户端密钥优先，否则使用客户端地址（见 client_address）"""
+    candidate = authenticated_client(client_key) or (client_address(forwarded_for, remote_addr) or "").strip()
+    return candidate[:MAX_CLIENT_ID_LENGTH] if candidate else ACCOUNTING_DEFAULT_CLIENT
+
+
+# ============== 请求上下文 ==============
+
+_current = contextvars.ContextVar("dmm_accounting", default=None)
+
+
+def start(client, endpoint=None):
+    """在请求开始时调用"""
+    _current.set((client, endpoint))
+
+
+def finish():
+    _current.set(None)
+
+
+def current_client() -> str:
+    context = _current.get()
+    return context[0] if context else ACCOUNTING_DEFAULT_CLIENT
+
+
+def _current_endpoint():
+    context = _current.get()
+    return context[1] if context else None
+
+
+@contextmanager
+def client_scope(client, endpoint="background"):
+    """在后台任务中绑定发起请求的客户端"""
+    token = _current.set((client, endpoint))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+# ============== 单价 ==============
+
+def llm_cost(model, stats) -> float:
+    """按 MODEL_PRICES 折算一次 LLM 调用的费用；缓存命中部分按 cached 单价计"""
+    prices = MODEL_PRICES.get(model) or {}
+    input_price = float(prices.get("input", 0))
+    cached_price = float(prices.get("cached", input_price))
+    cached = stats.get("cache_read_tokens", 0)
+    uncached = max(0, stats.get("input_tokens", 0) - cached)
+    return (uncached * input_price + cached * cached_price
+            + stats.get("output_tokens", 0) * float(prices.get("output", 0))) / 1_000_000
+
+
+def gas_cost(gas_used, gas_price_wei) -> float:
+    return gas_used * gas_price_wei / 1e18 * ETH_PRICE_USD
+
+
+# ============== 本地存储 ==============
+
+class Ledger:
+    """SQLite 明细表，按时间和客户端索引，用于滚动窗口汇总；写入由后台线程完成"""
+
+    def __init__(self, path=ACCOUNTING_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 已提交给写入线程、尚未写入的明细，预算检查时一并计入
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._queue = None
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            # 多个进程（Web 应用、Agent）可以同时写入同一个文件
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS usage_events (
+                ts REAL NOT NULL,
+                client TEXT NOT NULL,
+                endpoint TEXT,
+                kind TEXT NOT NULL,
+                model TEXT,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                images INTEGER NOT NULL DEFAULT 0,
+                gas_used INTEGER NOT NULL DEFAULT 0,
+                cost_usd REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS usage_events_ts ON usage_events (ts);
+            CREATE INDEX IF NOT EXISTS usage_events_client_ts ON usage_events (client, ts);
+        """)
+
+    def add(self, **event):
+        """记录一条明细，写入在后台完成"""
+        event.setdefault("ts", time.time())
+        with self._pending_lock:
+            if self._queue is None:
+                # 第一次写入时才启动线程（预加载后 fork 的 worker 中也能正常写入）
+                self._queue = queue.Queue()
+                threading.Thread(target=self._write_loop, name="accounting-writer", daemon=True).start()
+            self._pending.append(event)
+        self._queue.put(event)
+
+    def flush(self):
+        """等待已提交的明细全部写入"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                log.warning("accounting.write_failed", error=str(e), batch=len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit(self, events):
+        """在一个事务中写入一批明细；无论成功与否都从待写入列表中移除"""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                try:
+                    for event in events:
+                        columns = ", ".join(event)
+                        placeholders = ", ".join("?" for _ in event)
+                        self._conn.execute(f"INSERT INTO usage_events ({columns}) VALUES ({placeholders})",
+                                           tuple(event.values()))
+                    if (self._writes + len(events)) // PRUNE_EVERY > self._writes // PRUNE_EVERY:
+                        self._conn.execute("DELETE FROM usage_events WHERE ts < ?",
+                                           (time.time() - ACCOUNTING_RETENTION_S,))
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._writes += len(events)
+            finally:
+                # 与 spend() 共用 self._lock：明细要么在表中，要么在待写入列表中，不会重复或遗漏
+                written = {id(event) for event in events}
+                with self._pending_lock:
+                    self._pending = [event for event in self._pending if id(event) not in written]
+
+    def spend(self, window, client=None) -> float:
+        since = time.time() - window
+        with self._lock:
+            if client is None:
+                row = self._conn.execute(
+                    "SELECT COALESCE(SUM(cost_usd), 0) FROM usage_events WHERE ts >= ?", (since,)).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT COALESCE(SUM(cost_usd), 0) FROM usage_events WHERE client = ? AND ts >= ?",
+                    (client, since)).fetchone()
+            with self._pending_lock:
+                pending = sum(event.get("cost_usd", 0) for event in self._pending
+                              if event["ts"] >= since and (client is None or event["client"] == client))
+        return row[0] + pending
+
+    def summary(self, window, limit=50) -> dict:
+        """滚动窗口内按服务类型和客户端汇总"""
+        since = time.time() - window
+        totals = ("COUNT(*) AS calls, SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens, "
+                  "SUM(cached_tokens) AS cached_tokens, SUM(images) AS images, SUM(gas_used) AS gas_used, "
+                  "SUM(cost_usd) AS cost_usd")
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT kind, model, {totals} FROM usage_events WHERE ts >= ? "
+                "GROUP BY kind, model ORDER BY cost_usd DESC", (since,))
+            by_kind = _rows(cursor)
+            cursor = self._conn.execute(
+                f"SELECT client, {totals} FROM usage_events WHERE ts >= ? "
+                "GROUP BY client ORDER BY cost_usd DESC, calls DESC LIMIT ?", (since, limit))
+            by_client = _rows(cursor)
+        return {"by_kind": by_kind, "by_client": by_client}
+
+
+def _rows(cursor):
+    names = [column[0] for column in cursor.description]
+    rows = []
+    for values in cursor.fetchall():
+        row = dict(zip(names, values))
+        row["cost_usd"] = round(row["cost_usd"] or 0, 6)
+        rows.append(row)
+    return rows
+
+
+ledger = Ledger()
+atexit.register(ledger.flush)
+
+
+# ============== 记录与预算 ==============
+
+def _record(kind, cost, **fields):
+    ledger.add(client=current_client(), endpoint=_current_endpoint(), kind=kind, cost_usd=cost, **fields)
+    COST_USD.inc(cost, kind=kind)
+
+
+def record_llm(model, stats):
+    """记录一次 LLM 调用，stats 为 usage.record_usage 返回的统一用量字典"""
+    _record("llm", llm_cost(model, stats), model=model,
+            input_tokens=stats.get("input_tokens", 0),
+            output_tokens=stats.get("output_tokens", 0),
+            cached_tokens=stats.get("cache_read_tokens", 0))
+
+
+def record_image(model, count=1):
+    _record("image", count * IMAGE_PRICE_USD, model=model, images=count)
+
+
+def record_gas(gas_used, gas_price_wei, chain="eth"):
+    _record("gas", gas_cost(gas_used, gas_price_wei), model=chain, gas_used=gas_used)
+
+
+def budgets_enabled() -> bool:
+    return CLIENT_BUDGET_USD > 0 or GLOBAL_BUDGET_USD > 0
+
+
+def check_budget(estimate_usd=0.0, client=None):
+    """在调用上游之前检查预算：已花费加上本次预估超过预算时抛出 BudgetExceeded"""
+    if not budgets_enabled():
+        return
+    client = client or current_client()
+    if CLIENT_BUDGET_USD > 0:
+        spent = ledger.spend(BUDGET_WINDOW_S, client)
+        if spent + estimate_usd > CLIENT_BUDGET_USD:
+            BUDGET_REJECTIONS.inc(scope="client")
+            raise BudgetExceeded("client", client, spent, CLIENT_BUDGET_USD)
+    if GLOBAL_BUDGET_USD > 0:
+        spent = ledger.spend(BUDGET_WINDOW_S)
+        if spent + estimate_usd > GLOBAL_BUDGET_USD:
+            BUDGET_REJECTIONS.inc(scope="global")
+            raise BudgetExceeded("global", client, spent, GLOBAL_BUDGET_USD)
+
+
+def snapshot(window=BUDGET_WINDOW_S) -> dict:
+    """管理接口：滚动窗口内的花费汇总与预算配置（先等待待写入的明细写完）"""
+    ledger.flush()
+    summary = ledger.summary(window)
+    return {
+        "window_s": window,
+        "total_cost_usd": round(sum(row["cost_usd"] for row in summary["by_kind"]), 6),
+        "budgets": {
+            "window_s": BUDGET_WINDOW_S,
+            "client_usd": CLIENT_BUDGET_USD or None,
+            "global_usd": GLOBAL_BUDGET_USD or None,
+            "global_spent_usd": round(ledger.spend(BUDGET_WINDOW_S), 6)
+        },
+        **summary
+    }
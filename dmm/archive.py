@@ -0,0 +1,486 @@
+"""
+评估结果归档与全文检索
+
+每次 /api/evaluate 的结果（故事原文、分数、反馈、标题、描述、图片提示词）都写入本地 SQLite，
+图片生成、按需反馈和铸造成功后补上图片地址、反馈与交易哈希。标题、描述和故事正文建立 FTS5 索引（bm25 排序，
+标题权重最高），分数和时间建立普通索引，/api/search 按关键词检索并按分数、日期过滤。
+
+中文、日文、韩文没有空格分词，unicode61 分词器会把整段当作一个词。写入索引前把连续的 CJK 字符
+切成重叠的二元组（"祖母的菜谱" → "祖母 母的 的菜 菜谱 谱"），查询时同样切分后作为短语匹配，
+单字查询用前缀匹配；其余文本交给 porter + unicode61（不区分大小写和变音符号，英文词干归一）。
+FTS 表不保存原文（content=''），正文只在 stories 表中存一份。
+
+写入由后台线程批量提交，不占用请求路径；读取使用每个线程各自的连接（WAL 模式下与写入互不阻塞）。
+数据库在第一次读写时才打开（导入模块不创建文件和线程）；无法打开时（例如只读文件系统）
+记录一次错误并停用归档：写入被丢弃，检索和导出返回空结果，评估和铸造不受影响。
+
+环境变量:
+    ARCHIVE_DB          SQLite 文件路径，默认 <DATA_DIR>/archive.db（见 dmm.paths）；:memory: 表示只保存在当前进程
+    ARCHIVE_BATCH_MAX   后台线程单个事务写入的最大条数，默认 200
+    SEARCH_PAGE_MAX     /api/search 每页的最大条数，默认 50
+"""
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from dmm import metrics, paths
+from dmm.log import get_logger
+
+log = get_logger("archive")
+
+ARCHIVE_DB = paths.data_path(os.getenv("ARCHIVE_DB"), "archive.db")
+ARCHIVE_BATCH_MAX = int(os.getenv("ARCHIVE_BATCH_MAX", "200"))
+SEARCH_PAGE_MAX = int(os.getenv("SEARCH_PAGE_MAX", "50"))
+
+# bm25 列权重：标题、描述、正文
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+# 单次查询最多使用的关键词数
+MAX_QUERY_TERMS = 16
+EXCERPT_CHARS = 160
+
+ARCHIVED = metrics.REGISTRY.counter(
+    "dmm_archive_writes_total", "Archive writes committed by the background writer", ("op",))
+WRITE_FAILURES = metrics.REGISTRY.counter(
+    "dmm_archive_write_failures_total", "Archive writes dropped after failing on their own", ("op",))
+SEARCH_SECONDS = metrics.REGISTRY.histogram(
+    "dmm_search_seconds", "Archive search latency", ("kind",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+# 平假名/片假名、CJK 统一表意文字（含扩展 A）、兼容表意文字、韩文音节
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+_QUERY_TOKEN = re.compile(f"[{_CJK}]+|[^\\W_{_CJK}]+")
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS stories (
+        id INTEGER PRIMARY KEY,
+        evaluation_id TEXT NOT NULL UNIQUE,
+        created_at REAL NOT NULL,
+        client TEXT,
+        score INTEGER,
+        should_mint INTEGER NOT NULL DEFAULT 0,
+        screened INTEGER NOT NULL DEFAULT 0,
+        title TEXT,
+        description TEXT,
+        feedback TEXT,
+        story TEXT NOT NULL,
+        image_prompt TEXT,
+        image_url TEXT,
+        chain TEXT,
+        tx_hash TEXT,
+        token_id INTEGER,
+        minted_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS stories_created ON stories (created_at);
+    CREATE INDEX IF NOT EXISTS stories_score_created ON stories (score, created_at);
+    CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+        title, description, story,
+        content='',
+        tokenize='porter unicode61 remove_diacritics 2'
+    );
+"""
+
+# 写入后可以补充的字段
+UPDATABLE_FIELDS = ("feedback", "image_url", "chain", "tx_hash", "token_id", "minted_at")
+RESULT_FIELDS = ("evaluation_id", "created_at", "score", "should_mint", "screened", "title",
+                 "description", "feedback", "image_prompt", "image_url", "chain", "tx_hash", "token_id")
+
+
+# ============== CJK 分词 ==============
+
+def _bigrams(run):
+    if len(run) == 1:
+        return [run]
+    # 末字单独再出现一次，保证每个字都是某个词的开头，单字查询可以用前缀匹配
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def segment(text) -> str:
+    """索引前的切分：连续的 CJK 字符切成重叠二元组，其余文本原样保留"""
+    if not text:
+        return ""
+    return _CJK_RUN.sub(lambda m: " " + " ".join(_bigrams(m.group())) + " ", text)
+
+
+def terms(text) -> list:
+    """文本中的词：英文等按词（小写），CJK 按二元组（单字保留为一个词）"""
+    result = []
+    for token in _QUERY_TOKEN.findall(text or ""):
+        if _CJK_RUN.fullmatch(token):
+            result.extend(token[i:i + 2] for i in range(max(1, len(token) - 1)))
+        else:
+            result.append(token.lower())
+    return result
+
+
+def build_match(query) -> str:
+    """
+    把用户输入转换为 FTS5 查询表达式
+
+    每个词都必须出现（隐式 AND）；CJK 词按二元组短语匹配，单字按前缀匹配；
+    所有词都加引号，用户输入中的 FTS5 语法字符不会生效
+    """
+    terms = []
+    for token in _QUERY_TOKEN.findall(query or "")[:MAX_QUERY_TERMS]:
+        if _CJK_RUN.fullmatch(token):
+            if len(token) == 1:
+                terms.append(f'"{token}"*')
+            else:
+                terms.append('"' + " ".join(token[i:i + 2] for i in range(len(token) - 1)) + '"')
+        else:
+            terms.append(f'"{token}"')
+    return " ".join(terms)
+
+
+def excerpt(story, query, length=EXCERPT_CHARS) -> str:
+    """以第一个命中的关键词为中心截取正文片段"""
+    story = story or ""
+    lowered = story.lower()
+    position = -1
+    for token in _QUERY_TOKEN.findall(query or ""):
+        position = lowered.find(token.lower())
+        if position >= 0:
+            break
+    start = max(0, position - length // 3) if position >= 0 else 0
+    text = story[start:start + length]
+    return ("…" if start > 0 else "") + text + ("…" if start + length < len(story) else "")
+
+
+def parse_time(value, end_of_day=False):
+    """
+    接受 Unix 时间戳或 ISO 日期/时间，返回时间戳；无法解析时抛出 ValueError
+
+    end_of_day 为 True 时只有日期的值取当天结束（用于 until，使 until=2026-01-31 包含当天）
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    value = str(value)
+    timestamp = datetime.fromisoformat(value).timestamp()
+    if end_of_day and len(value) == 10:
+        timestamp += 86400
+    return timestamp
+
+
+# ============== 存储 ==============
+
+class Archive:
+    """SQLite 归档：后台线程批量写入，请求线程各自的连接读取"""
+
+    def __init__(self, path=ARCHIVE_DB, batch_max=ARCHIVE_BATCH_MAX):
+        self.path = path
+        self.batch_max = batch_max
+        # :memory: 数据库只能通过同一个连接访问，读写共用连接并加锁
+        self._shared = path == ":memory:"
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = None
+        self._queue = None
+        self._failed = False
+
+    def _open(self) -> bool:
+        """第一次使用时打开数据库并启动写入线程；无法打开时停用归档，返回是否可用"""
+        if self._conn is not None:
+            return True
+        with self._open_lock:
+            if self._conn is None and not self._failed:
+                try:
+                    if not self._shared:
+                        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    conn = self._connect()
+                    conn.executescript(_SCHEMA)
+                except (OSError, sqlite3.Error) as e:
+                    self._failed = True
+                    log.error("archive.unavailable", path=self.path, error=str(e))
+                    return False
+                self._queue = queue.Queue()
+                self._conn = conn
+                threading.Thread(target=self._write_loop, name="archive-writer", daemon=True).start()
+        return self._conn is not None
+
+    @property
+    def available(self) -> bool:
+        return self._open()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._shared:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    # ---------- 写入 ----------
+
+    def add(self, evaluation, story, client=None):
+        """归档一次评估结果（evaluation 需已带 evaluation_id），写入在后台完成"""
+        if not self._open():
+            return
+        self._queue.put(("add", {
+            "evaluation_id": evaluation["evaluation_id"],
+            "created_at": time.time(),
+            "client": client,
+            "score": evaluation.get("score"),
+            "should_mint": int(bool(evaluation.get("should_mint"))),
+            "screened": int(bool(evaluation.get("screened"))),
+            "title": evaluation.get("metadata_title"),
+            "description": evaluation.get("metadata_description"),
+            "feedback": evaluation.get("feedback"),
+            "story": story,
+            "image_prompt": evaluation.get("image_prompt"),
+            "image_url": evaluation.get("image_url")
+        }))
+
+    def update(self, evaluation_id, **fields):
+        fields = {key: value for key, value in fields.items() if key in UPDATABLE_FIELDS}
+        if evaluation_id and fields and self._open():
+            self._queue.put(("update", evaluation_id, fields))
+
+    def mark_minted(self, evaluation_id, chain, tx_hash, token_id=None):
+        self.update(evaluation_id, chain=chain, tx_hash=tx_hash, token_id=token_id, minted_at=time.time())
+
+    def flush(self):
+        """等待已提交的写入全部完成"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+                for op in batch:
+                    ARCHIVED.inc(op=op[0])
+            except Exception as e:
+                # 整批已回滚：逐条重试，只丢弃本身写入失败的记录
+                log.warning("archive.batch_failed", error=str(e), batch=len(batch))
+                for op in batch:
+                    self._retry(op)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _commit(self, ops):
+        """在一个事务中写入，任何一条失败时整体回滚并抛出异常"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for op in ops:
+                    self._apply(op)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _retry(self, op):
+        try:
+            self._commit([op])
+            ARCHIVED.inc(op=op[0])
+        except Exception as e:
+            WRITE_FAILURES.inc(op=op[0])
+            evaluation_id = op[1]["evaluation_id"] if op[0] == "add" else op[1]
+            log.error("archive.write_failed", op=op[0], evaluation_id=evaluation_id, error=str(e))
+
+    def _apply(self, op):
+        if op[0] == "add":
+            row = op[1]
+            columns = ", ".join(row)
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO stories ({columns}) VALUES ({', '.join('?' for _ in row)})",
+                tuple(row.values()))
+            if cursor.rowcount:
+                # 预筛结果的标题和描述是固定文案，不进入索引
+                title = "" if row["screened"] else segment(row["title"])
+                description = "" if row["screened"] else segment(row["description"])
+                self._conn.execute(
+                    "INSERT INTO stories_fts (rowid, title, description, story) VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, title, description, segment(row["story"])))
+        else:
+            _, evaluation_id, fields = op
+            assignments = ", ".join(f"{key} = ?" for key in fields)
+            self._conn.execute(f"UPDATE stories SET {assignments} WHERE evaluation_id = ?",
+                               (*fields.values(), evaluation_id))
+
+    # ---------- 读取 ----------
+
+    def _query(self, sql, params=()):
+        if not self._open():
+            return []
+        if self._shared:
+            with self._lock:
+                return self._conn.execute(sql, params).fetchall()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn.execute(sql, params).fetchall()
+
+    def get(self, evaluation_id):
+        rows = self._query("SELECT * FROM stories WHERE evaluation_id = ?", (evaluation_id,))
+        return dict(rows[0]) if rows else None
+
+    def search(self, query=None, min_score=None, max_score=None, since=None, until=None,
+               should_mint=None, minted=None, limit=20, offset=0) -> dict:
+        """
+        关键词检索（bm25 排序）或仅按条件过滤（按时间倒序）
+
+        多取一条判断是否还有下一页，不统计总数（命中数很大时 COUNT 本身就是一次全量扫描）
+        """
+        conditions, params = _filters(min_score, max_score, since, until, should_mint, minted)
+
+        match = build_match(query) if query else ""
+        if query and not match:
+            return {"results": [], "has_more": False}
+
+        started = time.perf_counter()
+        if match:
+            where = "".join(f" AND {condition}" for condition in conditions)
+            rows = self._query(
+                f"SELECT s.*, bm25(stories_fts, {', '.join(map(str, RANK_WEIGHTS))}) AS rank "
+                f"FROM stories_fts JOIN stories s ON s.id = stories_fts.rowid "
+                f"WHERE stories_fts MATCH ?{where} ORDER BY rank LIMIT ? OFFSET ?",
+                (match, *params, limit + 1, offset))
+        else:
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            rows = self._query(
+                f"SELECT s.*, NULL AS rank FROM stories s{where} ORDER BY s.created_at DESC LIMIT ? OFFSET ?",
+                (*params, limit + 1, offset))
+        SEARCH_SECONDS.observe(time.perf_counter() - started, kind="match" if match else "filter")
+
+        results = []
+        for row in rows[:limit]:
+            result = format_result(row, query)
+            result["rank"] = round(-row["rank"], 4) if row["rank"] is not None else None
+            results.append(result)
+        return {"results": results, "has_more": len(rows) > limit}
+
+    def get_many(self, evaluation_ids) -> dict:
+        """按 evaluation_id 批量取出，返回 {evaluation_id: 接口格式的结果}"""
+        evaluation_ids = list(evaluation_ids)
+        if not evaluation_ids:
+            return {}
+        rows = self._query(
+            f"SELECT * FROM stories WHERE evaluation_id IN ({', '.join('?' for _ in evaluation_ids)})",
+            evaluation_ids)
+        return {row["evaluation_id"]: format_result(row) for row in rows}
+
+    def export_batches(self, after_id=0, through_id=None, batch=1000, min_score=None, max_score=None,
+                       since=None, until=None, should_mint=None, minted=None):
+        """
+        按写入顺序（id）分批取出完整记录，用于导出
+
+        以 id 为游标翻页（WHERE id > 上一批最后的 id），每批一次查询，内存占用只与 batch 有关；
+        through_id 限定本次导出的最后一条（含）
+        """
+        conditions, params = _filters(min_score, max_score, since, until, should_mint, minted)
+        if through_id is not None:
+            conditions.append("s.id <= ?")
+            params.append(through_id)
+        where = "".join(f" AND {condition}" for condition in conditions)
+        while True:
+            rows = self._query(f"SELECT s.* FROM stories s WHERE s.id > ?{where} ORDER BY s.id LIMIT ?",
+                               (after_id, *params, batch))
+            if not rows:
+                return
+            yield rows
+            if len(rows) < batch:
+                return
+            after_id = rows[-1]["id"]
+
+    def export_page(self, after_id, limit, min_score=None, max_score=None, since=None, until=None,
+                    should_mint=None, minted=None):
+        """
+        一页导出的范围：返回 (本页最后一条的 id, 之后是否还有记录)
+
+        只读取 id 列，不在内存中保存本页的记录；本页不足 limit 条时返回 (None, False)
+        """
+        conditions, params = _filters(min_score, max_score, since, until, should_mint, minted)
+        where = "".join(f" AND {condition}" for condition in conditions)
+        rows = self._query(f"SELECT s.id FROM stories s WHERE s.id > ?{where} ORDER BY s.id LIMIT 2 OFFSET ?",
+                           (after_id, *params, limit - 1))
+        if not rows:
+            return None, False
+        return rows[0]["id"], len(rows) > 1
+
+    def iter_stories(self, after_id=0, batch=1000):
+        """按写入顺序遍历全部归档（用于重建派生索引），每次读取一批"""
+        while True:
+            rows = self._query(
+                "SELECT id, evaluation_id, screened, title, description, story FROM stories "
+                "WHERE id > ? ORDER BY id LIMIT ?", (after_id, batch))
+            if not rows:
+                return
+            yield from (dict(row) for row in rows)
+            after_id = rows[-1]["id"]
+
+
+def _filters(min_score=None, max_score=None, since=None, until=None, should_mint=None, minted=None):
+    """检索和导出共用的过滤条件：返回 (条件列表, 参数列表)，表别名为 s"""
+    conditions, params = [], []
+    for clause, value in (("s.score >= ?", min_score), ("s.score <= ?", max_score),
+                          ("s.created_at >= ?", since), ("s.created_at < ?", until),
+                          ("s.should_mint = ?", None if should_mint is None else int(should_mint))):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+    if minted is not None:
+        conditions.append("s.tx_hash IS NOT NULL" if minted else "s.tx_hash IS NULL")
+    return conditions, params
+
+
+def format_result(row, query=None) -> dict:
+    """接口返回的字段（正文只返回片段）"""
+    result = {field: row[field] for field in RESULT_FIELDS}
+    result["should_mint"] = bool(result["should_mint"])
+    result["screened"] = bool(result["screened"])
+    result["created_at"] = datetime.fromtimestamp(row["created_at"]).isoformat()
+    result["excerpt"] = excerpt(row["story"], query)
+    return result
+
+
+stories = Archive()
+
+
+def search_params(args) -> dict:
+    """
+    解析 /api/search 的查询参数（两个 Web 应用共用），参数错误时抛出 ValueError
+
+    q, min_score, max_score, since, until, should_mint, minted, page（从 1 开始）, per_page
+    """
+    def optional_int(name):
+        value = args.get(name)
+        return int(value) if value not in (None, "") else None
+
+    def optional_bool(name):
+        value = args.get(name)
+        if value in (None, ""):
+            return None
+        return str(value).lower() in ("1", "true", "yes")
+
+    page = max(1, optional_int("page") or 1)
+    per_page = min(SEARCH_PAGE_MAX, max(1, optional_int("per_page") or 20))
+    return {
+        "query": (args.get("q") or "").strip() or None,
+        "min_score": optional_int("min_score"),
+        "max_score": optional_int("max_score"),
+        "since": parse_time(args.get("since")),
+        "until": parse_time(args.get("until"), end_of_day=True),
+        "should_mint": optional_bool("should_mint"),
+        "minted": optional_bool("minted"),
+        "limit": per_page,
+        "offset": (page - 1) * per_page
+    }
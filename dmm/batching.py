@@ -0,0 +1,194 @@
+"""
+图片生成请求的微批处理
+
+在一个很短的窗口内收集并发的图片请求，按 (模型, 分辨率, 步数) 分组后合并成批量上游调用，
+再把每张图片交还给对应的请求，减少对服务商速率限制的占用。
+
+SiliconFlow 的 batch_size 是对同一个提示词生成多张图片，一次调用不能包含不同的提示词，
+因此窗口内相同提示词的请求合并为一次 batch_size=N 的调用（每个请求各得一张不同的图片），
+不同提示词仍各自调用，但在同一时刻一起发出。
+
+环境变量:
+    IMAGE_BATCH_WINDOW_MS  收集窗口（毫秒），0 表示关闭微批处理，默认 0；只合并提示词完全相同的请求
+    IMAGE_BATCH_MAX        相同提示词合并后单次上游调用的最大 batch_size，默认 4（SiliconFlow 的上限）
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from dmm import metrics
+
+IMAGE_BATCH_WINDOW_MS = float(os.getenv("IMAGE_BATCH_WINDOW_MS", "0"))
+IMAGE_BATCH_MAX = int(os.getenv("IMAGE_BATCH_MAX", "4"))
+
+BATCH_SIZE = metrics.REGISTRY.histogram(
+    "dmm_image_batch_size", "Images requested per upstream image call",
+    ("image_size",), buckets=(1, 2, 3, 4, 6, 8, 16))
+BATCH_FILL = metrics.REGISTRY.histogram(
+    "dmm_image_batch_fill_ratio", "Upstream image call batch_size divided by IMAGE_BATCH_MAX",
+    ("image_size",), buckets=(0.25, 0.5, 0.75, 1.0))
+WINDOW_REQUESTS = metrics.REGISTRY.histogram(
+    "dmm_image_batch_window_requests", "Image requests collected per batching window",
+    ("image_size",), buckets=(1, 2, 4, 8, 16, 32, 64))
+BATCHED_REQUESTS = metrics.REGISTRY.counter(
+    "dmm_image_batch_requests_total", "Image requests served through the micro-batcher",
+    ("image_size",))
+BATCH_CALLS = metrics.REGISTRY.counter(
+    "dmm_image_batch_calls_total", "Upstream image calls issued by the micro-batcher",
+    ("image_size", "outcome"))
+
+
+def plan_calls(items, max_batch):
+    """把窗口内的请求拆分为上游调用：相同提示词合并，每次最多 max_batch 张"""
+    groups = OrderedDict()
+    for prompt, waiter in items:
+        groups.setdefault(prompt, []).append(waiter)
+    calls = []
+    for prompt, waiters in groups.items():
+        for start in range(0, len(waiters), max_batch):
+            calls.append((prompt, waiters[start:start + max_batch]))
+    return calls
+
+
+def _record_window(key, size):
+    image_size = key[1]
+    WINDOW_REQUESTS.observe(size, image_size=image_size)
+    BATCHED_REQUESTS.inc(size, image_size=image_size)
+
+
+def _record_call(key, count, max_batch, outcome):
+    image_size = key[1]
+    BATCH_SIZE.observe(count, image_size=image_size)
+    BATCH_FILL.observe(count / max_batch, image_size=image_size)
+    BATCH_CALLS.inc(image_size=image_size, outcome=outcome)
+
+
+class _Window:
+    def __init__(self):
+        self.items = []
+        self.prompt_counts = {}
+
+    def add(self, prompt, waiter) -> int:
+        self.items.append((prompt, waiter))
+        self.prompt_counts[prompt] = self.prompt_counts.get(prompt, 0) + 1
+        return self.prompt_counts[prompt]
+
+
+# ============== 多线程版本（Flask）==============
+
+class ThreadedBatcher:
+    """
+    线程版微批处理器
+
+    send(key, prompt, count) 在线程池中执行，返回图片 URL 列表；
+    submit() 返回 concurrent.futures.Future，结果为单张图片 URL（可能为 None）。
+    """
+
+    def __init__(self, send, window_ms=IMAGE_BATCH_WINDOW_MS, max_batch=IMAGE_BATCH_MAX, max_workers=8):
+        self.send = send
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.enabled = window_ms > 0
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dmm-image-batch")
+
+    def submit(self, key, prompt) -> Future:
+        future = Future()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = _Window()
+                timer = threading.Timer(self.window, self._flush, (key, window))
+                timer.daemon = True
+                timer.start()
+            full = window.add(prompt, future) >= self.max_batch
+        if full:
+            # 该提示词已凑满一批，不必等到窗口结束
+            self._flush(key, window)
+        return future
+
+    def _flush(self, key, window):
+        with self._lock:
+            if self._windows.get(key) is not window:
+                return
+            del self._windows[key]
+        _record_window(key, len(window.items))
+        for prompt, waiters in plan_calls(window.items, self.max_batch):
+            self._pool.submit(self._call, key, prompt, waiters)
+
+    def _call(self, key, prompt, waiters):
+        try:
+            urls = self.send(key, prompt, len(waiters))
+        except Exception as e:
+            _record_call(key, len(waiters), self.max_batch, "error")
+            for waiter in waiters:
+                waiter.set_exception(e)
+            return
+        _record_call(key, len(waiters), self.max_batch, "ok")
+        for i, waiter in enumerate(waiters):
+            waiter.set_result(urls[i] if i < len(urls) else None)
+
+
+# ============== 协程版本（ASGI）==============
+
+class AsyncBatcher:
+    """
+    协程版微批处理器
+
+    send(key, prompt, count) 为协程函数；submit() 返回 asyncio.Future。
+    窗口回调和上游调用都在空白上下文中执行，不继承发起请求的截止时间和耗时明细。
+    """
+
+    def __init__(self, send, window_ms=IMAGE_BATCH_WINDOW_MS, max_batch=IMAGE_BATCH_MAX):
+        self.send = send
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.enabled = window_ms > 0
+        self._windows = {}
+        self._tasks = set()
+
+    def submit(self, key, prompt) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window()
+            loop.call_later(self.window, self._flush, key, window, context=contextvars.Context())
+        if window.add(prompt, future) >= self.max_batch:
+            loop.call_soon(self._flush, key, window, context=contextvars.Context())
+        return future
+
+    def _flush(self, key, window):
+        if self._windows.get(key) is not window:
+            return
+        del self._windows[key]
+        _record_window(key, len(window.items))
+        for prompt, waiters in plan_calls(window.items, self.max_batch):
+            task = asyncio.ensure_future(self._call(key, prompt, waiters))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, key, prompt, waiters):
+        try:
+            urls = await self.send(key, prompt, len(waiters))
+        except Exception as e:
+            _record_call(key, len(waiters), self.max_batch, "error")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        _record_call(key, len(waiters), self.max_batch, "ok")
+        for i, waiter in enumerate(waiters):
+            # 等待方可能因截止时间已取消
+            if not waiter.done():
+                waiter.set_result(urls[i] if i < len(urls) else None)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,273 @@
+"""
+上游熔断器（circuit breaker）
+
+每个上游一个熔断器：llm、image，以及每条链的 RPC（rpc:<链标识>）。
+熔断器统计最近 BREAKER_WINDOW_S 秒内的调用：
+    closed     正常放行；调用数达到 BREAKER_MIN_CALLS 且失败率超过 BREAKER_FAILURE_RATE，
+               或慢调用（超过该上游的 *_SLOW_CALL_S）比例超过 BREAKER_SLOW_RATE 时打开
+    open       直接抛出 CircuitOpen，不再等待上游超时；BREAKER_OPEN_S 秒后进入半开
+    half_open  最多放行 BREAKER_HALF_OPEN_CALLS 个探测调用，全部成功则关闭，任一失败重新打开
+
+客户端断开等本端原因终止的调用不计入统计；启用自适应并发限制（dmm.limits）时，
+429 由限制器降低并发处理，也不计为失败。各接口在熔断时的降级方式：
+    图片    跳过图片（image_url 为 null），之后可重新调用 POST /api/image
+    LLM     /api/evaluate 立即返回 503 和 Retry-After；级联评估的预筛失败时回退到完整评估
+    RPC     铸造路由避开熔断的链，全部熔断时返回 503；/api/status 返回最近一次成功的链上状态
+
+熔断器状态在 /api/status 的 breakers 字段和 dmm_breaker_state 指标中可见。
+
+环境变量:
+    BREAKERS_ENABLED          是否启用，默认 true
+    BREAKER_WINDOW_S          统计窗口（秒），默认 60
+    BREAKER_MIN_CALLS         窗口内调用数达到该值才判断是否打开，默认 10
+    BREAKER_FAILURE_RATE      打开的失败率，默认 0.5
+    BREAKER_SLOW_RATE         打开的慢调用比例，默认 0.8
+    BREAKER_OPEN_S            打开后进入半开的时间（秒），默认 30
+    BREAKER_HALF_OPEN_CALLS   半开状态放行的探测调用数，默认 3
+    LLM_SLOW_CALL_S           LLM 慢调用阈值（秒），默认 45
+    IMAGE_SLOW_CALL_S         图片慢调用阈值（秒），默认 30
+    RPC_SLOW_CALL_S           RPC 慢调用阈值（秒），默认 5
+
+用法:
+    with metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout, breakers.guard("llm"):
+        client.chat.completions.create(..., timeout=timeout)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from dmm import limits, metrics
+from dmm.deadline import ClientDisconnected
+from dmm.log import get_logger
+
+log = get_logger("breakers")
+
+BREAKERS_ENABLED = os.getenv("BREAKERS_ENABLED", "true").lower() in ("1", "true", "yes")
+BREAKER_WINDOW_S = float(os.getenv("BREAKER_WINDOW_S", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_S = float(os.getenv("BREAKER_OPEN_S", "30"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "3"))
+
+SLOW_CALL_S = {
+    "llm": float(os.getenv("LLM_SLOW_CALL_S", "45")),
+    "image": float(os.getenv("IMAGE_SLOW_CALL_S", "30")),
+    "rpc": float(os.getenv("RPC_SLOW_CALL_S", "5")),
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = metrics.REGISTRY.gauge(
+    "dmm_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ("breaker",))
+BREAKER_TRANSITIONS = metrics.REGISTRY.counter(
+    "dmm_breaker_transitions_total", "Circuit breaker state transitions", ("breaker", "state"))
+BREAKER_REJECTIONS = metrics.REGISTRY.counter(
+    "dmm_breaker_rejections_total", "Calls rejected by an open circuit breaker", ("breaker",))
+
+
+class CircuitOpen(Exception):
+    """上游熔断，调用未发出"""
+
+    outcome = "circuit_open"
+    status_code = 503
+
+    def __init__(self, breaker, retry_after):
+        self.breaker = breaker
+        self.retry_after = retry_after
+        super().__init__(f"Upstream {breaker} is unavailable (circuit open), retry in {retry_after:.1f}s")
+
+    def to_dict(self) -> dict:
+        return {
+            "error": str(self),
+            "upstream": self.breaker,
+            "retry_after_s": round(self.retry_after, 1)
+        }
+
+
+class CircuitBreaker:
+    """单个上游的熔断器，线程安全，同步和异步代码共用"""
+
+    def __init__(self, name, slow_call_s, window_s=BREAKER_WINDOW_S, min_calls=BREAKER_MIN_CALLS,
+                 failure_rate=BREAKER_FAILURE_RATE, slow_rate=BREAKER_SLOW_RATE,
+                 open_s=BREAKER_OPEN_S, half_open_calls=BREAKER_HALF_OPEN_CALLS):
+        self.name = name
+        self.slow_call_s = slow_call_s
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.open_s = open_s
+        self.half_open_calls = half_open_calls
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # (时间, 是否失败, 是否慢调用)
+        self._calls = deque()
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, breaker=name)
+
+    # ---------- 状态 ----------
+
+    def _transition(self, state, now):
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = now
+        if state != CLOSED:
+            self._probes = self._probe_successes = 0
+        if state == CLOSED:
+            self._calls.clear()
+        BREAKER_STATE.set(STATE_VALUES[state], breaker=self.name)
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+        log.warning("breaker.transition", breaker=self.name, previous=previous, state=state)
+
+    def _refresh(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_s:
+            self._transition(HALF_OPEN, now)
+        while self._calls and self._calls[0][0] < now - self.window_s:
+            self._calls.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def available(self) -> bool:
+        """是否会放行调用（用于在多个上游之间选择，不占用半开的探测名额）"""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state == CLOSED or (self._state == HALF_OPEN and self._probes < self.half_open_calls)
+
+    # ---------- 调用 ----------
+
+    def acquire(self) -> bool:
+        """调用前检查，熔断时抛出 CircuitOpen；返回本次调用是否为半开探测"""
+        if not BREAKERS_ENABLED:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self._state == CLOSED:
+                return False
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            retry_after = max(0.0, self._opened_at + self.open_s - now) if self._state == OPEN else 1.0
+        BREAKER_REJECTIONS.inc(breaker=self.name)
+        raise CircuitOpen(self.name, retry_after)
+
+    def record(self, probe, failed, elapsed_s, slow=True):
+        if not BREAKERS_ENABLED:
+            return
+        is_slow = slow and self.slow_call_s is not None and elapsed_s > self.slow_call_s
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            if self._state == HALF_OPEN and probe:
+                if failed or is_slow:
+                    self._transition(OPEN, now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED, now)
+                return
+            if self._state != CLOSED:
+                return
+            self._calls.append((now, failed, is_slow))
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_rate:
+                self._transition(OPEN, now)
+
+    def release(self, probe):
+        """调用因本端原因终止（客户端断开、任务取消），不计入统计"""
+        if probe:
+            with self._lock:
+                self._probes = max(0, self._probes - 1)
+
+    def guard(self, slow=True, ignore=()):
+        """
+        包住一次上游调用：熔断时抛出 CircuitOpen，结束时按耗时和异常记录结果
+
+        slow=False 时不统计慢调用（如等待交易确认）；ignore 中的异常类型不计为失败
+        """
+        return _Guard(self, slow, ignore)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._refresh(now)
+            calls = len(self._calls)
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            return {
+                "state": self._state,
+                "calls": calls,
+                "failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "slow_rate": round(slow_calls / calls, 3) if calls else 0.0,
+                "retry_after_s": round(max(0.0, self._opened_at + self.open_s - now), 1)
+                if self._state == OPEN else None
+            }
+
+
+class _Guard:
+    """CircuitBreaker.guard() 的上下文管理器，with 语句在同步和协程代码中都可用"""
+
+    def __init__(self, breaker, slow, ignore):
+        self.breaker = breaker
+        self.slow = slow
+        self.ignore = tuple(ignore)
+
+    def __enter__(self):
+        self.probe = self.breaker.acquire()
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, (ClientDisconnected, asyncio.CancelledError)):
+            self.breaker.release(self.probe)
+        elif exc_type is not None and self.ignore and issubclass(exc_type, self.ignore):
+            self.breaker.release(self.probe)
+        elif limits.absorbs(exc):
+            self.breaker.release(self.probe)
+        else:
+            self.breaker.record(self.probe, exc_type is not None, time.monotonic() - self.started, self.slow)
+        return False
+
+
+# ============== 注册表 ==============
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get(name) -> CircuitBreaker:
+    """按名称取熔断器（llm、image、rpc:<链标识>），首次使用时创建"""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, SLOW_CALL_S.get(name.split(":")[0]))
+        return breaker
+
+
+def rpc_name(chain_key) -> str:
+    return f"rpc:{chain_key}"
+
+
+def guard(name, slow=True, ignore=()):
+    return get(name).guard(slow, ignore)
+
+
+def snapshot() -> dict:
+    with _lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
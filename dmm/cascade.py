@@ -0,0 +1,135 @@
+"""
+级联评估：廉价模型预筛
+
+启用后，故事先交给小模型只估一个分数：
+- 预估分明显低于阈值（低于 阈值 - SCREEN_MARGIN）的故事直接返回轻量结果，
+  不再调用完整评估模型，也不生成图片
+- 接近阈值或高分的故事继续走完整评估
+
+被拦下的故事中按 SCREEN_AUDIT_RATE 抽样仍做完整评估，用来估计误拒率。
+完整评估后记录预筛与最终结果是否一致（一致率、分差），以及按预筛决策划分的最终结果
+（放行后未达标的比例、抽检误拒率），用于调整 SCREEN_MARGIN。
+
+不涉及任何网络调用，Flask 和 ASGI 两个版本各自负责调用模型。
+
+环境变量:
+    EVALUATION_CASCADE  true 时启用，默认 false
+    SCREEN_MODEL        预筛模型，默认 Qwen/Qwen2.5-7B-Instruct
+    SCREEN_MARGIN       预估分低于 阈值 - SCREEN_MARGIN 时直接拦下，默认 15
+    SCREEN_AUDIT_RATE   被拦下的故事中仍做完整评估的比例（0-1），默认 0.05
+"""
+
+import os
+import random
+import re
+import threading
+from datetime import datetime
+
+from dmm import metrics
+from dmm.evaluation import parse_evaluation
+
+EVALUATION_CASCADE = os.getenv("EVALUATION_CASCADE", "false").lower() in ("1", "true", "yes")
+SCREEN_MODEL = os.getenv("SCREEN_MODEL", "Qwen/Qwen2.5-7B-Instruct")
+SCREEN_MARGIN = int(os.getenv("SCREEN_MARGIN", "15"))
+SCREEN_AUDIT_RATE = float(os.getenv("SCREEN_AUDIT_RATE", "0.05"))
+SCREEN_MAX_TOKENS = 20
+
+# 预筛决策: reject（拦下）、audit（应拦下但抽中做完整评估）、escalate（完整评估）、fallback（预筛失败）
+DECISIONS = metrics.REGISTRY.counter(
+    "dmm_cascade_decisions_total", "Pre-screen decisions", ("decision",))
+# 完整评估后的结果，按预筛决策划分；reject+mint 即误拒，escalate+reject 即多余的完整评估
+OUTCOMES = metrics.REGISTRY.counter(
+    "dmm_cascade_outcomes_total", "Full evaluation verdicts grouped by pre-screen decision",
+    ("decision", "full_verdict"))
+AGREEMENT = metrics.REGISTRY.counter(
+    "dmm_cascade_agreement_total", "Whether screened and full scores fall on the same side of the threshold",
+    ("agreed",))
+SCORE_ERROR = metrics.REGISTRY.histogram(
+    "dmm_cascade_score_error", "Absolute difference between screened and full scores",
+    buckets=(2, 5, 10, 15, 20, 30, 50, 100))
+
+_lock = threading.Lock()
+_stats = {"reject": 0, "audit": 0, "escalate": 0, "fallback": 0,
+          "compared": 0, "agreed": 0, "false_rejects": 0, "abs_error": 0}
+
+
+def parse_screen_score(text):
+    """解析预筛模型输出的分数，兼容纯数字输出；无法解析时返回 None"""
+    try:
+        return max(0, min(100, int(parse_evaluation(text)["score"])))
+    except (ValueError, KeyError, TypeError):
+        match = re.search(r"\d{1,3}", text or "")
+        return max(0, min(100, int(match.group()))) if match else None
+
+
+def decide(estimate, threshold) -> str:
+    """根据预估分决定是否需要完整评估"""
+    if estimate is None:
+        decision = "fallback"
+    elif estimate >= threshold - SCREEN_MARGIN:
+        decision = "escalate"
+    elif SCREEN_AUDIT_RATE > 0 and random.random() < SCREEN_AUDIT_RATE:
+        decision = "audit"
+    else:
+        decision = "reject"
+
+    DECISIONS.inc(decision=decision)
+    with _lock:
+        _stats[decision] += 1
+    return decision
+
+
+def build_screened_evaluation(estimate, threshold) -> dict:
+    """被拦下故事的轻量结果（结构与完整评估一致，但没有图片提示词）"""
+    return {
+        "score": estimate,
+        "metadata_title": "Preliminary Assessment",
+        "metadata_description": "This story was assessed by a quick screening model. "
+                                "Full evaluation is reserved for stories close to the archival threshold.",
+        "feedback": f"Estimated score {estimate}, well below the archival threshold of {threshold}. "
+                    "Adding emotional depth, cultural or historical context, or a clearer narrative arc "
+                    "may raise the score.",
+        "timestamp": datetime.now().isoformat(),
+        "should_mint": False,
+        "screened": True,
+        "screen_score": estimate
+    }
+
+
+def record_outcome(decision, estimate, full_score, threshold):
+    """完整评估后记录预筛是否与最终结果一致"""
+    if estimate is None:
+        return
+    full_mint = full_score >= threshold
+    # 一致：预估分与完整评估分落在阈值的同一侧（与 SCREEN_MARGIN 无关，反映预筛模型本身的准确度）
+    agreed = full_mint == (estimate >= threshold)
+    error = abs(full_score - estimate)
+
+    OUTCOMES.inc(decision=decision, full_verdict="mint" if full_mint else "reject")
+    AGREEMENT.inc(agreed=str(agreed).lower())
+    SCORE_ERROR.observe(error)
+    with _lock:
+        _stats["compared"] += 1
+        _stats["agreed"] += int(agreed)
+        _stats["false_rejects"] += int(decision == "audit" and full_mint)
+        _stats["abs_error"] += error
+
+
+def snapshot() -> dict:
+    """预筛决策统计、一致率、抽检误拒率和平均分差"""
+    with _lock:
+        stats = dict(_stats)
+    compared = stats.pop("compared")
+    agreed = stats.pop("agreed")
+    false_rejects = stats.pop("false_rejects")
+    abs_error = stats.pop("abs_error")
+    return {
+        "enabled": EVALUATION_CASCADE,
+        "model": SCREEN_MODEL,
+        "margin": SCREEN_MARGIN,
+        "decisions": stats,
+        "compared": compared,
+        "agreement_rate": round(agreed / compared, 4) if compared else None,
+        "audit_false_reject_rate": round(false_rejects / stats["audit"], 4) if stats["audit"] else None,
+        "mean_abs_error": round(abs_error / compared, 2) if compared else None
+    }
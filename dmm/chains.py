@@ -0,0 +1,321 @@
+"""
+链注册表与铸造路由
+
+每条链定义 RPC 地址池、合约地址、chain id 和区块浏览器；Web 应用和 Agent 都从这里读取，
+不再各自硬编码。内置的 simulated 链指向进程内模拟链（见 dmm.simchain），用于离线压测铸造。每条链保持一个常驻连接（Connections），当前 RPC 地址连续出错时切换到池中的下一个。
+
+MintRouter 根据观测到的 gas 价格、每次铸造的 gas 用量和确认耗时（均为指数滑动平均）
+在 MINT_CHAINS 中选择目标链：
+    得分 = w * 预估费用 / 最低预估费用 + (1 - w) * 预估确认时间 / 最短预估确认时间
+取得分最低的链；还没有确认时间观测的链以 2 个出块间隔作为先验。连续出错的链暂时跳过。
+gas 价格超过 MINT_ROUTE_STALE_S 未更新的链，由调用方在选择前刷新（stale()）。
+
+环境变量:
+    SEPOLIA_RPC                    Ethereum Sepolia 的 RPC 地址池（逗号分隔），默认 Alchemy + 公共节点
+    BASE_SEPOLIA_RPC               Base Sepolia 的 RPC 地址池，默认 https://sepolia.base.org
+    SEPOLIA_CONTRACT_ADDRESS       各链的合约地址，未设置时使用 CONTRACT_ADDRESS
+    BASE_SEPOLIA_CONTRACT_ADDRESS
+    CHAIN_REGISTRY_FILE            额外或覆盖的链定义（JSON 数组，字段同 Chain 的参数）
+    MINT_CHAINS                    Web 应用可铸造的链（逗号分隔），第一个为默认链，默认 sepolia
+    AGENT_CHAIN                    Agent 铸造使用的链，默认 base-sepolia
+    MINT_ROUTE_FEE_WEIGHT          路由得分中费用的权重 w（0-1），默认 0.5
+    MINT_ROUTE_STALE_S             gas 价格观测的有效期（秒），默认 300
+"""
+
+import json
+import os
+import threading
+import time
+
+from dmm import breakers, metrics, simchain
+from dmm.config import ALCHEMY_API_KEY, CONTRACT_ADDRESS
+
+CHAIN_REGISTRY_FILE = os.getenv("CHAIN_REGISTRY_FILE", "")
+MINT_CHAINS = [key.strip() for key in os.getenv("MINT_CHAINS", "sepolia").split(",") if key.strip()]
+AGENT_CHAIN = os.getenv("AGENT_CHAIN", "base-sepolia")
+MINT_ROUTE_FEE_WEIGHT = float(os.getenv("MINT_ROUTE_FEE_WEIGHT", "0.5"))
+MINT_ROUTE_STALE_S = float(os.getenv("MINT_ROUTE_STALE_S", "300"))
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+# 指数滑动平均的平滑系数
+EWMA_ALPHA = 0.3
+# 连续出错达到该次数后暂停路由到该链，冷却结束后再试
+MAX_FAILURES = 3
+FAILURE_COOLDOWN_S = 60
+# 还没有 gas 用量观测时的先验
+DEFAULT_MINT_GAS = 200000
+
+MINT_ROUTED = metrics.REGISTRY.counter(
+    "dmm_mint_routed_total", "Mints routed to each chain", ("chain", "reason"))
+CONFIRMATION_SECONDS = metrics.REGISTRY.histogram(
+    "dmm_mint_confirmation_seconds", "Time from sending a mint transaction to its receipt",
+    ("chain",), buckets=(1, 2, 5, 10, 15, 20, 30, 60, 120))
+RPC_FAILOVERS = metrics.REGISTRY.counter(
+    "dmm_rpc_failovers_total", "RPC endpoint switches after errors", ("chain",))
+
+
+def _env_list(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return list(default)
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+class Chain:
+    """一条链的静态配置"""
+
+    def __init__(self, key, name, chain_id, rpc_urls, contract_address=None, explorer_tx_url="",
+                 block_time_s=12.0, wallet_rpc_url=None, explorer_url=None, currency="ETH"):
+        self.key = key
+        self.name = name
+        self.chain_id = int(chain_id)
+        self.rpc_urls = list(rpc_urls)
+        self.contract_address = contract_address or CONTRACT_ADDRESS
+        self.explorer_tx_url = explorer_tx_url
+        self.block_time_s = float(block_time_s)
+        # 前端钱包添加网络时使用的公共 RPC（rpc_urls 可能带 API Key，不对外暴露）
+        self.wallet_rpc_url = wallet_rpc_url
+        self.explorer_url = explorer_url
+        self.currency = currency
+
+    @property
+    def has_contract(self) -> bool:
+        return bool(self.contract_address) and self.contract_address.lower() != ZERO_ADDRESS
+
+    def tx_url(self, tx_hash) -> str:
+        return f"{self.explorer_tx_url}{tx_hash}"
+
+    def to_dict(self) -> dict:
+        """对外公开的字段（不包含 RPC 地址池）"""
+        return {
+            "key": self.key,
+            "name": self.name,
+            "chain_id": self.chain_id,
+            "chain_id_hex": hex(self.chain_id),
+            "contract_address": self.contract_address,
+            "explorer_url": self.explorer_url,
+            "wallet_rpc_url": self.wallet_rpc_url,
+            "currency": self.currency,
+            "block_time_s": self.block_time_s
+        }
+
+
+def _default_chains():
+    alchemy = f"https://eth-sepolia.g.alchemy.com/v2/{ALCHEMY_API_KEY}" if ALCHEMY_API_KEY else None
+    return [
+        Chain(
+            key="sepolia",
+            name="Ethereum Sepolia",
+            chain_id=11155111,
+            rpc_urls=_env_list("SEPOLIA_RPC", [url for url in (
+                alchemy, "https://ethereum-sepolia-rpc.publicnode.com") if url]),
+            contract_address=os.getenv("SEPOLIA_CONTRACT_ADDRESS"),
+            explorer_tx_url="https://sepolia.etherscan.io/tx/",
+            explorer_url="https://sepolia.etherscan.io",
+            wallet_rpc_url="https://ethereum-sepolia-rpc.publicnode.com",
+            block_time_s=12
+        ),
+        Chain(
+            key="base-sepolia",
+            name="Base Sepolia",
+            chain_id=84532,
+            rpc_urls=_env_list("BASE_SEPOLIA_RPC", ["https://sepolia.base.org"]),
+            contract_address=os.getenv("BASE_SEPOLIA_CONTRACT_ADDRESS"),
+            explorer_tx_url="https://sepolia.basescan.org/tx/",
+            explorer_url="https://sepolia.basescan.org",
+            wallet_rpc_url="https://sepolia.base.org",
+            block_time_s=2
+        ),
+        # 进程内模拟链（dmm.simchain），合约在首次连接时部署，地址写回这里
+        Chain(
+            key=simchain.CHAIN_KEY,
+            name="Simulated (in-process)",
+            chain_id=simchain.CHAIN_ID,
+            rpc_urls=[simchain.RPC_URL],
+            block_time_s=simchain.SIM_BLOCK_TIME_S,
+            currency="ETH"
+        ),
+    ]
+
+
+def load_registry(path=CHAIN_REGISTRY_FILE) -> dict:
+    """内置链定义，加上 CHAIN_REGISTRY_FILE 中新增或覆盖的链"""
+    registry = {chain.key: chain for chain in _default_chains()}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for entry in json.load(f):
+                chain = Chain(**entry)
+                registry[chain.key] = chain
+    return registry
+
+
+REGISTRY = load_registry()
+
+
+def get(key) -> Chain:
+    """按名称取链配置，不存在时抛出 KeyError"""
+    if key not in REGISTRY:
+        raise KeyError(f"Unknown chain '{key}', available: {', '.join(REGISTRY)}")
+    return REGISTRY[key]
+
+
+def mint_chains():
+    return [get(key) for key in MINT_CHAINS]
+
+
+def default_chain() -> Chain:
+    return get(MINT_CHAINS[0])
+
+
+# ============== 常驻连接 ==============
+
+class Connections:
+    """
+    每条链一个常驻客户端
+
+    factory(url) 创建客户端（Web3 或 AsyncWeb3），客户端在进程内复用以保持连接；
+    mark_failed() 切换到地址池中的下一个 RPC，下次 get() 时重新创建客户端。
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._clients = {}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def url(self, chain: Chain) -> str:
+        with self._lock:
+            return chain.rpc_urls[self._index.get(chain.key, 0) % len(chain.rpc_urls)]
+
+    def get(self, chain: Chain):
+        with self._lock:
+            client = self._clients.get(chain.key)
+            if client is None:
+                url = chain.rpc_urls[self._index.get(chain.key, 0) % len(chain.rpc_urls)]
+                client = self._clients[chain.key] = self.factory(url)
+            return client
+
+    def mark_failed(self, chain: Chain):
+        if len(chain.rpc_urls) < 2:
+            return
+        with self._lock:
+            self._index[chain.key] = self._index.get(chain.key, 0) + 1
+            self._clients.pop(chain.key, None)
+        RPC_FAILOVERS.inc(chain=chain.key)
+
+    def clients(self):
+        with self._lock:
+            return list(self._clients.values())
+
+
+# ============== 铸造路由 ==============
+
+def _ewma(previous, value):
+    return value if previous is None else previous + EWMA_ALPHA * (value - previous)
+
+
+class MintRouter:
+    """按观测到的费用和确认时间选择铸造目标链"""
+
+    def __init__(self, chains, fee_weight=MINT_ROUTE_FEE_WEIGHT, stale_s=MINT_ROUTE_STALE_S):
+        self.chains = list(chains)
+        self.fee_weight = min(1.0, max(0.0, fee_weight))
+        self.stale_s = stale_s
+        self._lock = threading.Lock()
+        self._stats = {chain.key: {"gas_price": None, "gas_price_at": 0.0, "gas_used": None,
+                                   "confirm_s": None, "mints": 0, "failures": 0, "failed_at": 0.0}
+                       for chain in self.chains}
+
+    def _available(self, now):
+        # RPC 熔断的链不参与路由（见 dmm.breakers）
+        return [chain for chain in self.chains
+                if (self._stats[chain.key]["failures"] < MAX_FAILURES
+                    or now - self._stats[chain.key]["failed_at"] > FAILURE_COOLDOWN_S)
+                and breakers.get(breakers.rpc_name(chain.key)).available()]
+
+    def stale(self):
+        """gas 价格需要刷新的候选链（只有一条候选链时无需比较）"""
+        if len(self.chains) < 2:
+            return []
+        now = time.time()
+        with self._lock:
+            return [chain for chain in self._available(now)
+                    if now - self._stats[chain.key]["gas_price_at"] > self.stale_s]
+
+    def observe_gas_price(self, key, gas_price_wei):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                stats["gas_price"] = _ewma(stats["gas_price"], gas_price_wei)
+                stats["gas_price_at"] = time.time()
+
+    def observe_mint(self, key, gas_used, confirm_s):
+        CONFIRMATION_SECONDS.observe(confirm_s, chain=key)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                stats["gas_used"] = _ewma(stats["gas_used"], gas_used)
+                stats["confirm_s"] = _ewma(stats["confirm_s"], confirm_s)
+                stats["mints"] += 1
+                stats["failures"] = 0
+
+    def observe_failure(self, key):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                stats["failures"] += 1
+                stats["failed_at"] = time.time()
+
+    def _estimates(self, chain):
+        stats = self._stats[chain.key]
+        fee = stats["gas_price"] * (stats["gas_used"] or DEFAULT_MINT_GAS) if stats["gas_price"] else None
+        confirm = stats["confirm_s"] if stats["confirm_s"] is not None else 2 * chain.block_time_s
+        return fee, confirm
+
+    def choose(self, preferred=None) -> Chain:
+        """返回目标链；preferred 为请求指定的链（必须在 MINT_CHAINS 中）"""
+        if preferred:
+            chain = next((c for c in self.chains if c.key == preferred), None)
+            if chain is None:
+                raise KeyError(f"Chain '{preferred}' is not enabled for minting")
+            MINT_ROUTED.inc(chain=chain.key, reason="requested")
+            return chain
+
+        with self._lock:
+            candidates = self._available(time.time()) or self.chains
+            if len(candidates) == 1:
+                chain = candidates[0]
+                reason = "only"
+            else:
+                estimates = {c.key: self._estimates(c) for c in candidates}
+                fees = [fee for fee, _ in estimates.values() if fee]
+                min_fee = min(fees) if fees else None
+                # 没有费用观测的链按已知的最高费用计，避免仅因缺少数据而被优先选择
+                max_fee = max(fees) if fees else None
+                min_confirm = min(confirm for _, confirm in estimates.values()) or 1.0
+
+                def score(c):
+                    fee, confirm = estimates[c.key]
+                    fee_ratio = (fee or max_fee) / min_fee if min_fee else 1.0
+                    return self.fee_weight * fee_ratio + (1 - self.fee_weight) * confirm / min_confirm
+
+                chain = min(candidates, key=score)
+                reason = "routed"
+        MINT_ROUTED.inc(chain=chain.key, reason=reason)
+        return chain
+
+    def snapshot(self) -> list:
+        with self._lock:
+            result = []
+            for chain in self.chains:
+                stats = self._stats[chain.key]
+                fee, confirm = self._estimates(chain)
+                result.append(dict(
+                    chain.to_dict(),
+                    gas_price_gwei=round(stats["gas_price"] / 1e9, 4) if stats["gas_price"] else None,
+                    expected_fee_eth=round(fee / 1e18, 8) if fee else None,
+                    expected_confirm_s=round(confirm, 2),
+                    mints=stats["mints"],
+                    failures=stats["failures"]
+                ))
+            return result
@@ -0,0 +1,29 @@
+"""
+Web 应用配置
+
+Flask（web/app.py）和 ASGI（web/asgi.py）两个版本共用同一份配置
+"""
+
+import os
+
+# Alchemy API 配置
+ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY", "")
+
+# 区块链配置（各链的 RPC、chain id、浏览器和合约地址见 dmm.chains）
+AGENT_PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
+# 未单独配置合约地址的链使用该地址
+CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0000000000000000000000000000000000000000")
+# mintToken 交易的 gas 上限
+MINT_GAS_LIMIT = 300000
+
+# AI 配置
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.siliconflow.cn/v1")
+AI_MODEL = os.getenv("AI_MODEL", "Qwen/Qwen3-Next-80B-A3B-Instruct")
+SCORE_THRESHOLD = int(os.getenv("SCORE_THRESHOLD", "85"))
+IMAGE_API_URL = os.getenv("IMAGE_API_URL", "https://api.siliconflow.cn/v1/images/generations")
+
+
+def has_agent_key() -> bool:
+    """是否配置了后端铸造使用的 Agent 私钥"""
+    return bool(AGENT_PRIVATE_KEY) and AGENT_PRIVATE_KEY != "your_private_key_here"
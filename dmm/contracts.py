@@ -0,0 +1,60 @@
+"""
+MemoryToken 合约 ABI
+"""
+
+import json
+import os
+
+from web3.logs import DISCARD
+
+_ABI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'contracts', 'MemoryToken_ABI.json')
+
+# 后端铸造只需要 mintToken，TokenMinted 事件用于从收据中取出 tokenId
+CONTRACT_ABI = [
+    {
+        "inputs": [
+            {"internalType": "address", "name": "recipient", "type": "address"},
+            {"internalType": "string", "name": "tokenURI", "type": "string"}
+        ],
+        "name": "mintToken",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "address", "name": "recipient", "type": "address"},
+            {"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"},
+            {"indexed": False, "internalType": "string", "name": "tokenURI", "type": "string"}
+        ],
+        "name": "TokenMinted",
+        "type": "event"
+    }
+]
+
+# 前端钱包铸造使用的最小 ABI（ABI 文件不存在时的降级方案）
+MINIMAL_USER_ABI = [
+    {
+        "inputs": [{"internalType": "string", "name": "tokenURI", "type": "string"}],
+        "name": "mint",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+
+def load_contract_abi() -> list:
+    """读取完整的合约 ABI"""
+    if os.path.exists(_ABI_PATH):
+        with open(_ABI_PATH, 'r') as f:
+            return json.load(f)
+    return MINIMAL_USER_ABI
+
+
+def minted_token_id(contract, receipt):
+    """从交易收据的 TokenMinted 事件中取出 tokenId，没有该事件时返回 None"""
+    events = contract.events.TokenMinted().process_receipt(receipt, errors=DISCARD)
+    return events[0]['args']['tokenId'] if events else None
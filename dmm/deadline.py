@@ -0,0 +1,208 @@
+"""
+请求级截止时间（deadline）
+
+接口入口为每个请求设定总预算，各阶段通过 stage() 取得剩余时间作为自己的超时，
+预算用完时抛出 DeadlineExceeded，并标明是哪个阶段耗尽了预算。
+客户端断开后，下一个阶段开始前会抛出 ClientDisconnected，不再继续调用上游。
+
+客户端可以通过 X-Request-Timeout-Ms 请求头缩短（不能延长）服务端预算。
+
+环境变量:
+    EVALUATE_DEADLINE_S        /api/evaluate 的预算（秒），默认 110（前端 fetch 超时为 120）
+    EVALUATE_BATCH_DEADLINE_S  /api/evaluate/batch 的预算（秒），默认 300
+    MINT_DEADLINE_S            /api/mint 的预算（秒），默认 150
+    IMAGE_DEADLINE_S           POST /api/image 的预算（秒），默认 90
+    FEEDBACK_DEADLINE_S        /api/evaluate/<id>/feedback 的预算（秒），默认 60
+    STATUS_DEADLINE_S          /api/status 的预算（秒），默认 10
+
+用法:
+    deadline.start(deadline.budget_for("evaluate", request.headers.get(deadline.TIMEOUT_HEADER)))
+    with metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout:
+        client.chat.completions.create(..., timeout=timeout)
+"""
+
+import contextvars
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+
+ENDPOINT_BUDGETS = {
+    "evaluate": float(os.getenv("EVALUATE_DEADLINE_S", "110")),
+    "evaluate_batch": float(os.getenv("EVALUATE_BATCH_DEADLINE_S", "300")),
+    "mint": float(os.getenv("MINT_DEADLINE_S", "150")),
+    "create_image": float(os.getenv("IMAGE_DEADLINE_S", "90")),
+    "evaluation_feedback": float(os.getenv("FEEDBACK_DEADLINE_S", "60")),
+    "status": float(os.getenv("STATUS_DEADLINE_S", "10")),
+}
+
+# 剩余时间低于该值时不再启动新的阶段
+MIN_STAGE_BUDGET_S = 0.05
+
+
+# ============== 异常 ==============
+
+class RequestAborted(Exception):
+    """请求在完成前被终止"""
+
+    outcome = "aborted"
+    status_code = 500
+
+    def __init__(self, stage, deadline=None):
+        self.stage = stage
+        self.budget_ms = round(deadline.budget * 1000) if deadline else None
+        self.elapsed_ms = round(deadline.elapsed() * 1000) if deadline else None
+        self.details = {}
+        super().__init__(f"{self.describe()} during {stage}")
+
+    def describe(self) -> str:
+        return "Request aborted"
+
+    def to_dict(self) -> dict:
+        return {
+            "error": str(self),
+            "stage": self.stage,
+            "budget_ms": self.budget_ms,
+            "elapsed_ms": self.elapsed_ms,
+            **self.details
+        }
+
+
+class DeadlineExceeded(RequestAborted):
+    """请求预算耗尽"""
+
+    outcome = "deadline"
+    status_code = 504
+
+    def describe(self) -> str:
+        return "Deadline exceeded"
+
+
+class ClientDisconnected(RequestAborted):
+    """客户端已断开连接（499 沿用 nginx 的约定，仅用于日志和指标）"""
+
+    outcome = "cancelled"
+    status_code = 499
+
+    def describe(self) -> str:
+        return "Client disconnected"
+
+
+# ============== 截止时间 ==============
+
+class Deadline:
+    """一次请求的总预算"""
+
+    def __init__(self, budget, disconnected=None):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget
+        self.current_stage = None
+        self._disconnected = disconnected
+        self._cancelled = False
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """标记客户端已断开（ASGI 监视协程调用）"""
+        self._cancelled = True
+
+    def cancelled(self) -> bool:
+        if not self._cancelled and self._disconnected is not None:
+            self._cancelled = bool(self._disconnected())
+        return self._cancelled
+
+    def check(self, stage):
+        """在阶段开始前检查，预算不足或客户端已断开时抛出异常"""
+        if self.cancelled():
+            raise ClientDisconnected(stage, self)
+        if self.remaining() < MIN_STAGE_BUDGET_S:
+            raise DeadlineExceeded(stage, self)
+
+    def timeout(self, stage, cap=None) -> float:
+        """返回阶段可用的超时时间（秒），不超过 cap"""
+        self.check(stage)
+        remaining = self.remaining()
+        return remaining if cap is None else min(remaining, cap)
+
+
+_current = contextvars.ContextVar("dmm_deadline", default=None)
+
+
+def budget_for(endpoint, header_value=None):
+    """接口预算（秒），客户端请求头只能缩短预算；没有预算的接口返回 None"""
+    budget = ENDPOINT_BUDGETS.get(endpoint)
+    if budget is None:
+        return None
+    try:
+        requested = float(header_value) / 1000 if header_value else None
+    except ValueError:
+        requested = None
+    if requested is not None and requested > 0:
+        budget = min(budget, requested)
+    return budget
+
+
+def start(budget, disconnected=None):
+    """为当前请求设定截止时间，budget 为 None 时不限制"""
+    deadline = Deadline(budget, disconnected) if budget is not None else None
+    _current.set(deadline)
+    return deadline
+
+
+def current():
+    return _current.get()
+
+
+def finish():
+    _current.set(None)
+
+
+@contextmanager
+def stage(name, cap=None):
+    """
+    在截止时间内执行一个阶段，产出本阶段的超时时间（秒）
+
+    没有截止时间时直接产出 cap。阶段内抛出的异常（通常是上游客户端的超时）
+    如果发生在预算耗尽之后，会被转换为 DeadlineExceeded。
+    """
+    deadline = _current.get()
+    if deadline is None:
+        yield cap
+        return
+
+    timeout = deadline.timeout(name, cap)
+    deadline.current_stage = name
+    try:
+        yield timeout
+    except RequestAborted:
+        raise
+    except Exception as exc:
+        if deadline.remaining() < MIN_STAGE_BUDGET_S:
+            raise DeadlineExceeded(name, deadline) from exc
+        raise
+
+
+def socket_disconnected(sock) -> bool:
+    """
+    非阻塞地探测客户端是否已关闭连接（WSGI 下的尽力检测）
+
+    对端关闭时 recv(MSG_PEEK) 立即返回空字节；没有数据时抛出 BlockingIOError。
+    """
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
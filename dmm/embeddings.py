@@ -0,0 +1,509 @@
+"""
+评估结果的向量检索（"相关回忆"）
+
+每条归档的评估结果（标题 + 描述 + 正文）计算一个文本向量，L2 归一化后按行追加到磁盘上的
+float32 矩阵（EMBEDDING_PATH，np.memmap 映射，容量不足时翻倍扩展），行号与 evaluation_id 的对应
+关系追加写入同名 .ids 文件。/api/memories/<id>/related 取该条的向量与矩阵做一次矩阵乘法得到余弦
+相似度，返回最相似的 k 条。
+
+暴力检索的耗时随条数线性增长；平均耗时超过 RELATED_BRUTE_FORCE_MS 时在后台构建 IVF 近似索引
+（k-means 聚类中心 + 倒排列表），之后只在离查询最近的 RELATED_NPROBE 个簇内精确计算。
+构建之后新增的向量直接归入最近的簇，条数比构建时翻倍后重新聚类。
+
+向量由后台线程批量计算，不占用请求路径；启动时补算归档中还没有向量的条目。
+矩阵文件在后台线程启动后才打开，无法打开时（例如只读文件系统）记录错误并停用向量检索，
+/related 对所有条目返回 pending，不影响评估和归档。
+模型可插拔（EMBEDDING_MODEL）：
+    hashing        默认，本地特征哈希（英文词 + CJK 二元组），不需要网络，用于测试和离线环境
+    api:<model>    OpenAI 兼容的 /embeddings 接口（使用 OPENAI_API_KEY / OPENAI_API_BASE），如 api:BAAI/bge-m3
+其它实现（如本地 sentence-transformers）用 register_model() 注册。
+模型名称或维度与已有矩阵不一致时旧矩阵作废，从归档中重新计算。
+
+环境变量:
+    EMBEDDING_MODEL             向量模型，默认 hashing
+    EMBEDDING_DIM               hashing 模型的维度，默认 256
+    EMBEDDING_PATH              向量矩阵文件，默认 <DATA_DIR>/embeddings.f32（见 dmm.paths）；:memory: 表示不落盘
+    EMBEDDING_BATCH_MAX         单次批量计算的最大条数，默认 32
+    EMBEDDING_BATCH_WINDOW_MS   凑批的等待时间（毫秒），默认 200
+    RELATED_K_MAX               /related 返回的最大条数，默认 20
+    RELATED_BRUTE_FORCE_MS      暴力检索的平均耗时超过该值时构建近似索引，默认 5
+    RELATED_NPROBE              近似检索探查的簇数，默认 8
+"""
+
+import json
+import math
+import os
+import queue
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from dmm import accounting, metrics, paths
+from dmm.archive import stories, terms
+from dmm.config import OPENAI_API_BASE, OPENAI_API_KEY
+from dmm.log import get_logger
+
+log = get_logger("embeddings")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "hashing")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "256"))
+EMBEDDING_PATH = paths.data_path(os.getenv("EMBEDDING_PATH"), "embeddings.f32")
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", "32"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "200"))
+RELATED_K_MAX = int(os.getenv("RELATED_K_MAX", "20"))
+RELATED_BRUTE_FORCE_MS = float(os.getenv("RELATED_BRUTE_FORCE_MS", "5"))
+RELATED_NPROBE = int(os.getenv("RELATED_NPROBE", "8"))
+
+INITIAL_CAPACITY = 1024
+# 条数太少时聚类没有意义
+IVF_MIN_ROWS = 2048
+# 每个簇平均的向量数（决定簇数），以及 k-means 的采样量和迭代次数
+IVF_ROWS_PER_LIST = 256
+IVF_SAMPLE_PER_LIST = 32
+IVF_ITERATIONS = 10
+# 构建之后条数增长到该倍数时重新聚类
+IVF_REBUILD_GROWTH = 2.0
+# 暴力检索耗时的指数滑动平均平滑系数
+LATENCY_ALPHA = 0.2
+ASSIGN_CHUNK = 65536
+
+EMBEDDED = metrics.REGISTRY.counter(
+    "dmm_embeddings_total", "Embeddings computed by the background worker", ("model", "status"))
+RELATED_SECONDS = metrics.REGISTRY.histogram(
+    "dmm_related_seconds", "Related-memory lookup latency", ("index",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+
+def embedding_text(entry) -> str:
+    """参与计算向量的文本；预筛结果的标题和描述是固定文案，只用正文"""
+    if entry.get("screened"):
+        return entry.get("story") or ""
+    return "\n".join(part for part in (entry.get("title"), entry.get("description"), entry.get("story")) if part)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ============== 模型 ==============
+
+class HashingModel:
+    """特征哈希：词频取对数后按 crc32 散列到固定维度，符号位取自另一段哈希，减少碰撞偏差"""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            counts = {}
+            for term in terms(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                h = zlib.crc32(term.encode("utf-8"))
+                vectors[i, h % self.dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count))
+        return _normalize(vectors)
+
+
+class ApiModel:
+    """OpenAI 兼容的 /embeddings 接口，维度由第一次调用的返回确定"""
+
+    def __init__(self, model, dim=None):
+        from openai import OpenAI
+
+        self.model = model
+        self.name = f"api:{model}"
+        self.dim = dim
+        self.client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, max_retries=2)
+
+    def embed(self, texts):
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        if response.usage is not None:
+            accounting.record_llm(self.model, {"input_tokens": response.usage.prompt_tokens})
+        vectors = _normalize([item.embedding for item in sorted(response.data, key=lambda item: item.index)])
+        self.dim = vectors.shape[1]
+        return vectors
+
+
+_MODELS = {
+    "hashing": lambda arg: HashingModel(int(arg) if arg else EMBEDDING_DIM),
+    "api": lambda arg: ApiModel(arg),
+}
+
+
+def register_model(prefix, factory):
+    """注册模型：EMBEDDING_MODEL 为 prefix 或 prefix:arg 时调用 factory(arg)，返回带 name、dim、embed(texts) 的对象"""
+    _MODELS[prefix] = factory
+
+
+def load_model(spec=EMBEDDING_MODEL):
+    prefix, _, arg = spec.partition(":")
+    if prefix not in _MODELS:
+        raise ValueError(f"Unknown embedding model '{spec}', available: {', '.join(_MODELS)}")
+    return _MODELS[prefix](arg)
+
+
+# ============== 向量矩阵 ==============
+
+class VectorStore:
+    """
+    追加写入的 float32 矩阵（内存映射）和行号 → evaluation_id 映射
+
+    先写向量再追加 .ids，进程中断时最多丢失最后一批（下次启动补算），不会出现 ID 对应到未写完的行
+    """
+
+    def __init__(self, path=EMBEDDING_PATH):
+        self.path = path
+        self.model = None
+        self.dim = None
+        self.ids = []
+        self.rows = {}
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def open(self, model_name, dim):
+        """打开（或新建）与模型匹配的矩阵，模型不一致时清空"""
+        with self._lock:
+            self.model, self.dim = model_name, dim
+            if self.path == ":memory:":
+                self._matrix = np.zeros((INITIAL_CAPACITY, dim), dtype=np.float32)
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            meta = {}
+            if os.path.exists(self.path + ".meta.json"):
+                with open(self.path + ".meta.json", encoding="utf-8") as f:
+                    meta = json.load(f)
+            if meta != {"model": model_name, "dim": dim}:
+                if meta:
+                    log.warning("embeddings.reset", previous=meta, model=model_name, dim=dim)
+                for suffix in ("", ".ids"):
+                    if os.path.exists(self.path + suffix):
+                        os.remove(self.path + suffix)
+                with open(self.path + ".meta.json", "w", encoding="utf-8") as f:
+                    json.dump({"model": model_name, "dim": dim}, f)
+            if os.path.exists(self.path + ".ids"):
+                with open(self.path + ".ids", encoding="utf-8") as f:
+                    self.ids = [line.strip() for line in f if line.strip()]
+            row_bytes = dim * 4
+            on_disk = os.path.getsize(self.path) // row_bytes if os.path.exists(self.path) else 0
+            # .ids 比矩阵多出的行来自中断的写入，丢弃
+            self.ids = self.ids[:on_disk]
+            self.rows = {evaluation_id: row for row, evaluation_id in enumerate(self.ids)}
+            self._matrix = self._map(max(INITIAL_CAPACITY, on_disk))
+
+    def _map(self, capacity):
+        with open(self.path, "ab") as f:
+            if f.tell() < capacity * self.dim * 4:
+                f.truncate(capacity * self.dim * 4)
+        return np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def add(self, evaluation_ids, vectors):
+        with self._lock:
+            start = len(self.ids)
+            needed = start + len(evaluation_ids)
+            if needed > self._matrix.shape[0]:
+                capacity = max(needed, self._matrix.shape[0] * 2)
+                if self.path == ":memory:":
+                    grown = np.zeros((capacity, self.dim), dtype=np.float32)
+                    grown[:start] = self._matrix[:start]
+                    self._matrix = grown
+                else:
+                    self._matrix.flush()
+                    self._matrix = self._map(capacity)
+            self._matrix[start:needed] = vectors
+            if self.path != ":memory:":
+                self._matrix.flush()
+                with open(self.path + ".ids", "a", encoding="utf-8") as f:
+                    f.write("".join(f"{evaluation_id}\n" for evaluation_id in evaluation_ids))
+            # 列表只追加，读取方拿到的 (matrix, count) 快照始终一致
+            for offset, evaluation_id in enumerate(evaluation_ids):
+                self.ids.append(evaluation_id)
+                self.rows[evaluation_id] = start + offset
+            return start
+
+    def snapshot(self):
+        with self._lock:
+            return self._matrix, len(self.ids)
+
+
+# ============== 近似索引 ==============
+
+class IVFIndex:
+    """倒排文件索引：球面 k-means 聚类中心 + 每个簇的行号列表"""
+
+    def __init__(self, centroids, lists, built_rows):
+        self.centroids = centroids
+        self.lists = lists
+        self.extra = [[] for _ in lists]
+        self.built_rows = built_rows
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, matrix, count, seed=0):
+        rng = np.random.default_rng(seed)
+        nlist = max(1, count // IVF_ROWS_PER_LIST)
+        sample = np.array(matrix[np.sort(rng.choice(count, min(count, nlist * IVF_SAMPLE_PER_LIST), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(IVF_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=nlist) > 0
+            centroids[filled] = _normalize(sums[filled])
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, ASSIGN_CHUNK):
+            chunk = np.asarray(matrix[start:min(count, start + ASSIGN_CHUNK)])
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.cumsum(np.bincount(assignment, minlength=nlist))[:-1]
+        return cls(centroids, np.split(order, bounds), count)
+
+    def add(self, start, vectors):
+        """构建之后新增的向量归入最近的簇"""
+        nearest = np.argmax(vectors @ self.centroids.T, axis=1)
+        with self._lock:
+            for offset, cluster in enumerate(nearest):
+                self.extra[cluster].append(start + offset)
+
+    def candidates(self, query, nprobe=RELATED_NPROBE):
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        with self._lock:
+            parts = [self.lists[c] for c in probe] + [np.array(self.extra[c], dtype=np.int64) for c in probe]
+        return np.concatenate(parts)
+
+
+# ============== 检索 ==============
+
+class RelatedIndex:
+    """相关回忆检索：默认暴力计算，耗时超过阈值后切换到 IVF"""
+
+    def __init__(self, store, brute_force_ms=RELATED_BRUTE_FORCE_MS, nprobe=RELATED_NPROBE):
+        self.store = store
+        self.brute_force_ms = brute_force_ms
+        self.nprobe = nprobe
+        self.ivf = None
+        self._brute_ms = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def added(self, start, vectors):
+        """新向量写入矩阵后调用"""
+        ivf = self.ivf
+        if ivf is not None:
+            ivf.add(start, vectors)
+            if self.store.count >= ivf.built_rows * IVF_REBUILD_GROWTH:
+                self._start_build()
+
+    def related(self, evaluation_id, k=10):
+        """返回 [(evaluation_id, 相似度)]；该条还没有向量时抛出 KeyError"""
+        row = self.store.rows.get(evaluation_id)
+        if row is None:
+            raise KeyError(evaluation_id)
+        matrix, count = self.store.snapshot()
+        query = np.array(matrix[row])
+        ivf = self.ivf
+        started = time.perf_counter()
+        if ivf is not None:
+            candidates = ivf.candidates(query, self.nprobe)
+            candidates = candidates[candidates < count]
+            scores = np.asarray(matrix[candidates]) @ query
+        else:
+            candidates = None
+            scores = np.asarray(matrix[:count]) @ query
+        elapsed = time.perf_counter() - started
+        RELATED_SECONDS.observe(elapsed, index="ivf" if ivf is not None else "exact")
+        if ivf is None:
+            self._observe_brute_force(elapsed * 1000, count)
+
+        rows = candidates if candidates is not None else np.arange(count)
+        scores[rows == row] = -np.inf
+        k = min(k, len(scores) - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.store.ids[rows[i]], round(float(scores[i]), 4)) for i in top]
+
+    @property
+    def kind(self) -> str:
+        return "ivf" if self.ivf is not None else "exact"
+
+    def _observe_brute_force(self, elapsed_ms, count):
+        with self._lock:
+            self._brute_ms = elapsed_ms if self._brute_ms is None else (
+                self._brute_ms + LATENCY_ALPHA * (elapsed_ms - self._brute_ms))
+            slow = self._brute_ms > self.brute_force_ms
+        if slow and count >= IVF_MIN_ROWS:
+            self._start_build()
+
+    def _start_build(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._build, name="related-ivf", daemon=True).start()
+
+    def _build(self):
+        try:
+            matrix, count = self.store.snapshot()
+            started = time.perf_counter()
+            ivf = IVFIndex.build(matrix, count)
+            # 构建期间新增的行补进索引
+            matrix, latest = self.store.snapshot()
+            if latest > count:
+                ivf.add(count, np.asarray(matrix[count:latest]))
+            self.ivf = ivf
+            log.info("related.ivf_built", rows=count, lists=len(ivf.lists),
+                     seconds=round(time.perf_counter() - started, 2), brute_force_ms=self._brute_ms)
+        except Exception as e:
+            log.error("related.ivf_failed", error=str(e))
+        finally:
+            with self._lock:
+                self._building = False
+
+
+# ============== 后台计算 ==============
+
+class EmbeddingWorker:
+    """从队列中凑批计算向量并写入矩阵；启动时先补算归档中缺少向量的条目"""
+
+    def __init__(self, store, index, model_spec=EMBEDDING_MODEL,
+                 batch_max=EMBEDDING_BATCH_MAX, window_ms=EMBEDDING_BATCH_WINDOW_MS):
+        self.store = store
+        self.index = index
+        self.model_spec = model_spec
+        self.batch_max = batch_max
+        self.window_s = window_ms / 1000
+        self.model = None
+        self._queue = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name="embedding-worker", daemon=True).start()
+
+    def enqueue(self, evaluation_id, text):
+        self._queue.put((evaluation_id, text))
+
+    def flush(self):
+        """等待队列中的条目全部处理完"""
+        self._queue.join()
+
+    def _run(self):
+        try:
+            self.model = load_model(self.model_spec)
+            if self.model.dim is None:
+                self.model.embed(["dimension probe"])
+            self.store.open(self.model.name, self.model.dim)
+            self._backfill()
+        except Exception as e:
+            log.error("embeddings.start_failed", model=self.model_spec, path=self.store.path, error=str(e))
+            self.model = None
+            # 矩阵可能只打开了一半：清空行号映射，/related 一律返回 pending
+            self.store.ids, self.store.rows = [], {}
+        while True:
+            batch = [self._queue.get()]
+            deadline_at = time.monotonic() + self.window_s
+            while len(batch) < self.batch_max:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if self.model is not None:
+                    self._embed(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _embed(self, batch):
+        batch = [(evaluation_id, text) for evaluation_id, text in batch if evaluation_id not in self.store.rows]
+        if not batch:
+            return
+        try:
+            vectors = self.model.embed([text for _, text in batch])
+        except Exception as e:
+            # 未写入的条目在下次启动时补算
+            EMBEDDED.inc(len(batch), model=self.model.name, status="error")
+            log.error("embeddings.failed", model=self.model.name, batch=len(batch), error=str(e))
+            return
+        start = self.store.add([evaluation_id for evaluation_id, _ in batch], vectors)
+        self.index.added(start, vectors)
+        EMBEDDED.inc(len(batch), model=self.model.name, status="ok")
+
+    def _backfill(self):
+        pending = []
+        total = 0
+        for entry in stories.iter_stories():
+            if entry["evaluation_id"] in self.store.rows:
+                continue
+            pending.append((entry["evaluation_id"], embedding_text(entry)))
+            if len(pending) >= self.batch_max:
+                self._embed(pending)
+                total += len(pending)
+                pending = []
+        if pending:
+            self._embed(pending)
+            total += len(pending)
+        if total:
+            log.info("embeddings.backfilled", rows=total, model=self.model.name)
+
+
+vectors = VectorStore()
+related_index = RelatedIndex(vectors)
+worker = EmbeddingWorker(vectors, related_index)
+
+
+def start():
+    """启动后台计算线程（Web 应用启动时调用）"""
+    worker.start()
+
+
+def enqueue(evaluation, story):
+    """评估结果归档后调用，向量在后台计算"""
+    worker.enqueue(evaluation["evaluation_id"], embedding_text({
+        "screened": evaluation.get("screened"),
+        "title": evaluation.get("metadata_title"),
+        "description": evaluation.get("metadata_description"),
+        "story": story
+    }))
+
+
+def related(evaluation_id, k=10) -> dict:
+    """
+    与某条评估最相似的 k 条，附带归档中的标题、分数等字段
+
+    该条不在归档中时抛出 KeyError；已归档但向量尚未计算时返回 pending
+    """
+    try:
+        matches = related_index.related(evaluation_id, min(max(1, k), RELATED_K_MAX))
+    except KeyError:
+        if stories.get(evaluation_id) is None:
+            raise
+        return {"evaluation_id": evaluation_id, "pending": True, "related": []}
+    entries = stories.get_many(evaluation_id for evaluation_id, _ in matches)
+    return {
+        "evaluation_id": evaluation_id,
+        "index": related_index.kind,
+        "model": vectors.model,
+        "related": [dict(entries[match_id], similarity=similarity)
+                    for match_id, similarity in matches if match_id in entries]
+    }
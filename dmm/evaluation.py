@@ -0,0 +1,98 @@
+"""
+评估结果、图片请求和 NFT 元数据的处理
+
+不涉及任何网络调用，供 Flask 和 ASGI 两个版本共用
+"""
+
+import base64
+import json
+from datetime import datetime
+
+IMAGE_MODEL = "black-forest-labs/FLUX.1-schnell"
+IMAGE_SIZE = "1024x1024"
+IMAGE_STEPS = 20
+
+
+# ============== 评估结果 ==============
+
+def parse_evaluation(result_text: str) -> dict:
+    """解析模型返回的 JSON，兼容被 markdown 代码块包裹的情况"""
+    result_text = result_text.strip()
+
+    # 清理可能的 markdown 格式
+    if result_text.startswith("```"):
+        result_text = result_text.split("```")[1]
+        if result_text.startswith("json"):
+            result_text = result_text[4:]
+
+    return json.loads(result_text.strip())
+
+
+def finalize_evaluation(evaluation: dict, threshold: int) -> dict:
+    """补充时间戳和是否达到铸造标准"""
+    evaluation['timestamp'] = datetime.now().isoformat()
+    evaluation['should_mint'] = evaluation['score'] >= threshold
+    return evaluation
+
+
+# ============== 图片生成 ==============
+
+def build_image_payload(prompt: str, image_size: str = IMAGE_SIZE, steps: int = IMAGE_STEPS,
+                        batch_size: int = 1) -> dict:
+    """SiliconFlow 图片生成请求体（预览图使用更小的分辨率和步数，微批处理时 batch_size > 1）"""
+    return {
+        "model": IMAGE_MODEL,
+        "prompt": prompt,
+        "image_size": image_size,
+        "batch_size": batch_size,
+        "num_inference_steps": steps
+    }
+
+
+def extract_image_url(result: dict):
+    """从图片生成响应中取出第一张图片的 URL，没有则返回 None"""
+    if result.get('images') and len(result['images']) > 0:
+        return result['images'][0]['url']
+    return None
+
+
+def extract_image_urls(result: dict) -> list:
+    """取出批量生成的全部图片 URL"""
+    return [image['url'] for image in result.get('images') or [] if image.get('url')]
+
+
+# ============== NFT 元数据 ==============
+
+def build_nft_metadata(metadata: dict) -> dict:
+    """构建符合 NFT 标准的元数据"""
+    nft_metadata = {
+        "name": metadata.get('metadata_title', 'Untitled Memory'),
+        "description": metadata.get('metadata_description', ''),
+        "image": metadata.get('image_url', ''),
+        "attributes": [
+            {
+                "trait_type": "Score",
+                "value": metadata.get('score', 0)
+            },
+            {
+                "trait_type": "Timestamp",
+                "value": metadata.get('timestamp', '')
+            }
+        ]
+    }
+
+    # 如果有图片提示词，也加入属性
+    if metadata.get('image_prompt'):
+        nft_metadata['attributes'].append({
+            "trait_type": "Image Prompt",
+            "value": metadata.get('image_prompt', '')
+        })
+
+    return nft_metadata
+
+
+def encode_token_uri(nft_metadata: dict) -> str:
+    """将元数据转换为 base64 编码的 data URI"""
+    metadata_json = json.dumps(nft_metadata, ensure_ascii=False)
+    metadata_base64 = base64.b64encode(metadata_json.encode('utf-8')).decode('utf-8')
+    return f"data:application/json;base64,{metadata_base64}"
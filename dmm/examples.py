@@ -0,0 +1,32 @@
+"""
+示例故事
+"""
+
+EXAMPLE_STORIES = [
+    {
+        "title": "The Potter's Final Masterpiece",
+        "content": """In an ancient village lived an elderly potter. He had spent a lifetime shaping clay into vessels, firing memories into each creation. His hands were covered with cracks, like the textures on the pottery he crafted. All the young people had left for the cities, leaving only him to guard this dying craft.
+
+On a rainy night, he lit his kiln for the last time. In the firelight, he saw his entire life—the wonder of first touching clay as a child, the hardships of apprenticeship in his youth, and the solitude of his twilight years as a guardian. When villagers found him the next day, the pottery in the kiln had been perfectly fired, smooth as jade. The old man sat there quietly, a contented smile on his face, as if he himself had become his final masterpiece.
+
+The story spread throughout the region, and that last piece of pottery was sent to a museum. People say if you listen carefully, you can still hear the sound of the kiln fire burning within the vessel—a craftsman's most gentle conversation with time."""
+    },
+    {
+        "title": "The Library Night Watchman",
+        "content": """In the old quarter of the city stood a century-old library. Each night after closing, the watchman, Old Zhang, would patrol among the bookshelves. He said these books also needed company.
+
+One day, he discovered a yellowed diary tucked between two thick history books. The diary belonged to a young librarian who had protected books during wartime, risking her life to move precious ancient texts to safety. The last page read: "Knowledge is humanity's most precious treasure, worth protecting with our lives."
+
+Old Zhang placed this diary in the library's most prominent position. From then on, every visitor could read this story. People began to understand that protecting knowledge is not just a job—it's a legacy to be passed down."""
+    },
+    {
+        "title": "Grandmother's Recipe Book",
+        "content": """After my grandmother passed away, I found a handwritten recipe book in her old trunk. Each page recorded a dish's preparation method, with small drawings she had sketched herself. But what moved me most were the notes written after each recipe.
+
+"Braised pork—your grandfather's favorite. He'd always have an extra bowl of rice when I made this."
+"Sweet and sour ribs—your father was a picky eater as a child, so I made this to coax him."
+"Tomato and eggs—I made this specially to celebrate the day you were born."
+
+Each dish carried a story, a memory. I decided to learn all these recipes, not just because they were delicious, but because they were grandmother's code of love, left for me to decipher."""
+    }
+]
@@ -0,0 +1,292 @@
+"""
+归档的流式导出（NDJSON / CSV / Parquet）
+
+把归档中的全部评估结果（故事原文、分数、反馈、元数据、图片、链和 token id）导出给研究合作方。
+记录按写入顺序（归档 id）分批读取、逐批编码输出，内存占用只与批大小有关，与归档总量无关。
+
+每条记录带 cursor 字段（归档 id）。导出可以从任意 cursor 之后继续：
+    - 下载中断时，取最后一条完整记录的 cursor 重新请求 cursor=<该值>
+    - 指定 limit 时只导出一页，响应头 X-Export-Next-Cursor 给出下一页的 cursor（没有下一页时不返回）
+Parquet 文件只有写完才能读取，大量数据建议配合 limit 分页导出。
+
+过滤参数：since / until（Unix 时间戳或 ISO 日期，until 为日期时包含当天）、min_score / max_score、
+should_mint、minted（true 只导出已铸造的记录）。
+
+环境变量:
+    EXPORT_BATCH_ROWS   每次从数据库读取并编码的条数（也是 Parquet 的 row group 大小），默认 2000
+
+用法:
+    GET /admin/export?format=ndjson&minted=true              （需要管理令牌）
+    python -m dmm.export --format parquet --output memories.parquet --since 2026-01-01 --min-score 80
+    python -m dmm.export --format ndjson --output memories.ndjson --append --cursor 120000
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+from dmm import metrics
+from dmm.archive import parse_time, stories
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet"
+}
+EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "parquet": "parquet"}
+NEXT_CURSOR_HEADER = "X-Export-Next-Cursor"
+
+# (字段, Parquet 类型)
+FIELDS = (
+    ("cursor", "int64"),
+    ("evaluation_id", "string"),
+    ("created_at", "string"),
+    ("score", "int64"),
+    ("should_mint", "bool_"),
+    ("screened", "bool_"),
+    ("title", "string"),
+    ("description", "string"),
+    ("feedback", "string"),
+    ("story", "string"),
+    ("image_prompt", "string"),
+    ("image_url", "string"),
+    ("chain", "string"),
+    ("tx_hash", "string"),
+    ("token_id", "int64"),
+    ("minted_at", "string")
+)
+FIELD_NAMES = tuple(name for name, _ in FIELDS)
+
+EXPORTED = metrics.REGISTRY.counter("dmm_export_rows_total", "Archived stories exported", ("format",))
+
+
+class ExportUnavailable(Exception):
+    """请求的格式缺少依赖"""
+
+    status_code = 501
+
+    def to_dict(self) -> dict:
+        return {"error": str(self)}
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+def record(row) -> dict:
+    """导出的一条记录（与 FIELDS 顺序一致）"""
+    return {
+        "cursor": row["id"],
+        "evaluation_id": row["evaluation_id"],
+        "created_at": _iso(row["created_at"]),
+        "score": row["score"],
+        "should_mint": bool(row["should_mint"]),
+        "screened": bool(row["screened"]),
+        "title": row["title"],
+        "description": row["description"],
+        "feedback": row["feedback"],
+        "story": row["story"],
+        "image_prompt": row["image_prompt"],
+        "image_url": row["image_url"],
+        "chain": row["chain"],
+        "tx_hash": row["tx_hash"],
+        "token_id": row["token_id"],
+        "minted_at": _iso(row["minted_at"])
+    }
+
+
+def export_params(args) -> dict:
+    """
+    解析导出参数（两个 Web 应用和命令行共用），参数错误时抛出 ValueError
+
+    format, cursor, limit, since, until, min_score, max_score, should_mint, minted
+    """
+    def optional_int(name):
+        value = args.get(name)
+        return int(value) if value not in (None, "") else None
+
+    def optional_bool(name):
+        value = args.get(name)
+        if value in (None, ""):
+            return None
+        return str(value).lower() in ("1", "true", "yes")
+
+    export_format = (args.get("format") or "ndjson").lower()
+    if export_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    limit = optional_int("limit")
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    return {
+        "format": export_format,
+        "cursor": max(0, optional_int("cursor") or 0),
+        "limit": limit,
+        "filters": {
+            "min_score": optional_int("min_score"),
+            "max_score": optional_int("max_score"),
+            "since": parse_time(args.get("since")),
+            "until": parse_time(args.get("until"), end_of_day=True),
+            "should_mint": optional_bool("should_mint"),
+            "minted": optional_bool("minted")
+        }
+    }
+
+
+# ============== 编码 ==============
+
+def _ndjson(batches, header):
+    for batch in batches:
+        yield "".join(json.dumps(record(row), ensure_ascii=False) + "\n" for row in batch).encode("utf-8"), batch
+
+
+def _csv(batches, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FIELD_NAMES)
+        yield buffer.getvalue().encode("utf-8"), []
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in batch:
+            writer.writerow(record(row).values())
+        yield buffer.getvalue().encode("utf-8"), batch
+
+
+def _parquet_schema():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ExportUnavailable("Parquet export requires pyarrow: pip install pyarrow")
+    return pa.schema([(name, getattr(pa, kind)()) for name, kind in FIELDS])
+
+
+def _parquet(batches, header):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    # 每批写成一个 row group，写完立即取出已编码的字节，缓冲区只保存一批
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    for batch in batches:
+        records = [record(row) for row in batch]
+        writer.write_table(pa.Table.from_pylist(records, schema=schema))
+        yield drain(), batch
+    writer.close()
+    yield drain(), []
+
+
+_ENCODERS = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}
+
+
+class ExportStream:
+    """
+    可迭代的导出字节流；rows 和 cursor 为已交给调用方的条数和最后一条的 cursor
+
+    cursor 在调用方取走一段数据之后才前进，中断时用它继续导出不会遗漏记录
+    """
+
+    def __init__(self, export_format, cursor=0, through=None, filters=None, header=True,
+                 batch=EXPORT_BATCH_ROWS):
+        if export_format == "parquet":
+            _parquet_schema()
+        self.format = export_format
+        self.cursor = cursor
+        self.rows = 0
+        self._chunks = _ENCODERS[export_format](
+            stories.export_batches(after_id=cursor, through_id=through, batch=batch, **(filters or {})), header)
+
+    def __iter__(self):
+        for data, batch in self._chunks:
+            if data:
+                yield data
+            if batch:
+                self.rows += len(batch)
+                self.cursor = batch[-1]["id"]
+                EXPORTED.inc(len(batch), format=self.format)
+
+
+def open_export(params, header=True):
+    """
+    按 export_params() 的结果创建导出流，返回 (ExportStream, 下一页的 cursor 或 None)
+
+    指定 limit 时先定位本页最后一条（只读取 id），本次导出到该条为止
+    """
+    through, next_cursor = None, None
+    if params["limit"]:
+        through, has_more = stories.export_page(params["cursor"], params["limit"], **params["filters"])
+        next_cursor = through if has_more else None
+    stream = ExportStream(params["format"], params["cursor"], through, params["filters"], header)
+    return stream, next_cursor
+
+
+def filename(export_format) -> str:
+    return f"memories-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{EXTENSIONS[export_format]}"
+
+
+# ============== 命令行 ==============
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="流式导出归档的评估结果")
+    parser.add_argument("--format", choices=tuple(FORMATS), default="ndjson")
+    parser.add_argument("--output", help="输出文件，默认标准输出")
+    parser.add_argument("--append", action="store_true",
+                        help="追加到已有文件（ndjson / csv，csv 不再写表头），配合 --cursor 续传")
+    parser.add_argument("--cursor", type=int, default=0, help="从该 cursor 之后开始导出")
+    parser.add_argument("--limit", type=int, help="最多导出的条数")
+    parser.add_argument("--since", help="起始时间（含），Unix 时间戳或 ISO 日期")
+    parser.add_argument("--until", help="结束时间，日期时包含当天")
+    parser.add_argument("--min-score", type=int)
+    parser.add_argument("--max-score", type=int)
+    parser.add_argument("--should-mint", choices=("true", "false"))
+    parser.add_argument("--minted", choices=("true", "false"), help="true 只导出已铸造的记录")
+    args = parser.parse_args(argv)
+
+    if args.append and (args.format == "parquet" or not args.output):
+        parser.error("--append requires --output and the ndjson or csv format")
+    try:
+        params = export_params({
+            "format": args.format, "cursor": args.cursor, "limit": args.limit,
+            "since": args.since, "until": args.until, "min_score": args.min_score,
+            "max_score": args.max_score, "should_mint": args.should_mint, "minted": args.minted
+        })
+        stream, next_cursor = open_export(params, header=not args.append)
+    except (ValueError, ExportUnavailable) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    output = open(args.output, "ab" if args.append else "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in stream:
+            output.write(data)
+    except KeyboardInterrupt:
+        print(f"\n⚠️  已中断：导出 {stream.rows} 条，用 --cursor {stream.cursor} 继续", file=sys.stderr)
+        return 130
+    finally:
+        if args.output:
+            output.close()
+        else:
+            output.flush()
+
+    print(f"✅ 导出 {stream.rows} 条，最后的 cursor: {stream.cursor}", file=sys.stderr)
+    if next_cursor is not None:
+        print(f"   下一页: --cursor {next_cursor}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
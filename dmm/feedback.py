@@ -0,0 +1,135 @@
+"""
+精简评估与按需生成的详细反馈
+
+完整评估的输出大部分是篇幅最长的 feedback，生成它占了评估耗时的大头，而很多用户并不查看。
+精简模式下 /api/evaluate 只让模型返回 score、metadata_title、metadata_description 和 image_prompt
+（见 dmm.prompts.LEAN_RUBRIC_EN），输出上限缩短为 LEAN_MAX_TOKENS：
+- 结果带 feedback_deferred，feedback 为 null；故事正文随评估结果保存在服务端（dmm.store）
+- 客户端需要时调用 GET /api/evaluate/<evaluation_id>/feedback，按已给出的分数生成详细反馈
+- 生成的反馈保存到评估结果并写入归档，重复调用直接返回，不再调用模型
+- 进程内存储中没有该评估时（请求落到其它实例、进程重启、超出 EVALUATION_STORE_SIZE 被淘汰）
+  从归档（dmm.archive）取故事、分数和标题，其它实例已生成的反馈也从归档返回
+- 同一条评估的并发请求只调用一次模型，其余请求等待同一个结果
+
+不涉及任何网络调用，Flask 和 ASGI 两个版本各自负责调用模型。
+
+环境变量:
+    EVALUATION_MODE      full / lean，默认 full（请求体中的 lean 字段可覆盖）
+    LEAN_MAX_TOKENS      精简评估的输出上限，默认 300
+    FEEDBACK_MAX_TOKENS  按需生成反馈的输出上限，默认 600
+"""
+
+import os
+import threading
+from concurrent.futures import Future
+
+from dmm import metrics
+from dmm.archive import stories
+from dmm.deadline import RequestAborted
+from dmm.store import evaluations
+
+EVALUATION_MODE = os.getenv("EVALUATION_MODE", "full").lower()
+LEAN_MAX_TOKENS = int(os.getenv("LEAN_MAX_TOKENS", "300"))
+FEEDBACK_MAX_TOKENS = int(os.getenv("FEEDBACK_MAX_TOKENS", "600"))
+
+# 完整评估的输出上限
+FULL_MAX_TOKENS = 800
+
+# 反馈请求: generated（调用模型生成）、cached（返回已保存的反馈）、joined（等待并发请求的生成结果）
+FEEDBACK_REQUESTS = metrics.REGISTRY.counter(
+    "dmm_feedback_requests_total", "On-demand feedback requests by outcome", ("outcome",))
+
+
+def lean_enabled(data) -> bool:
+    """请求体中的 lean 字段优先，否则使用 EVALUATION_MODE"""
+    value = (data or {}).get('lean')
+    return EVALUATION_MODE == "lean" if value is None else bool(value)
+
+
+def max_tokens(lean: bool) -> int:
+    return LEAN_MAX_TOKENS if lean else FULL_MAX_TOKENS
+
+
+def defer(evaluation: dict) -> dict:
+    """标记精简评估结果：反馈稍后按需生成"""
+    evaluation['feedback'] = None
+    evaluation['feedback_deferred'] = True
+    return evaluation
+
+
+def clean_feedback(text) -> str:
+    """整理模型返回的反馈文本，去掉可能的 markdown 代码块；为空时抛出 ValueError"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        # 去掉首行的代码块标记（可能带语言名）和结尾标记
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rstrip("`").strip()
+    if not text:
+        raise ValueError("Empty feedback from model")
+    return text
+
+
+# ============== 评估结果 ==============
+
+def lookup(evaluation_id):
+    """
+    生成反馈所需的评估结果（score、metadata_title、story_text、feedback），找不到时返回 None
+
+    先查进程内存储；没有或还没有反馈时查归档（同步读取 SQLite，ASGI 中在线程池调用）
+    """
+    evaluation = evaluations.get(evaluation_id)
+    if evaluation is not None and evaluation.get('feedback'):
+        return evaluation
+    row = stories.get(evaluation_id)
+    if row is None:
+        return evaluation
+    if evaluation is None:
+        evaluation = {"evaluation_id": evaluation_id, "score": row["score"], "metadata_title": row["title"] or ""}
+    evaluation['story_text'] = evaluation.get('story_text') or row["story"]
+    evaluation['feedback'] = evaluation.get('feedback') or row["feedback"]
+    return evaluation
+
+
+def save(evaluation_id, text):
+    """保存生成的反馈：写入进程内存储（仍在时）和归档"""
+    evaluations.update(evaluation_id, feedback=text, feedback_deferred=False)
+    stories.update(evaluation_id, feedback=text)
+
+
+# ============== 并发合并 ==============
+
+class InFlight:
+    """
+    按 evaluation_id 合并并发的反馈生成：第一个请求调用模型，其余请求等待同一个 Future
+
+    Flask 中用 future.result(timeout) 等待，ASGI 中用 asyncio.wrap_future 等待
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """返回 (future, leader)；leader 为 True 时由调用方生成并调用 finish()"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future, False
+            future = self._futures[key] = Future()
+            return future, True
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+            return
+        if not isinstance(error, Exception) or isinstance(error, RequestAborted):
+            # 发起生成的请求超时、断开或被取消：与等待方自己的预算无关，返回普通错误，客户端可以重试
+            error = RuntimeError("Feedback generation by a concurrent request did not finish")
+        future.set_exception(error)
+
+
+inflight = InFlight()
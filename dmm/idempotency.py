@@ -0,0 +1,190 @@
+"""
+铸造请求的幂等处理
+
+前端重试超时的 /api/mint 或用户重复点击时，同一份元数据不应再签名发送第二笔交易。
+每个铸造请求对应一个幂等键：
+    - 请求带 Idempotency-Key 头时使用该值（按客户端隔离）；同一个键配不同的元数据返回 422
+    - 否则由规范化后的 NFT 元数据（键排序的 JSON）计算 SHA-256，同一份记忆无论谁提交都只铸造一次
+
+处理之前先在本地 SQLite 中占用该键（INSERT，多个进程共享同一文件时同样互斥），
+交易签名后、发送前写入交易哈希，确认后保存完整响应。再次收到同一个键的请求时直接返回
+保存的结果（已确认）或 pending 状态和交易哈希（仍在等待），不访问 RPC。
+
+失败的请求不占用键：发送前出错时释放，交易回滚（status=0）时删除记录，可以重新铸造。
+已发送但在请求预算内没等到收据的交易保持 pending，由后台继续等待并补全结果。
+没有交易哈希的占用超过 MINT_CLAIM_STALE_S 视为进程中途退出，允许新的请求接管。
+
+数据库在第一次铸造时才打开（导入模块不创建文件）。文件无法打开时（例如只读文件系统）记录错误并
+退回进程内存储：同一进程内仍然去重，但不跨进程、不跨重启。
+
+环境变量:
+    MINT_IDEMPOTENCY_DB      SQLite 文件路径，默认 <DATA_DIR>/mints.db（见 dmm.paths）；:memory: 表示仅当前进程
+    MINT_IDEMPOTENCY_TTL_S   记录保留时间（秒），默认 2592000（30 天）
+    MINT_CLAIM_STALE_S       未发送交易的占用的过期时间（秒），默认 300
+    MINT_PENDING_TIMEOUT_S   后台等待收据的时间（秒），超过后确认交易已被丢弃或 nonce 已被占用才删除记录，默认 600
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dmm import metrics, paths
+from dmm.log import get_logger
+
+log = get_logger("idempotency")
+
+MINT_IDEMPOTENCY_DB = paths.data_path(os.getenv("MINT_IDEMPOTENCY_DB"), "mints.db")
+MINT_IDEMPOTENCY_TTL_S = float(os.getenv("MINT_IDEMPOTENCY_TTL_S", str(30 * 86400)))
+MINT_CLAIM_STALE_S = float(os.getenv("MINT_CLAIM_STALE_S", "300"))
+MINT_PENDING_TIMEOUT_S = float(os.getenv("MINT_PENDING_TIMEOUT_S", "600"))
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# 每占用这么多次清理一次过期记录
+PRUNE_EVERY = 500
+
+REQUESTS = metrics.REGISTRY.counter(
+    "dmm_mint_idempotency_total", "Mint requests by idempotency outcome", ("outcome",))
+
+
+class KeyConflict(Exception):
+    """同一个 Idempotency-Key 对应了不同的元数据"""
+
+    status_code = 422
+
+    def to_dict(self) -> dict:
+        return {"error": f"{HEADER} was already used with different metadata"}
+
+
+def metadata_hash(nft_metadata) -> str:
+    """规范化元数据（键排序、无多余空白）的 SHA-256"""
+    canonical = json.dumps(nft_metadata, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_key(header_value, client, request_hash) -> str:
+    """幂等键：客户端提供的键按客户端隔离，否则为元数据哈希"""
+    if header_value:
+        if len(header_value) > MAX_KEY_LENGTH:
+            raise ValueError(f"{HEADER} is longer than {MAX_KEY_LENGTH} characters")
+        return f"key:{client}:{header_value}"
+    return f"metadata:{request_hash}"
+
+
+def replay(record):
+    """已有记录的响应：(响应体, 状态码)"""
+    if record["status"] == "succeeded":
+        REQUESTS.inc(outcome="replayed")
+        return record["response"], 200
+    REQUESTS.inc(outcome="pending")
+    return dict(record["response"] or {"tx_hash": None}, pending=True), 202
+
+
+# ============== 本地存储 ==============
+
+class MintRequests:
+    """幂等键表：key → 状态、交易哈希和保存的响应"""
+
+    def __init__(self, path=MINT_IDEMPOTENCY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._claims = 0
+        self._conn = None
+
+    def _db(self):
+        """第一次使用时打开数据库（调用方持有 _lock）；文件无法打开时退回进程内存储"""
+        if self._conn is None:
+            try:
+                self._conn = self._open(self.path)
+            except (OSError, sqlite3.Error) as e:
+                log.error("idempotency.fallback_memory", path=self.path, error=str(e))
+                self._conn = self._open(":memory:")
+        return self._conn
+
+    @staticmethod
+    def _open(path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            # 多个进程可以同时占用同一个文件中的键
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mint_requests (
+                key TEXT PRIMARY KEY,
+                request_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                tx_hash TEXT,
+                response TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS mint_requests_created_at ON mint_requests (created_at);
+        """)
+        return conn
+
+    def claim(self, key, request_hash):
+        """
+        占用幂等键：成功时返回 None，由调用方执行铸造；键已被占用时返回已有记录
+
+        过期的记录和超时未发送交易的占用会被覆盖；键相同但 request_hash 不同时抛出 KeyConflict
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT request_hash, status, tx_hash, response, created_at, updated_at "
+                    "FROM mint_requests WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    request_hash_seen, status, tx_hash, response, created_at, updated_at = row
+                    expired = created_at < now - MINT_IDEMPOTENCY_TTL_S
+                    abandoned = status == "pending" and tx_hash is None and updated_at < now - MINT_CLAIM_STALE_S
+                    if not (expired or abandoned):
+                        if request_hash_seen != request_hash:
+                            REQUESTS.inc(outcome="conflict")
+                            raise KeyConflict(key)
+                        return {"key": key, "status": status, "tx_hash": tx_hash,
+                                "response": json.loads(response) if response else None}
+                conn.execute(
+                    "INSERT OR REPLACE INTO mint_requests (key, request_hash, status, created_at, updated_at) "
+                    "VALUES (?, ?, 'pending', ?, ?)", (key, request_hash, now, now))
+                self._claims += 1
+                if self._claims % PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM mint_requests WHERE created_at < ?",
+                                       (now - MINT_IDEMPOTENCY_TTL_S,))
+            finally:
+                conn.execute("COMMIT")
+        REQUESTS.inc(outcome="claimed")
+        return None
+
+    def sending(self, key, tx_hash, response):
+        """交易签名后、发送前调用：此后重复请求返回 pending 和交易哈希，占用不再被释放"""
+        self._update("UPDATE mint_requests SET tx_hash = ?, response = ?, updated_at = ? WHERE key = ?",
+                     (tx_hash, json.dumps(response), time.time(), key))
+
+    def complete(self, key, response):
+        """交易确认成功，保存完整响应"""
+        self._update("UPDATE mint_requests SET status = 'succeeded', response = ?, updated_at = ? WHERE key = ?",
+                     (json.dumps(response), time.time(), key))
+
+    def release(self, key):
+        """发送交易之前失败：释放占用（已发送或已完成的记录不受影响）"""
+        self._update("DELETE FROM mint_requests WHERE key = ? AND status = 'pending' AND tx_hash IS NULL", (key,))
+
+    def discard(self, key):
+        """交易回滚：删除记录，允许重新铸造"""
+        self._update("DELETE FROM mint_requests WHERE key = ?", (key,))
+
+    def _update(self, sql, params):
+        with self._lock:
+            self._db().execute(sql, params)
+
+
+mint_requests = MintRequests()
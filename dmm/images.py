@@ -0,0 +1,168 @@
+"""
+渐进式图片生成：最终图片缓存与后台渲染任务
+
+渐进模式下 /api/evaluate 先用少步数、低分辨率生成预览图并立即返回，
+同时在后台渲染完整质量的图片；客户端通过 /api/images/<job_id> 查询任务，
+渲染完成后用最终图片替换预览图。最终图片按 image_prompt 缓存，
+相同提示词的后续请求直接复用，正在渲染的相同提示词共用同一个任务。
+
+图片只为达到铸造标准的评估结果生成，且默认不在 /api/evaluate 的关键路径上：
+- deferred（默认）: 评估结果带 image_deferred，客户端调用 POST /api/image 按 evaluation_id 生成
+- background: /api/evaluate 返回前启动后台渲染任务，客户端通过 image_job 查询
+- eager: 旧行为，/api/evaluate 内为所有带提示词的结果同步生成图片
+
+不涉及任何网络调用，Flask 和 ASGI 两个版本各自负责调度上游请求。
+
+环境变量:
+    IMAGE_GENERATION        deferred / background / eager，默认 deferred
+    IMAGE_PROGRESSIVE       true 时默认启用渐进模式（请求体中的 progressive 字段可覆盖），默认 false
+    IMAGE_PREVIEW_SIZE      预览图分辨率，默认 512x512
+    IMAGE_PREVIEW_STEPS     预览图推理步数，默认 4
+    IMAGE_CACHE_TTL_S       最终图片缓存时间（秒），默认 3600（服务商返回的图片链接会过期）
+    IMAGE_CACHE_SIZE        缓存的提示词数量上限，默认 1000
+    IMAGE_JOB_BUFFER_SIZE   保留的渲染任务数量，默认 500
+    IMAGE_RENDER_WORKERS    Flask 版本后台渲染线程数，默认 8
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+IMAGE_GENERATION = os.getenv("IMAGE_GENERATION", "deferred").lower()
+IMAGE_PROGRESSIVE = os.getenv("IMAGE_PROGRESSIVE", "false").lower() in ("1", "true", "yes")
+IMAGE_PREVIEW_SIZE = os.getenv("IMAGE_PREVIEW_SIZE", "512x512")
+IMAGE_PREVIEW_STEPS = int(os.getenv("IMAGE_PREVIEW_STEPS", "4"))
+IMAGE_CACHE_TTL_S = float(os.getenv("IMAGE_CACHE_TTL_S", "3600"))
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "1000"))
+IMAGE_JOB_BUFFER_SIZE = int(os.getenv("IMAGE_JOB_BUFFER_SIZE", "500"))
+IMAGE_RENDER_WORKERS = int(os.getenv("IMAGE_RENDER_WORKERS", "8"))
+
+
+def cache_key(prompt) -> str:
+    return " ".join(str(prompt).split())
+
+
+def progressive_enabled(data) -> bool:
+    """请求体中的 progressive 字段优先，否则使用 IMAGE_PROGRESSIVE"""
+    value = (data or {}).get('progressive')
+    return IMAGE_PROGRESSIVE if value is None else bool(value)
+
+
+# ============== 最终图片缓存 ==============
+
+class ImageCache:
+    """按提示词缓存最终图片 URL（LRU + TTL）"""
+
+    def __init__(self, ttl=IMAGE_CACHE_TTL_S, maxsize=IMAGE_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, prompt):
+        key = cache_key(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url
+
+    def put(self, prompt, url):
+        if not url:
+            return
+        key = cache_key(prompt)
+        with self._lock:
+            self._entries[key] = (url, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+# ============== 后台渲染任务 ==============
+
+class JobStore:
+    """
+    渲染任务登记表
+
+    任务状态: rendering（渲染中）→ done / failed
+    """
+
+    def __init__(self, maxlen=IMAGE_JOB_BUFFER_SIZE):
+        self.maxlen = maxlen
+        self._jobs = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def find_or_create(self, prompt):
+        """返回 (job, created)；相同提示词正在渲染时复用已有任务"""
+        key = cache_key(prompt)
+        with self._lock:
+            job_id = self._inflight.get(key)
+            if job_id is not None and job_id in self._jobs:
+                return dict(self._jobs[job_id]), False
+
+            now = datetime.now().isoformat()
+            job = {
+                "id": uuid.uuid4().hex,
+                "status": "rendering",
+                "image_prompt": prompt,
+                "preview_url": None,
+                "image_url": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now
+            }
+            self._jobs[job["id"]] = job
+            self._inflight[key] = job["id"]
+            while len(self._jobs) > self.maxlen:
+                self._jobs.popitem(last=False)
+            return dict(job), True
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=datetime.now().isoformat())
+            if job["status"] != "rendering":
+                key = cache_key(job["image_prompt"])
+                if self._inflight.get(key) == job_id:
+                    del self._inflight[key]
+            return dict(job)
+
+    def set_preview(self, job_id, preview_url):
+        return self._update(job_id, preview_url=preview_url)
+
+    def complete(self, job_id, image_url):
+        return self._update(job_id, status="done", image_url=image_url)
+
+    def fail(self, job_id, error):
+        return self._update(job_id, status="failed", error=error)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+
+cache = ImageCache()
+jobs = JobStore()
+
+
+def apply_job(evaluation: dict, job: dict) -> dict:
+    """把任务当前状态写入评估结果：已完成时直接给出最终图片，否则给出预览图和任务 ID"""
+    if job["status"] == "done":
+        evaluation['image_url'] = job["image_url"]
+        return evaluation
+    evaluation['image_url'] = job["preview_url"]
+    evaluation['image_preview'] = True
+    evaluation['image_job'] = job["id"]
+    return evaluation
@@ -0,0 +1,438 @@
+"""
+上游并发的自适应限制（AIMD）
+
+服务商在并发过高时返回 429 或 5xx，以前只能从失败的评估和图片请求中发现。
+每个上游（llm、image）一个限制器，限制同时发出的调用数：
+    慢启动  第一次减小之前，调用成功、耗时正常且并发已用满时上限 +1（每轮约翻倍）
+    加性增  之后同样条件下上限增加 1 / 上限（每用满一轮约 +1）
+    乘性减  429、5xx、超时或近期耗时超过基线的 CONCURRENCY_LATENCY_TOLERANCE 倍时，上限乘以 CONCURRENCY_BACKOFF；
+            同一批并发失败只减一次（两次减小之间至少间隔一个基线耗时）
+耗时基线是健康调用耗时的指数滑动平均（下降快、上升慢，接近上游无排队时的耗时）；
+近期耗时是最近调用耗时的滑动平均，单个长尾调用（如输出很长的评估）不会触发减小。
+超出上限的调用按先来先到排队等待，不直接失败；收到 429 的调用等待一个基线耗时后重新排队，
+最多重试 THROTTLE_RETRIES 次。排队时间计入请求预算，预算耗尽时抛出 DeadlineExceeded
+（阶段名为 <上游>_queue）。429 由限制器处理，不计入熔断器的失败率。
+
+当前上限、在途和排队数见 dmm_concurrency_limit / dmm_concurrency_in_flight / dmm_concurrency_queued
+指标和 /api/status 的 limits 字段。
+
+环境变量:
+    ADAPTIVE_LIMITS_ENABLED          是否启用，默认 true
+    LLM_CONCURRENCY_INITIAL          LLM 的初始并发上限，默认 8
+    LLM_CONCURRENCY_MAX              LLM 的最大并发上限，默认 64
+    IMAGE_CONCURRENCY_INITIAL        图片的初始并发上限，默认 4
+    IMAGE_CONCURRENCY_MAX            图片的最大并发上限，默认 16
+    CONCURRENCY_MIN                  并发上限的下限，默认 1
+    CONCURRENCY_BACKOFF              乘性减的系数，默认 0.5
+    CONCURRENCY_LATENCY_TOLERANCE    耗时超过基线该倍数视为过载，默认 2.5
+    THROTTLE_RETRIES                 收到 429 后重新排队的次数，默认 2
+
+用法:
+    for attempt in limits.attempts("llm"):
+        with attempt, metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout:
+            response = client.chat.completions.create(..., timeout=timeout)
+
+    for attempt in limits.attempts("llm"):
+        async with attempt:
+            with metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout:
+                ...
+
+限制器放在 deadline.stage 之外，上游超时在排队结束后才计算。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from dmm import deadline, metrics
+from dmm.deadline import ClientDisconnected, DeadlineExceeded
+from dmm.log import get_logger
+
+log = get_logger("limits")
+
+ADAPTIVE_LIMITS_ENABLED = os.getenv("ADAPTIVE_LIMITS_ENABLED", "true").lower() in ("1", "true", "yes")
+CONCURRENCY_MIN = int(os.getenv("CONCURRENCY_MIN", "1"))
+CONCURRENCY_BACKOFF = float(os.getenv("CONCURRENCY_BACKOFF", "0.5"))
+CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("CONCURRENCY_LATENCY_TOLERANCE", "2.5"))
+THROTTLE_RETRIES = int(os.getenv("THROTTLE_RETRIES", "2"))
+
+LIMITS = {
+    "llm": (int(os.getenv("LLM_CONCURRENCY_INITIAL", "8")), int(os.getenv("LLM_CONCURRENCY_MAX", "64"))),
+    "image": (int(os.getenv("IMAGE_CONCURRENCY_INITIAL", "4")), int(os.getenv("IMAGE_CONCURRENCY_MAX", "16"))),
+}
+
+# 健康调用数达到该值后才用耗时基线判断过载
+MIN_LATENCY_SAMPLES = 10
+# 耗时基线的平滑系数：比基线快时快速跟随，慢时缓慢跟随，基线接近无排队时的耗时，
+# 不会随着上游排队逐渐抬高
+LATENCY_ALPHA_DOWN = 0.3
+LATENCY_ALPHA_UP = 0.02
+# 近期耗时的平滑系数
+RECENT_ALPHA = 0.2
+# 还没有耗时基线时，两次乘性减之间的最短间隔（秒）；有基线后间隔为一个基线耗时
+MIN_DECREASE_INTERVAL_S = 1.0
+
+CONCURRENCY_LIMIT = metrics.REGISTRY.gauge(
+    "dmm_concurrency_limit", "Adaptive concurrency limit for each upstream", ("upstream",))
+IN_FLIGHT = metrics.REGISTRY.gauge(
+    "dmm_concurrency_in_flight", "Upstream calls in flight", ("upstream",))
+QUEUED = metrics.REGISTRY.gauge(
+    "dmm_concurrency_queued", "Upstream calls waiting for a concurrency slot", ("upstream",))
+QUEUE_SECONDS = metrics.REGISTRY.histogram(
+    "dmm_concurrency_queue_seconds", "Time spent waiting for a concurrency slot", ("upstream",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30))
+DECREASES = metrics.REGISTRY.counter(
+    "dmm_concurrency_decreases_total", "Multiplicative decreases of the concurrency limit", ("upstream", "reason"))
+RETRIES = metrics.REGISTRY.counter(
+    "dmm_concurrency_throttle_retries_total", "Throttled upstream calls queued again", ("upstream",))
+
+
+def signal(exc) -> str:
+    """
+    一次调用结果对应的信号：ok、throttled（429）、error（5xx）、timeout、deadline、cancelled，或 None
+
+    预算耗尽（deadline）只按耗时判断；客户端断开和任务取消（cancelled）、熔断、4xx 等（None）不调整上限。
+    状态码只取自上游客户端（openai、aiohttp、requests）的异常：本项目自己的异常（如熔断的
+    CircuitOpen 503、预算用完的 BudgetExceeded 429）的 status_code 是返回给客户端的状态码，
+    调用并未到达上游，不能当作上游的 5xx / 429。
+    """
+    if exc is None:
+        return "ok"
+    if isinstance(exc, (ClientDisconnected, asyncio.CancelledError)):
+        return "cancelled"
+    if isinstance(exc, DeadlineExceeded):
+        return "deadline"
+    if _is_local(exc):
+        return None
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        if status == 429:
+            return "throttled"
+        if status >= 500:
+            return "error"
+        return None
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(exc).__name__:
+        return "timeout"
+    return None
+
+
+def _is_local(exc) -> bool:
+    """本项目定义的异常（dmm.*），不是上游返回的错误"""
+    return type(exc).__module__.split(".")[0] == "dmm"
+
+
+def absorbs(exc) -> bool:
+    """启用时由限制器处理的异常（429）：熔断器不计为失败，由限制器降低并发"""
+    return ADAPTIVE_LIMITS_ENABLED and exc is not None and signal(exc) == "throttled"
+
+
+class _Waiter:
+    """排队中的一个调用；granted 在锁内设置，唤醒方式取决于同步还是异步等待"""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.abandoned = False
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.loop = loop
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdaptiveLimiter:
+    """单个上游的 AIMD 并发限制器，线程安全，同步和异步代码共用"""
+
+    def __init__(self, name, initial, max_limit, min_limit=CONCURRENCY_MIN, backoff=CONCURRENCY_BACKOFF,
+                 latency_tolerance=CONCURRENCY_LATENCY_TOLERANCE):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._waiters = deque()
+        self._latency = None
+        self._recent = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        # 慢启动阈值：上限低于该值时每次成功 +1，第一次减小后设为减小后的上限
+        self._threshold = float(self.max_limit)
+        self._lock = threading.Lock()
+        CONCURRENCY_LIMIT.set(self.limit, upstream=name)
+
+    def _capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    # ---------- 占用与归还 ----------
+
+    def _try_acquire(self, loop=None):
+        """有空位且没有人排队时直接占用（返回 None），否则排队并返回 _Waiter"""
+        with self._lock:
+            if self.in_flight < self._capacity() and not self._waiters:
+                self.in_flight += 1
+                IN_FLIGHT.set(self.in_flight, upstream=self.name)
+                return None
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            QUEUED.set(len(self._waiters), upstream=self.name)
+            return waiter
+
+    def _abandon(self, waiter) -> bool:
+        """等待超时或取消：仍在排队时移出队列并返回 False；已经分到空位时返回 True（由调用方归还）"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.abandoned = True
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            QUEUED.set(len(self._waiters), upstream=self.name)
+            return False
+
+    def _grant(self):
+        """（持有锁）把空位按顺序交给排队的调用"""
+        while self._waiters and self.in_flight < self._capacity():
+            waiter = self._waiters.popleft()
+            if waiter.abandoned:
+                continue
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+        IN_FLIGHT.set(self.in_flight, upstream=self.name)
+        QUEUED.set(len(self._waiters), upstream=self.name)
+
+    def acquire(self, timeout=None) -> bool:
+        """同步占用一个空位，timeout 内没有空位时返回 False"""
+        waiter = self._try_acquire()
+        if waiter is None:
+            return True
+        if waiter.event.wait(timeout):
+            return True
+        if self._abandon(waiter):
+            return True
+        return False
+
+    async def acquire_async(self, timeout=None) -> bool:
+        waiter = self._try_acquire(asyncio.get_running_loop())
+        if waiter is None:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                return True
+            return False
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release(0.0, "cancelled")
+            raise
+
+    def release(self, elapsed_s, result, saturated=True):
+        """归还空位，按调用结果调整上限（result 见 signal()）"""
+        with self._lock:
+            self.in_flight -= 1
+            self._adjust(elapsed_s, result, saturated)
+            self._grant()
+
+    # ---------- AIMD ----------
+
+    def _adjust(self, elapsed_s, result, saturated):
+        if result not in ("ok", "throttled", "error", "timeout", "deadline"):
+            return
+        if result in ("throttled", "error", "timeout"):
+            self._decrease(result, elapsed_s)
+            return
+        self._recent = elapsed_s if self._recent is None else self._recent + RECENT_ALPHA * (elapsed_s - self._recent)
+        if self._samples >= MIN_LATENCY_SAMPLES and self._recent > self._latency * self.latency_tolerance:
+            if self._decrease("latency", elapsed_s):
+                # 减小前发出的调用仍然偏慢，近期耗时从基线重新累计，避免连续减到下限
+                self._recent = self._latency
+            return
+        if result == "deadline":
+            return
+        self._samples += 1
+        if self._latency is None:
+            self._latency = elapsed_s
+        else:
+            alpha = LATENCY_ALPHA_DOWN if elapsed_s < self._latency else LATENCY_ALPHA_UP
+            self._latency += alpha * (elapsed_s - self._latency)
+        # 并发没有用满时上限不是瓶颈，不增加（否则空闲时会一直增长）
+        if saturated and self.limit < self.max_limit:
+            step = 1.0 if self.limit < self._threshold else 1.0 / self.limit
+            self.limit = min(self.max_limit, self.limit + step)
+            CONCURRENCY_LIMIT.set(round(self.limit, 3), upstream=self.name)
+
+    def _decrease(self, reason, elapsed_s) -> bool:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or MIN_DECREASE_INTERVAL_S):
+            return False
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._threshold = self.limit
+        CONCURRENCY_LIMIT.set(round(self.limit, 3), upstream=self.name)
+        DECREASES.inc(upstream=self.name, reason=reason)
+        log.warning("limits.decreased", upstream=self.name, reason=reason, previous=round(previous, 2),
+                    limit=round(self.limit, 2), elapsed_ms=round(elapsed_s * 1000),
+                    baseline_ms=round(self._latency * 1000) if self._latency else None)
+        return True
+
+    def backoff_delay(self) -> float:
+        """429 后重新排队前的等待时间：一个基线耗时（还没有基线时为 MIN_DECREASE_INTERVAL_S）"""
+        return self._latency or MIN_DECREASE_INTERVAL_S
+
+    def slot(self):
+        """占用一个空位的上下文管理器，with 和 async with 都可用"""
+        return _Slot(self)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "baseline_ms": round(self._latency * 1000, 1) if self._latency else None
+            }
+
+
+class _Slot:
+    """
+    AdaptiveLimiter.slot() 的上下文管理器：排队时间计入请求预算，结束时按结果调整上限
+
+    retry 为 True 时吞掉 429（throttled 置为 True），由 attempts() 重新排队；
+    delay 为重新排队前的等待时间（秒），同样计入请求预算
+    """
+
+    retry = False
+    throttled = False
+    delay = 0.0
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def _wait_timeout(self):
+        current = deadline.current()
+        return current.timeout(self._stage) if current is not None else None
+
+    def _delay(self):
+        if not self.delay:
+            return 0.0
+        timeout = self._wait_timeout()
+        return self.delay if timeout is None else min(self.delay, timeout)
+
+    @property
+    def _stage(self) -> str:
+        return f"{self.limiter.name}_queue"
+
+    def _acquired(self, started, ok):
+        waited = time.monotonic() - started
+        QUEUE_SECONDS.observe(waited, upstream=self.limiter.name)
+        if not ok:
+            raise DeadlineExceeded(self._stage, deadline.current())
+        with self.limiter._lock:
+            self.saturated = waited > 0.001 or self.limiter.in_flight >= self.limiter._capacity()
+        self.started = time.monotonic()
+
+    def __enter__(self):
+        started = time.monotonic()
+        time.sleep(self._delay())
+        self._acquired(started, self.limiter.acquire(self._wait_timeout()))
+        return self
+
+    def _released(self, exc) -> bool:
+        result = signal(exc)
+        self.limiter.release(time.monotonic() - self.started, result, self.saturated)
+        self.throttled = result == "throttled"
+        if self.throttled and self.retry:
+            RETRIES.inc(upstream=self.limiter.name)
+            return True
+        return False
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._released(exc)
+
+    async def __aenter__(self):
+        started = time.monotonic()
+        await asyncio.sleep(self._delay())
+        self._acquired(started, await self.limiter.acquire_async(self._wait_timeout()))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self._released(exc)
+
+
+class _Unlimited:
+    """关闭自适应限制时的空上下文管理器"""
+
+    throttled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+# ============== 注册表 ==============
+
+_limiters = {name: AdaptiveLimiter(name, initial, max_limit) for name, (initial, max_limit) in LIMITS.items()}
+
+
+def get(name) -> AdaptiveLimiter:
+    return _limiters[name]
+
+
+def slot(name, enabled=True):
+    """
+    占用某个上游的一个并发空位
+
+    ADAPTIVE_LIMITS_ENABLED=false 或 enabled=False（例如由微批处理器的上游调用统一占用）时不限制
+    """
+    if not (ADAPTIVE_LIMITS_ENABLED and enabled):
+        return _Unlimited()
+    return _limiters[name].slot()
+
+
+def attempts(name, enabled=True, retries=THROTTLE_RETRIES):
+    """
+    依次产出 slot(name, enabled)：上游返回 429 时吞掉异常，等待一个基线耗时后产出下一个（重新排队），
+    最后一次仍是 429 时异常照常抛出；其他结果结束迭代
+    """
+    for remaining in range(retries, -1, -1):
+        current = slot(name, enabled)
+        if isinstance(current, _Slot):
+            current.retry = remaining > 0
+            if remaining < retries:
+                current.delay = current.limiter.backoff_delay()
+        yield current
+        if not current.throttled:
+            return
+
+
+def snapshot() -> dict:
+    return {name: limiter.snapshot() for name, limiter in _limiters.items()}
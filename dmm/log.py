@@ -0,0 +1,177 @@
+"""
+非阻塞结构化日志
+
+请求线程只负责创建 LogRecord 并放入队列，格式化（包括 JSON 序列化和
+字符串插值）全部在后台 QueueListener 线程中完成。
+
+环境变量:
+    LOG_LEVEL        日志级别，默认 INFO
+    LOG_SAMPLE_RATE  低于 WARNING 的日志的采样率（0-1），默认 1.0
+    LOG_FORMAT       json（默认）或 text
+
+用法:
+    from dmm.log import get_logger
+    log = get_logger("web")
+    log.info("evaluate.done", score=90, duration_ms=1234.5)
+    log.debug("mint.metadata", metadata=nft_metadata)  # 未开启 DEBUG 时不会产生任何序列化开销
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+
+ROOT_LOGGER_NAME = "dmm"
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue = None
+
+
+# ============== 格式化（在后台线程执行）==============
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """适合本地开发阅读的单行文本格式"""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        fields = getattr(record, "fields", None) or {}
+        extras = " ".join(
+            f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items()
+        )
+        line = f"{timestamp} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if extras:
+            line = f"{line} {extras}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    不在调用线程中格式化的 QueueHandler
+
+    标准 QueueHandler.prepare() 会在调用线程里执行 format()，这里直接把原始记录入队，
+    由监听线程的处理器负责格式化。
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# ============== 初始化 ==============
+
+def _start_listener():
+    global _listener, _queue
+
+    _queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    _listener = QueueListener(_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(_queue))
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def _setup():
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is None:
+            _start_listener()
+            atexit.register(shutdown)
+            if hasattr(os, "register_at_fork"):
+                # 预加载后 fork 的 worker 进程中没有监听线程，需要重新启动
+                os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def _restart_in_child():
+    global _listener
+    _listener = None
+    _start_listener()
+
+
+def shutdown():
+    """刷新队列中剩余的日志并停止监听线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# ============== 结构化日志接口 ==============
+
+class StructuredLogger:
+    """
+    结构化日志记录器
+
+    级别和采样判断在创建 LogRecord 之前完成，被过滤的日志几乎没有开销。
+    WARNING 及以上级别不参与采样。
+    """
+
+    def __init__(self, name, sample_rate=None):
+        self._logger = logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+        self.sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    def is_enabled_for(self, level) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, event, fields, exc_info=None):
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields}, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name, sample_rate=None) -> StructuredLogger:
+    """获取 dmm.<name> 结构化日志记录器"""
+    _setup()
+    return StructuredLogger(name, sample_rate)
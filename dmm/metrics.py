@@ -0,0 +1,261 @@
+"""
+分阶段耗时指标
+
+- 进程内的 Counter / Gauge / Histogram，按 Prometheus 文本格式导出（/metrics）
+- stage() 上下文管理器同时记录直方图和当前请求的耗时明细，
+  请求结束时生成 Server-Timing 响应头
+
+当前请求的耗时明细保存在 contextvars 中，多线程（Flask）和协程（ASGI）下都互不干扰。
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认直方图桶（秒），覆盖从本地解析到 120 秒回执等待的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# ============== 指标类型 ==============
+
+class Counter:
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值（状态、并发上限等）"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """累积桶直方图（单位秒）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, dict(entry, buckets=list(entry["buckets"])))
+                           for key, entry in self._values.items())
+        lines = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(entry['sum'], 6))}")
+            lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """以 Prometheus 文本格式（version 0.0.4）导出全部指标"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "dmm_stage_duration_seconds", "Duration of each request stage",
+    ("endpoint", "stage", "upstream", "outcome"))
+STAGE_TOTAL = REGISTRY.counter(
+    "dmm_stage_total", "Number of executed request stages",
+    ("endpoint", "stage", "upstream", "outcome"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "dmm_request_duration_seconds", "End-to-end request duration",
+    ("endpoint", "status"))
+
+
+# ============== 请求级耗时明细 ==============
+
+class RequestTimings:
+    """一次请求内各阶段的耗时，用于生成 Server-Timing 头"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.entries = []
+
+    def add(self, stage, duration, upstream="", outcome="ok"):
+        self.entries.append((stage, duration, upstream, outcome))
+
+    def server_timing(self) -> str:
+        parts = []
+        for stage, duration, upstream, outcome in self.entries:
+            desc = upstream if outcome == "ok" else f"{upstream or stage} {outcome}"
+            part = f"{stage};dur={duration * 1000:.1f}"
+            if desc:
+                part += f';desc="{desc}"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("dmm_request_timings", default=None)
+
+
+def start_request(endpoint):
+    """在请求开始时调用，返回本次请求的 RequestTimings"""
+    timings = RequestTimings(endpoint or "unknown")
+    _current.set(timings)
+    return timings
+
+
+def current_request():
+    return _current.get()
+
+
+def finish_request(status_code):
+    """在请求结束时调用，记录端到端耗时并返回 Server-Timing 头的值"""
+    timings = _current.get()
+    if timings is None:
+        return None
+    _current.set(None)
+
+    REQUEST_SECONDS.observe(time.perf_counter() - timings.started,
+                            endpoint=timings.endpoint, status=f"{status_code // 100}xx")
+    return timings.server_timing()
+
+
+class _Stage:
+    def __init__(self):
+        self.outcome = "ok"
+
+
+@contextmanager
+def stage(name, upstream=""):
+    """
+    计量一个阶段的耗时
+
+    阶段内抛出异常时 outcome 记为 error（异常自带 outcome 属性时使用该值，
+    例如 deadline；协程被取消时记为 cancelled）；调用方也可以通过 `as s` 手动设置 s.outcome，
+    例如上游返回了空结果。
+    """
+    handle = _Stage()
+    started = time.perf_counter()
+    try:
+        yield handle
+    except BaseException as exc:
+        if isinstance(exc, asyncio.CancelledError):
+            handle.outcome = "cancelled"
+        else:
+            handle.outcome = getattr(exc, "outcome", "error")
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        timings = _current.get()
+        endpoint = timings.endpoint if timings else "background"
+        labels = {"endpoint": endpoint, "stage": name, "upstream": upstream, "outcome": handle.outcome}
+        STAGE_SECONDS.observe(duration, **labels)
+        STAGE_TOTAL.inc(**labels)
+        if timings is not None:
+            timings.add(name, duration, upstream, handle.outcome)
@@ -0,0 +1,165 @@
+"""
+多故事打包评估
+
+批量导入大量短故事（50–300 字符）时，每个故事单独评估都要重复发送同样的评分标准和 JSON 结构说明，
+大部分输入 token 和调用耗时花在这段固定前缀上。打包评估把若干短故事（各带一个 id）放进同一个提示词，
+要求模型返回 JSON 数组、每个故事一条结果（见 dmm.prompts.PACKED_RUBRIC_EN）：
+- 超过 PACK_MAX_STORY_CHARS 的故事不打包，单独评估
+- 每个提示词最多 PACK_MAX_STORIES 个故事，故事部分的估算 token 不超过 PACK_TOKEN_BUDGET
+- 数组中缺失、id 对不上或字段不完整的结果，对应的故事回退为单独评估
+
+不涉及任何网络调用，Flask、ASGI 和 Agent 各自负责调用模型。
+
+环境变量:
+    PACK_MAX_STORY_CHARS   参与打包的故事最大长度（字符），默认 300
+    PACK_MAX_STORIES       每个提示词最多包含的故事数，默认 8
+    PACK_TOKEN_BUDGET      每个提示词中故事部分的估算 token 上限，默认 1500
+    PACK_OUTPUT_TOKENS     每个故事预留的输出 token 数（max_tokens 按故事数计算），默认 350
+    BATCH_MAX_STORIES      一次批量评估请求最多包含的故事数，默认 50
+
+用法:
+    packs, singles = packing.plan(story_texts)
+    for pack in packs:
+        response = client.chat.completions.create(
+            messages=build_packed_messages([story_texts[i] for i in pack]),
+            max_tokens=packing.max_tokens(len(pack)), ...)
+        results = packing.parse_packed(response.choices[0].message.content, len(pack))
+        # results[k] 为 pack[k] 的评估结果，缺失的故事加入 singles 单独评估
+"""
+
+import os
+
+from dmm import metrics
+from dmm.evaluation import parse_evaluation
+
+PACK_MAX_STORY_CHARS = int(os.getenv("PACK_MAX_STORY_CHARS", "300"))
+PACK_MAX_STORIES = int(os.getenv("PACK_MAX_STORIES", "8"))
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "1500"))
+PACK_OUTPUT_TOKENS = int(os.getenv("PACK_OUTPUT_TOKENS", "350"))
+BATCH_MAX_STORIES = int(os.getenv("BATCH_MAX_STORIES", "50"))
+
+# Web 应用的评估结果字段；Agent 的中文评分标准只要求前三项
+FIELDS_EN = ("score", "metadata_title", "metadata_description", "feedback", "image_prompt")
+FIELDS_ZH = ("score", "metadata_title", "metadata_description")
+
+# 故事在打包提示词中的额外开销（id 和 JSON 结构）
+STORY_OVERHEAD_TOKENS = 12
+
+# 故事的去向: packed（打包评估成功）、fallback（打包结果缺失或无效，回退单独评估）、single（不适合打包）
+PACKED_STORIES = metrics.REGISTRY.counter(
+    "dmm_packed_stories_total", "Batch-evaluated stories by how they were evaluated", ("outcome",))
+PACK_SIZE = metrics.REGISTRY.histogram(
+    "dmm_pack_size", "Stories per packed evaluation prompt", buckets=(2, 3, 4, 6, 8, 12, 16))
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符每个约 1 个 token，其他字符每 4 个约 1 个 token"""
+    wide = sum(1 for char in text if ord(char) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def plan(story_texts: list) -> tuple:
+    """
+    按输入顺序把短故事装入打包提示词，返回 (packs, singles)
+
+    packs 为下标列表的列表（每组至少 2 个故事），singles 为需要单独评估的下标
+    """
+    packs, singles = [], []
+    current, used = [], 0
+    for index, text in enumerate(story_texts):
+        if len(text) > PACK_MAX_STORY_CHARS or PACK_MAX_STORIES < 2:
+            singles.append(index)
+            continue
+        tokens = estimate_tokens(text) + STORY_OVERHEAD_TOKENS
+        if current and (len(current) >= PACK_MAX_STORIES or used + tokens > PACK_TOKEN_BUDGET):
+            packs.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += tokens
+    if current:
+        packs.append(current)
+
+    # 只剩一个故事的组打包没有收益
+    for pack in [pack for pack in packs if len(pack) < 2]:
+        packs.remove(pack)
+        singles.extend(pack)
+    singles.sort()
+    PACKED_STORIES.inc(len(singles), outcome="single")
+    for pack in packs:
+        PACK_SIZE.observe(len(pack))
+    return packs, singles
+
+
+def max_tokens(count: int) -> int:
+    """打包提示词的输出上限"""
+    return PACK_OUTPUT_TOKENS * count
+
+
+def valid_evaluation(evaluation, fields=FIELDS_EN) -> bool:
+    """结果包含全部字段、分数为 0-100 的整数、文本字段非空"""
+    if not isinstance(evaluation, dict) or any(field not in evaluation for field in fields):
+        return False
+    score = evaluation["score"]
+    if isinstance(score, bool) or not isinstance(score, int) or not 0 <= score <= 100:
+        return False
+    return all(isinstance(evaluation[field], str) and evaluation[field].strip()
+               for field in fields if field != "score")
+
+
+def parse_packed(result_text: str, count: int, fields=FIELDS_EN) -> dict:
+    """
+    解析打包评估返回的 JSON 数组，返回 {故事在本组中的下标: 评估结果}
+
+    按 id 对应故事（id 为 "1".."count"）；无法解析时返回空 dict，无效或重复的条目被忽略
+    """
+    try:
+        items = parse_evaluation(result_text or "")
+    except ValueError:
+        return {}
+    if isinstance(items, dict):
+        # 部分模型会把数组包在一个对象里
+        items = next((value for value in items.values() if isinstance(value, list)), [])
+    if not isinstance(items, list):
+        return {}
+
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(str(item.get("id")).strip()) - 1
+        except ValueError:
+            continue
+        if not 0 <= index < count or index in results:
+            continue
+        evaluation = {key: value for key, value in item.items() if key != "id"}
+        if isinstance(evaluation.get("score"), float) and evaluation["score"].is_integer():
+            evaluation["score"] = int(evaluation["score"])
+        if valid_evaluation(evaluation, fields):
+            results[index] = evaluation
+    return results
+
+
+def record_pack(count: int, parsed: int):
+    """记录一组打包评估中成功和回退的故事数"""
+    PACKED_STORIES.inc(parsed, outcome="packed")
+    PACKED_STORIES.inc(count - parsed, outcome="fallback")
+
+
+def story_texts(stories) -> list:
+    """
+    批量评估请求中的故事列表，元素可以是字符串或 {"story_text": ...}；格式错误时抛出 ValueError
+    """
+    if not isinstance(stories, list) or not stories:
+        raise ValueError("stories must be a non-empty list")
+    if len(stories) > BATCH_MAX_STORIES:
+        raise ValueError(f"at most {BATCH_MAX_STORIES} stories per batch")
+    texts = []
+    for story in stories:
+        if isinstance(story, dict):
+            story = story.get("story_text")
+        if not isinstance(story, str):
+            raise ValueError("each story must be a string or an object with story_text")
+        texts.append(story.strip())
+    return texts
+
@@ -0,0 +1,32 @@
+"""
+本地数据文件的位置
+
+归档、向量索引和铸造幂等记录都写在数据目录下。相对路径以项目根目录为基准，
+与启动时的工作目录无关（在根目录启动和 cd web && python app.py 写入同一个 data/）。
+Serverless 平台（Vercel、AWS Lambda）上项目目录只读，默认改用临时目录（实例回收后清空）。
+
+环境变量:
+    DATA_DIR  数据目录，默认 <项目根目录>/data，serverless 上为 <临时目录>/dmm-data
+"""
+
+import os
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERLESS = bool(os.getenv("VERCEL") or os.getenv("AWS_LAMBDA_FUNCTION_NAME"))
+
+
+def resolve(path: str) -> str:
+    """:memory: 和绝对路径原样返回，相对路径以项目根目录为基准"""
+    if path == ":memory:" or os.path.isabs(path):
+        return path
+    return os.path.join(PROJECT_ROOT, path)
+
+
+DATA_DIR = resolve(os.getenv("DATA_DIR") or (
+    os.path.join(tempfile.gettempdir(), "dmm-data") if SERVERLESS else "data"))
+
+
+def data_path(configured, filename: str) -> str:
+    """数据文件路径：使用配置的路径（环境变量），没有配置时放在 DATA_DIR 下"""
+    return resolve(configured) if configured else os.path.join(DATA_DIR, filename)
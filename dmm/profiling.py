@@ -0,0 +1,176 @@
+"""
+按需请求性能剖析
+
+请求携带 `X-Profile: <ADMIN_TOKEN>` 头，或按 PROFILE_SAMPLE_RATE 随机抽中时，
+该请求会在剖析器下运行：
+
+- sampling（默认）：后台线程定时采集请求线程的调用栈，输出折叠栈格式
+  （flamegraph.pl / speedscope / inferno 可直接读取）
+- cprofile：确定性剖析，输出 pstats 二进制文件（snakeviz / flameprof 可读取）
+
+结果保存在固定大小的环形缓冲区中。未被剖析的请求只需读取一个请求头和一次随机数比较。
+
+环境变量:
+    ADMIN_TOKEN            管理令牌，同时用作 X-Profile 请求头的值
+    PROFILE_SAMPLE_RATE    随机剖析比例（0-1），默认 0
+    PROFILE_MODE           sampling 或 cprofile，默认 sampling
+    PROFILE_INTERVAL_MS    采样间隔（毫秒），默认 5
+    PROFILE_BUFFER_SIZE    保留的剖析结果数量，默认 50
+"""
+
+import cProfile
+import hmac
+import io
+import itertools
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+PROFILE_HEADER = "X-Profile"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sampling")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_BUFFER_SIZE = int(os.getenv("PROFILE_BUFFER_SIZE", "50"))
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_admin(token) -> bool:
+    """校验管理令牌（未配置 ADMIN_TOKEN 时一律拒绝）"""
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(str(token), ADMIN_TOKEN)
+
+
+def should_profile(header_value) -> bool:
+    """判断当前请求是否需要剖析"""
+    if header_value is not None:
+        return is_admin(header_value)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+# ============== 剖析器 ==============
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_PROJECT_ROOT):
+        filename = os.path.relpath(filename, _PROJECT_ROOT)
+    else:
+        filename = "/".join(filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+class SamplingProfiler:
+    """定时采集目标线程调用栈的采样剖析器"""
+
+    mode = "sampling"
+    content_type = "text/plain; charset=utf-8"
+    extension = "folded"
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self.samples = 0
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="dmm-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> bytes:
+        self._stop.set()
+        self._thread.join()
+        lines = (f"{stack} {count}" for stack, count in self.stacks.most_common())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class DeterministicProfiler:
+    """基于 cProfile 的确定性剖析器"""
+
+    mode = "cprofile"
+    content_type = "application/octet-stream"
+    extension = "pstats"
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self.samples = 0
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self) -> bytes:
+        self._profile.disable()
+        self._profile.create_stats()
+        self.samples = len(self._profile.stats)
+        buffer = io.BytesIO()
+        marshal.dump(self._profile.stats, buffer)
+        return buffer.getvalue()
+
+
+def start_profiler(mode=None):
+    """创建并启动一个剖析器"""
+    profiler = DeterministicProfiler() if (mode or PROFILE_MODE) == "cprofile" else SamplingProfiler()
+    profiler.start()
+    profiler.started_at = time.perf_counter()
+    return profiler
+
+
+# ============== 环形缓冲区 ==============
+
+class ProfileStore:
+    """保存最近 N 个剖析结果"""
+
+    def __init__(self, maxlen=PROFILE_BUFFER_SIZE):
+        self._entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def add(self, profiler, data, **info) -> dict:
+        entry = {
+            "id": next(self._ids),
+            "mode": profiler.mode,
+            "created_at": datetime.now().isoformat(),
+            "duration_ms": round((time.perf_counter() - profiler.started_at) * 1000, 1),
+            "samples": profiler.samples,
+            "size_bytes": len(data),
+            "filename": None,
+            **info
+        }
+        entry["filename"] = f"profile-{entry['id']}.{profiler.extension}"
+        with self._lock:
+            self._entries.append((entry, data, profiler.content_type))
+        return entry
+
+    def list(self) -> list:
+        with self._lock:
+            return [entry for entry, _, _ in reversed(self._entries)]
+
+    def get(self, profile_id):
+        """返回 (entry, data, content_type)，不存在时返回 None"""
+        with self._lock:
+            for item in self._entries:
+                if item[0]["id"] == profile_id:
+                    return item
+        return None
+
+
+store = ProfileStore()
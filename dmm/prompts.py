@@ -0,0 +1,168 @@
+"""
+故事评估提示词
+
+评分标准（_CRITERIA_EN / _CRITERIA_ZH）和 JSON 字段说明只定义一次，各场景的系统提示词由它们组合而成。
+评分标准、JSON 结构和输出要求放在固定不变的系统提示词中，故事正文单独放在用户消息里。
+"""
+
+import json
+
+# ============== 评分标准（静态部分）==============
+
+_ROLE_EN = "You are a professional literary critic and cultural archivist."
+_ROLE_ZH = "你是一位专业的文学评论家和文化档案管理员。"
+
+_CRITERIA_EN = """Scoring Criteria (0-100):
+- Emotional depth and authenticity (30 points)
+- Cultural and historical value (25 points)
+- Narrative quality and structure (20 points)
+- Originality and uniqueness (15 points)
+- Social significance and impact (10 points)"""
+
+_CRITERIA_ZH = """评分标准（0-100）：
+- 情感深度和真实性 (30分)
+- 文化和历史价值 (25分)
+- 叙事质量和结构 (20分)
+- 原创性和独特性 (15分)
+- 社会意义和影响力 (10分)"""
+
+# 评估结果的 JSON 字段
+_SCORE_EN = '"score": [integer from 0-100]'
+_TITLE_EN = '"metadata_title": "[Brief title, max 50 characters]"'
+_DESCRIPTION_EN = ('"metadata_description": "[Detailed description summarizing the core value '
+                   'and characteristics of the story, 100-200 characters]"')
+_FEEDBACK_EN = '"feedback": "[Detailed evaluation feedback explaining the scoring rationale]"'
+_IMAGE_PROMPT_EN = ('"image_prompt": "[English image generation prompt describing the core scene, atmosphere '
+                    'and visual elements of the story, suitable for AI art generation, 50-100 characters]"')
+_FIELDS_ZH = ('"score": [0-100的整数]',
+              '"metadata_title": "[简短标题，最多50字符]"',
+              '"metadata_description": "[详细描述，总结故事的核心价值和特点，100-200字符]"')
+
+_EVALUATE_EN = (f"{_ROLE_EN} Please evaluate the value of the humanistic story provided by the user "
+                "and return the assessment in JSON format. Always return valid JSON format.")
+_RETURN_JSON_EN = "Please return in strict JSON format (without any markdown formatting):"
+
+
+def _json_object(fields, indent=""):
+    """按 4 空格缩进排版的 JSON 对象模板"""
+    body = ",\n".join(f"{indent}    {field}" for field in fields)
+    return f"{indent}{{\n{body}\n{indent}}}"
+
+
+def _json_array(fields):
+    return f"[\n{_json_object(fields, '    ')}\n]"
+
+
+# Web 应用使用的英文评分标准（包含反馈和图片提示词）
+EVALUATION_RUBRIC_EN = f"""{_EVALUATE_EN}
+
+{_CRITERIA_EN}
+
+{_RETURN_JSON_EN}
+{_json_object((_SCORE_EN, _TITLE_EN, _DESCRIPTION_EN, _FEEDBACK_EN, _IMAGE_PROMPT_EN))}"""
+
+# Agent 使用的中文评分标准
+EVALUATION_RUBRIC_ZH = f"""{_ROLE_ZH}请评估用户提供的人文故事的价值，
+并以 JSON 格式返回评估结果。请始终返回有效的JSON格式。
+
+{_CRITERIA_ZH}
+
+请以严格的 JSON 格式返回（不要包含任何markdown格式或其他文字）：
+{_json_object(_FIELDS_ZH)}"""
+
+# 精简评估（见 dmm.feedback）：不生成篇幅最长的 feedback，输出上限可以大幅缩短
+LEAN_RUBRIC_EN = f"""{_EVALUATE_EN}
+
+{_CRITERIA_EN}
+
+{_RETURN_JSON_EN}
+{_json_object((_SCORE_EN, _TITLE_EN, _DESCRIPTION_EN, _IMAGE_PROMPT_EN))}"""
+
+# 按需生成的详细反馈：解释一个已经给出的分数，输出纯文本
+FEEDBACK_RUBRIC_EN = f"""{_ROLE_EN} The user provides a humanistic story together with the score it has already been given.
+
+{_CRITERIA_EN}
+
+Write detailed evaluation feedback explaining the scoring rationale against these criteria, consistent with the given score, including the story's strengths and what could be improved. Return only the feedback as plain text, without JSON or markdown formatting."""
+
+# 级联评估的预筛标准：只输出分数，供小模型快速估分
+SCREEN_RUBRIC_EN = f"""You are a literary critic screening humanistic stories for an archive. Estimate the value of the story provided by the user.
+
+{_CRITERIA_EN}
+
+Return only this JSON, without any other text or markdown formatting:
+{{"score": [integer from 0-100]}}"""
+
+# 打包评估（见 dmm.packing）：一次提交多个带 id 的短故事，按 id 返回 JSON 数组
+PACKED_RUBRIC_EN = f"""{_ROLE_EN} The user provides a JSON array of humanistic stories, each with an "id". Evaluate the value of each story independently, as if it were the only story provided, and return the assessments in JSON format. Always return valid JSON format.
+
+{_CRITERIA_EN}
+
+Please return a strict JSON array (without any markdown formatting) with exactly one object per story, in the same order, copying each story's id:
+{_json_array(('"id": "[id of the story]"', _SCORE_EN, _TITLE_EN, _DESCRIPTION_EN, _FEEDBACK_EN, _IMAGE_PROMPT_EN))}"""
+
+PACKED_RUBRIC_ZH = f"""{_ROLE_ZH}用户会提供一个 JSON 数组，其中每个人文故事都带有 "id"。
+请把每个故事当作唯一的故事独立评估其价值，并以 JSON 格式返回评估结果。请始终返回有效的JSON格式。
+
+{_CRITERIA_ZH}
+
+请以严格的 JSON 数组返回（不要包含任何markdown格式或其他文字），每个故事一个对象，顺序与输入一致，并原样填写故事的 id：
+{_json_array(('"id": "[故事的 id]"',) + _FIELDS_ZH)}"""
+
+
+# ============== 消息构建（可变部分）==============
+
+def build_story_message(story_text: str, label: str = "Story Content") -> str:
+    """构建只包含故事正文的用户消息"""
+    return f"{label}:\n{story_text}"
+
+
+def build_openai_messages(story_text: str, rubric: str = EVALUATION_RUBRIC_EN,
+                          label: str = "Story Content") -> list:
+    """
+    构建 OpenAI 兼容接口的消息列表：系统消息是固定的评分标准，用户消息只包含故事
+    """
+    return [
+        {"role": "system", "content": rubric},
+        {"role": "user", "content": build_story_message(story_text, label)}
+    ]
+
+
+def build_packed_messages(story_texts: list, rubric: str = PACKED_RUBRIC_EN,
+                          label: str = "Stories") -> list:
+    """
+    构建打包评估的消息列表：用户消息是 [{"id": "1", "story": ...}, ...] 形式的 JSON 数组
+
+    id 为故事在本次打包中的序号（从 1 开始），系统消息与单独评估一样保持固定
+    """
+    payload = [{"id": str(index), "story": text} for index, text in enumerate(story_texts, 1)]
+    return [
+        {"role": "system", "content": rubric},
+        {"role": "user", "content": f"{label}:\n{json.dumps(payload, ensure_ascii=False, indent=1)}"}
+    ]
+
+
+def build_feedback_messages(story_text: str, score, title: str = "") -> list:
+    """构建按需生成反馈的消息列表：已给出的分数和标题放在用户消息中，系统消息保持固定"""
+    return [
+        {"role": "system", "content": FEEDBACK_RUBRIC_EN},
+        {"role": "user", "content": f"Score: {score}/100\nTitle: {title}\n\n{build_story_message(story_text)}"}
+    ]
+
+
+def build_claude_request(story_text: str, rubric: str = EVALUATION_RUBRIC_ZH,
+                         label: str = "故事内容") -> dict:
+    """
+    构建 Anthropic Messages API 的 system / messages 参数
+
+    评分标准作为带 cache_control 的系统块，是所有请求共享的前缀。前缀短于模型的最小缓存长度
+    （Sonnet 为 1024 tokens）时服务端不缓存也不报错，是否命中以 usage 中的 cache_read_tokens 为准。
+    """
+    return {
+        "system": [
+            {"type": "text", "text": rubric, "cache_control": {"type": "ephemeral"}}
+        ],
+        "messages": [
+            {"role": "user", "content": build_story_message(story_text, label)}
+        ]
+    }
@@ -0,0 +1,465 @@
+"""
+进程内模拟链
+
+用 eth-tester（py-evm 后端）在进程内运行一条 EVM 链：启动时为测试账户和 PRIVATE_KEY 对应的
+Agent 账户预置余额，并以 Agent 账户部署 MemoryToken（mintToken 仅限合约所有者调用）。
+链注册表中的 simulated 链（RPC 地址 sim://memory）指向这里，Web 应用用 MINT_CHAINS=simulated、
+Agent 用 AGENT_CHAIN=simulated 选择它；签名、发送、等待收据、解析 TokenMinted 事件的路径
+与真实链完全一致，可以离线压测铸造吞吐。
+
+出块：SIM_BLOCK_TIME_S 为 0 时每笔交易立即打包；大于 0 时发送的交易先进入队列，由后台线程
+每个间隔统一提交（每笔交易单独成块），等待收据的耗时与真实链的确认时间相当。
+
+合约字节码：读取 MEMORY_TOKEN_ARTIFACT（Hardhat / Foundry 产物或 solc --combined-json 输出）；
+产物文件不存在时用 py-solc-x 按 SOLC_VERSION 编译 contracts/MemoryToken.sol，
+OpenZeppelin 源码来自 OPENZEPPELIN_PATH（npm install @openzeppelin/contracts@5 后的目录）：
+    python -m dmm.simchain build      # 编译完整合约并写出 MEMORY_TOKEN_ARTIFACT
+    python -m dmm.simchain stand-in   # 重新生成替身合约产物 contracts/MemoryTokenStandIn.json
+两者都不可用时退回仓库自带的替身合约 contracts/MemoryTokenStandIn.json（合约名 MemoryTokenStandIn，
+见下方“替身合约”一节，启动时记一条警告）。替身合约是手写字节码，不是 MemoryToken.sol 的编译结果：
+只实现 mintToken（仅限所有者，写入计数、余额、持有人和 tokenURI，发出 TokenMinted）、
+getCurrentTokenId、balanceOf 和 tokenURI，不实现 ERC-721 的转账与授权，
+铸造消耗的 gas 与完整合约接近但不相同。
+
+可选依赖：pip install "web3[tester]"（即 eth-tester[py-evm]；编译完整合约另需 py-solc-x）
+
+环境变量:
+    SIM_BLOCK_TIME_S          出块间隔（秒），0 表示每笔交易立即打包，默认 0
+    SIM_ACCOUNTS              预置余额的测试账户数，默认 10
+    SIM_ACCOUNT_BALANCE_ETH   每个预置账户的余额（ETH），默认 1000
+    MEMORY_TOKEN_ARTIFACT     MemoryToken 编译产物路径，默认 contracts/MemoryToken.json（完整合约，不是替身合约）
+    SOLC_VERSION              py-solc-x 编译使用的 solc 版本，默认 0.8.20
+    OPENZEPPELIN_PATH         OpenZeppelin 源码目录，默认 node_modules/@openzeppelin
+"""
+
+import json
+import os
+import sys
+import threading
+
+from eth_utils import keccak
+from hexbytes import HexBytes
+from web3 import AsyncWeb3, Web3
+from web3.providers import AsyncBaseProvider
+from web3.providers.eth_tester import EthereumTesterProvider
+from web3.providers.eth_tester.main import _make_request, _make_response
+
+from dmm.config import AGENT_PRIVATE_KEY, has_agent_key
+from dmm.log import get_logger
+
+log = get_logger("simchain")
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIM_BLOCK_TIME_S = float(os.getenv("SIM_BLOCK_TIME_S", "0"))
+SIM_ACCOUNTS = int(os.getenv("SIM_ACCOUNTS", "10"))
+SIM_ACCOUNT_BALANCE_ETH = float(os.getenv("SIM_ACCOUNT_BALANCE_ETH", "1000"))
+MEMORY_TOKEN_ARTIFACT = os.getenv("MEMORY_TOKEN_ARTIFACT",
+                                  os.path.join(_PROJECT_ROOT, "contracts", "MemoryToken.json"))
+SOLC_VERSION = os.getenv("SOLC_VERSION", "0.8.20")
+OPENZEPPELIN_PATH = os.getenv("OPENZEPPELIN_PATH", os.path.join(_PROJECT_ROOT, "node_modules", "@openzeppelin"))
+
+CHAIN_KEY = "simulated"
+RPC_URL = "sim://memory"
+# eth-tester 默认的 chain id
+CHAIN_ID = 131277322940537
+
+_SOURCE_PATH = os.path.join(_PROJECT_ROOT, "contracts", "MemoryToken.sol")
+_ABI_PATH = os.path.join(_PROJECT_ROOT, "contracts", "MemoryToken_ABI.json")
+STAND_IN_ARTIFACT = os.path.join(_PROJECT_ROOT, "contracts", "MemoryTokenStandIn.json")
+_DEPLOY_GAS = 5_000_000
+
+
+class SimulatorUnavailable(RuntimeError):
+    """缺少 eth-tester 或合约字节码，无法启动模拟链"""
+
+
+# ============== 合约字节码 ==============
+
+def _bytecode_from_artifact(data) -> str:
+    """支持 Hardhat（bytecode）、Foundry（bytecode.object）和 solc --combined-json（contracts.*.bin）"""
+    if "contracts" in data:
+        for name, contract in data["contracts"].items():
+            if name.endswith(":MemoryToken"):
+                return contract["bin"]
+        raise SimulatorUnavailable("MemoryToken not found in combined-json artifact")
+    bytecode = data.get("bytecode")
+    if isinstance(bytecode, dict):
+        bytecode = bytecode.get("object")
+    if not bytecode:
+        raise SimulatorUnavailable("Artifact has no bytecode")
+    return bytecode
+
+
+def compile_memory_token() -> dict:
+    """用 py-solc-x 编译 contracts/MemoryToken.sol，返回 {"abi", "bytecode"}"""
+    try:
+        import solcx
+    except ImportError:
+        raise SimulatorUnavailable(
+            f"No MemoryToken artifact at {MEMORY_TOKEN_ARTIFACT} and py-solc-x is not installed "
+            "(pip install py-solc-x, or point MEMORY_TOKEN_ARTIFACT at a Hardhat/Foundry build)")
+    if not os.path.isdir(OPENZEPPELIN_PATH):
+        raise SimulatorUnavailable(
+            f"OpenZeppelin sources not found at {OPENZEPPELIN_PATH} "
+            "(npm install @openzeppelin/contracts@5, or set OPENZEPPELIN_PATH)")
+    if SOLC_VERSION not in [str(v) for v in solcx.get_installed_solc_versions()]:
+        solcx.install_solc(SOLC_VERSION)
+    output = solcx.compile_files(
+        [_SOURCE_PATH], output_values=["abi", "bin"], solc_version=SOLC_VERSION,
+        import_remappings=[f"@openzeppelin/={OPENZEPPELIN_PATH}/"],
+        allow_paths=[_PROJECT_ROOT, OPENZEPPELIN_PATH])
+    contract = next(value for name, value in output.items() if name.endswith(":MemoryToken"))
+    return {"contractName": "MemoryToken", "abi": contract["abi"], "bytecode": "0x" + contract["bin"]}
+
+
+def _read_artifact(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    abi = data.get("abi")
+    if abi is None:
+        with open(_ABI_PATH, encoding="utf-8") as f:
+            abi = json.load(f)
+    return abi, _bytecode_from_artifact(data)
+
+
+def load_memory_token():
+    """返回 (abi, bytecode)：优先读取编译产物，其次现场编译，都不可用时退回替身合约"""
+    if os.path.exists(MEMORY_TOKEN_ARTIFACT):
+        abi, bytecode = _read_artifact(MEMORY_TOKEN_ARTIFACT)
+    else:
+        try:
+            artifact = compile_memory_token()
+            abi, bytecode = artifact["abi"], artifact["bytecode"]
+        except SimulatorUnavailable as e:
+            if not os.path.exists(STAND_IN_ARTIFACT):
+                raise
+            log.warning("simchain.stand_in", reason=str(e), artifact=STAND_IN_ARTIFACT)
+            abi, bytecode = _read_artifact(STAND_IN_ARTIFACT)
+    if not bytecode.startswith("0x"):
+        bytecode = "0x" + bytecode
+    return abi, bytecode
+
+
+# ============== 替身合约 ==============
+#
+# 手写的 EVM 字节码（MemoryTokenStandIn），mintToken / tokenURI / TokenMinted 的接口与 MemoryToken 一致，
+# 不依赖 solc。存储：slot 0 为 tokenId 计数，slot 1 为所有者，balanceOf 映射在 slot 2，持有人映射在 slot 3，
+# tokenURI 映射在 slot 4（映射位置存长度，其后的连续槽位存内容，每槽 32 字节）。
+
+_OPCODES = {
+    "STOP": 0x00, "ADD": 0x01, "LT": 0x10, "EQ": 0x14, "ISZERO": 0x15, "AND": 0x16, "NOT": 0x19,
+    "SHR": 0x1c, "SHA3": 0x20, "CALLER": 0x33, "CALLVALUE": 0x34, "CALLDATALOAD": 0x35,
+    "CALLDATASIZE": 0x36, "CALLDATACOPY": 0x37, "CODECOPY": 0x39, "POP": 0x50, "MLOAD": 0x51, "MSTORE": 0x52,
+    "SLOAD": 0x54, "SSTORE": 0x55, "JUMPI": 0x57, "JUMPDEST": 0x5b, "LOG3": 0xa3,
+    "RETURN": 0xf3, "REVERT": 0xfd,
+}
+_STAND_IN_FUNCTIONS = ("mintToken", "getCurrentTokenId", "balanceOf", "tokenURI", "TokenMinted")
+
+
+def _assemble(program) -> bytes:
+    """
+    最小的汇编器：元素为助记符、("PUSH", 值, 字节数)、("PUSH", "@标签") 或 "@标签:"
+
+    标签一律用 PUSH2 引用，DUPn / SWAPn 写作 "DUP3" / "SWAP1"。
+    """
+    def size(item):
+        if isinstance(item, tuple):
+            return 3 if isinstance(item[1], str) else 1 + item[2]
+        return 0 if item.endswith(":") else 1
+
+    labels, offset = {}, 0
+    for item in program:
+        if isinstance(item, str) and item.endswith(":"):
+            labels[item[:-1]] = offset
+        offset += size(item)
+
+    code = bytearray()
+    for item in program:
+        if isinstance(item, tuple):
+            value, width = (labels[item[1]], 2) if isinstance(item[1], str) else item[1:]
+            code.append(0x5f + width)
+            code += value.to_bytes(width, "big")
+        elif item.endswith(":"):
+            continue
+        elif item.startswith("DUP"):
+            code.append(0x7f + int(item[3:]))
+        elif item.startswith("SWAP"):
+            code.append(0x8f + int(item[4:]))
+        else:
+            code.append(_OPCODES[item])
+    return bytes(code)
+
+
+def _push(value, width=1):
+    return ("PUSH", value, width)
+
+
+def _selector(signature) -> int:
+    return int.from_bytes(keccak(text=signature)[:4], "big")
+
+
+def _mapping_slot(slot):
+    """栈顶的键 -> 映射 slot 中该键的存储位置（keccak256(key . slot)，使用 0x00-0x3f 暂存）"""
+    return [_push(0), "MSTORE", _push(slot), _push(0x20), "MSTORE", _push(0x40), _push(0), "SHA3"]
+
+
+def stand_in_runtime() -> bytes:
+    revert = ("PUSH", "@revert")
+    return _assemble([
+        _push(4), "CALLDATASIZE", "LT", revert, "JUMPI",
+        _push(0), "CALLDATALOAD", _push(0xe0), "SHR",
+        "DUP1", _push(_selector("mintToken(address,string)"), 4), "EQ", ("PUSH", "@mintToken"), "JUMPI",
+        "DUP1", _push(_selector("getCurrentTokenId()"), 4), "EQ", ("PUSH", "@current"), "JUMPI",
+        "DUP1", _push(_selector("balanceOf(address)"), 4), "EQ", ("PUSH", "@balanceOf"), "JUMPI",
+        "DUP1", _push(_selector("tokenURI(uint256)"), 4), "EQ", ("PUSH", "@tokenURI"), "JUMPI",
+        "@revert:", "JUMPDEST", _push(0), "DUP1", "REVERT",
+
+        "@current:", "JUMPDEST",
+        _push(0), "SLOAD", _push(0), "MSTORE", _push(0x20), _push(0), "RETURN",
+
+        "@balanceOf:", "JUMPDEST",
+        _push(4), "CALLDATALOAD", *_mapping_slot(2), "SLOAD",
+        _push(0), "MSTORE", _push(0x20), _push(0), "RETURN",
+
+        # tokenURI(uint256 id)：不存在的 token 回滚
+        "@tokenURI:", "JUMPDEST",
+        _push(4), "CALLDATALOAD", *_mapping_slot(3), "SLOAD", "ISZERO", revert, "JUMPI",
+        _push(4), "CALLDATALOAD", *_mapping_slot(4),                    # [slot]
+        "DUP1", "SLOAD", _push(0x1f), "ADD", _push(0x1f), "NOT", "AND",  # [slot, padded]
+        _push(0x40), "ADD", "SWAP1", _push(0x20),                       # [end, slot, mem]
+        _push(0x20), _push(0), "MSTORE",                                # ABI 编码的 string 偏移
+        "@load:", "JUMPDEST",                                           # 长度和内容读到 0x20
+        "DUP2", "SLOAD", "DUP2", "MSTORE",
+        "SWAP1", _push(1), "ADD", "SWAP1", _push(0x20), "ADD",
+        "DUP3", "DUP2", "LT", ("PUSH", "@load"), "JUMPI",
+        "POP", "POP", _push(0), "RETURN",
+
+        # mintToken(address recipient, string tokenURI)
+        "@mintToken:", "JUMPDEST",
+        "CALLVALUE", revert, "JUMPI",                                   # 不接受转账
+        _push(1), "SLOAD", "CALLER", "EQ", "ISZERO", revert, "JUMPI",   # onlyOwner
+        _push(4), "CALLDATALOAD", _push((1 << 160) - 1, 20), "AND",     # [r]
+        "DUP1", "ISZERO", revert, "JUMPI",                              # recipient != 0
+        "DUP1", *_mapping_slot(2),                                      # balanceOf[r] += 1
+        "DUP1", "SLOAD", _push(1), "ADD", "SWAP1", "SSTORE",
+        _push(0), "SLOAD",                                              # [r, id]
+        "DUP1", _push(1), "ADD", _push(0), "SSTORE",                    # 计数 + 1
+        "DUP1", *_mapping_slot(3), "DUP3", "SWAP1", "SSTORE",           # 持有人[id] = r
+        "DUP1", *_mapping_slot(4),                                      # [r, id, slot]
+        _push(0x24), "CALLDATALOAD", _push(4), "ADD",                   # [r, id, slot, off]
+        "DUP1", "CALLDATALOAD",                                         # [r, id, slot, off, len]
+        "DUP1", "ISZERO", revert, "JUMPI",                              # tokenURI 不能为空
+        _push(0x1f), "ADD", _push(0x1f), "NOT", "AND",                  # [r, id, slot, off, padded]
+        "DUP1", _push(0x20), "ADD", "DUP3", _push(0x20), "CALLDATACOPY",  # 长度和内容复制到 0x20
+        _push(0x20), _push(0), "MSTORE",                                # ABI 编码的 string 偏移
+        "SWAP1", "POP",                                                 # [r, id, slot, padded]
+        "DUP1", _push(0x40), "ADD", "DUP3", _push(0x20),                # [.., end, slot, mem]
+        "@store:", "JUMPDEST",                                          # tokenURI[id] = 长度和内容
+        "DUP1", "MLOAD", "DUP3", "SSTORE",
+        "SWAP1", _push(1), "ADD", "SWAP1", _push(0x20), "ADD",
+        "DUP3", "DUP2", "LT", ("PUSH", "@store"), "JUMPI",
+        "POP", "POP", "POP", "SWAP1", "POP",                            # [r, id, padded]
+        "DUP2", "DUP4", _push(int.from_bytes(keccak(text="TokenMinted(address,uint256,string)"), "big"), 32),
+        "DUP4", _push(0x40), "ADD", _push(0), "LOG3",                   # TokenMinted(r, id, tokenURI)
+        "POP", _push(0), "MSTORE", "POP", _push(0x20), _push(0), "RETURN",
+    ])
+
+
+def stand_in_artifact() -> dict:
+    """替身合约的产物：构造函数把部署者记为所有者，ABI 取 MemoryToken_ABI.json 中已实现的部分"""
+    runtime = stand_in_runtime()
+    constructor = ["CALLER", _push(1), "SSTORE",
+                   _push(len(runtime), 2), "DUP1", ("PUSH", "@runtime"), _push(0), "CODECOPY",
+                   _push(0), "RETURN", "@runtime:"]
+    with open(_ABI_PATH, encoding="utf-8") as f:
+        abi = [entry for entry in json.load(f)
+               if entry["type"] == "constructor" or entry.get("name") in _STAND_IN_FUNCTIONS]
+    return {"contractName": "MemoryTokenStandIn", "sourceName": "dmm/simchain.py (stand-in)", "abi": abi,
+            "bytecode": "0x" + (_assemble(constructor) + runtime).hex()}
+
+
+# ============== 模拟链 ==============
+
+class _SimulatorProvider(EthereumTesterProvider):
+    """同步 Web3 的 provider，请求交给 Simulator.request()"""
+
+    def __init__(self, simulator):
+        super().__init__(simulator.tester)
+        self._simulator = simulator
+
+    def make_request(self, method, params):
+        return self._simulator.request(method, params)
+
+
+class _AsyncSimulatorProvider(AsyncBaseProvider):
+    """AsyncWeb3 的 provider，与同步 provider 共用同一条模拟链"""
+
+    def __init__(self, simulator):
+        from web3.providers.eth_tester import AsyncEthereumTesterProvider
+
+        super().__init__()
+        self.middlewares = AsyncEthereumTesterProvider.middlewares
+        self._simulator = simulator
+
+    async def make_request(self, method, params):
+        # eth-tester 的调用是同步的（毫秒级），直接在事件循环中执行
+        return self._simulator.request(method, params)
+
+    async def is_connected(self, show_traceback=False):
+        return True
+
+
+class Simulator:
+    """进程内的 eth-tester 链，已部署 MemoryToken"""
+
+    def __init__(self, owner_key=None, block_time_s=SIM_BLOCK_TIME_S,
+                 accounts=SIM_ACCOUNTS, balance_eth=SIM_ACCOUNT_BALANCE_ETH):
+        try:
+            from eth_tester import EthereumTester, PyEVMBackend
+        except ImportError:
+            raise SimulatorUnavailable('Simulated chain requires eth-tester: pip install "web3[tester]"')
+        from web3.providers.eth_tester.defaults import API_ENDPOINTS
+
+        abi, bytecode = load_memory_token()
+
+        balance = Web3.to_wei(balance_eth, "ether")
+        genesis_state = PyEVMBackend.generate_genesis_state(
+            overrides={"balance": balance}, num_accounts=accounts)
+        if owner_key:
+            owner = Web3().eth.account.from_key(owner_key)
+            genesis_state[bytes.fromhex(owner.address[2:])] = {
+                "balance": balance, "storage": {}, "code": b"", "nonce": 0}
+        self.backend = PyEVMBackend(genesis_state=genesis_state)
+        self.tester = EthereumTester(self.backend)
+        self.api_endpoints = API_ENDPOINTS
+        self.account_keys = [key.to_hex() for key in self.backend.account_keys]
+        self.owner_key = owner_key or self.account_keys[0]
+        self.block_time_s = block_time_s
+        self.lock = threading.RLock()
+        self._queue = []
+        self._stopped = threading.Event()
+
+        # 部署时交易立即打包（出块线程尚未启动）
+        w3 = self.web3()
+        owner = w3.eth.account.from_key(self.owner_key)
+        transaction = w3.eth.contract(abi=abi, bytecode=bytecode).constructor().build_transaction({
+            "from": owner.address,
+            "chainId": CHAIN_ID,
+            "gas": _DEPLOY_GAS,
+            "gasPrice": w3.eth.gas_price,
+            "nonce": w3.eth.get_transaction_count(owner.address)
+        })
+        receipt = self._submit(owner.sign_transaction(transaction).rawTransaction)
+        if receipt["status"] != 1 or not receipt["contract_address"]:
+            raise SimulatorUnavailable("MemoryToken deployment reverted")
+        self.contract_address = Web3.to_checksum_address(receipt["contract_address"])
+
+        if block_time_s > 0:
+            threading.Thread(target=self._mine, name="simchain-miner", daemon=True).start()
+        log.info("simchain.started", contract=self.contract_address, owner=owner.address,
+                 accounts=len(self.account_keys), block_time_s=block_time_s)
+
+    def _submit(self, raw_transaction):
+        with self.lock:
+            tx_hash = self.tester.send_raw_transaction(HexBytes(raw_transaction).hex())
+            return self.tester.get_transaction_receipt(tx_hash)
+
+    def request(self, method, params):
+        """
+        处理一次 JSON-RPC 请求，eth-tester 不是线程安全的，所有请求和出块共用一把锁。
+
+        出块间隔大于 0 时，eth_sendRawTransaction 只把交易放入队列并返回交易哈希，
+        由出块线程在下一个间隔提交，期间查询收据得到的是“尚未打包”。
+        （eth-tester 关闭自动打包后无法打包 EIP-155 签名的交易，因此不用它的待打包区块。）
+        """
+        if method == "eth_sendRawTransaction" and self.block_time_s > 0:
+            raw_transaction = HexBytes(params[0])
+            with self.lock:
+                self._queue.append(raw_transaction)
+            return _make_response(Web3.to_hex(keccak(raw_transaction)))
+        with self.lock:
+            return _make_request(method, params, self.api_endpoints, self.tester)
+
+    def _mine(self):
+        while not self._stopped.wait(self.block_time_s):
+            with self.lock:
+                queued, self._queue = self._queue, []
+                # 并发发送的交易到达顺序可能与 nonce 顺序不同：与节点的交易池一致，
+                # nonce 超前的交易等前面的交易打包后重试，直到一轮下来没有新的交易成功
+                failed = []
+                while queued:
+                    failed = []
+                    for raw_transaction in queued:
+                        try:
+                            self._submit(raw_transaction)
+                        except Exception as e:
+                            failed.append((raw_transaction, e))
+                    if len(failed) == len(queued):
+                        break
+                    queued = [raw_transaction for raw_transaction, _ in failed]
+                for raw_transaction, e in failed:
+                    # 与真实节点丢弃无效交易一致：收据永远不会出现，由调用方超时处理
+                    log.warning("simchain.transaction_dropped",
+                                tx_hash=Web3.to_hex(keccak(raw_transaction)), error=str(e))
+
+    def stop(self):
+        self._stopped.set()
+
+    def web3(self) -> Web3:
+        return Web3(_SimulatorProvider(self))
+
+    def async_web3(self) -> AsyncWeb3:
+        return AsyncWeb3(_AsyncSimulatorProvider(self))
+
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+
+def simulator() -> Simulator:
+    """进程内唯一的模拟链，首次调用时启动并部署合约，部署地址写回链注册表"""
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None:
+            from dmm import chains
+
+            _simulator = Simulator(AGENT_PRIVATE_KEY if has_agent_key() else None)
+            chain = chains.REGISTRY.get(CHAIN_KEY)
+            if chain is not None:
+                chain.contract_address = _simulator.contract_address
+        return _simulator
+
+
+def is_simulated(url) -> bool:
+    return url == RPC_URL
+
+
+def web3(url=RPC_URL) -> Web3:
+    """Connections 的工厂：sim:// 地址连接模拟链，其余地址走 HTTP"""
+    if is_simulated(url):
+        return simulator().web3()
+    return Web3(Web3.HTTPProvider(url))
+
+
+def async_web3(url=RPC_URL) -> AsyncWeb3:
+    if is_simulated(url):
+        return simulator().async_web3()
+    return AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(url))
+
+
+def build(path=None, stand_in=False):
+    """编译 MemoryToken 写出 MEMORY_TOKEN_ARTIFACT，或生成替身合约写出 STAND_IN_ARTIFACT"""
+    artifact = stand_in_artifact() if stand_in else compile_memory_token()
+    path = path or (STAND_IN_ARTIFACT if stand_in else MEMORY_TOKEN_ARTIFACT)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, indent=2)
+        f.write("\n")
+    print(f"✅ {artifact['contractName']} {'替身合约' if stand_in else '编译'}产物已写入 {path}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["build"], ["stand-in"]):
+        print("用法: python -m dmm.simchain build | stand-in")
+        sys.exit(1)
+    build(stand_in=sys.argv[1] == "stand-in")
@@ -0,0 +1,47 @@
+"""
+延迟统计工具
+
+供连接探测脚本、压测脚本等计算分位数和汇总数据
+"""
+
+import math
+
+
+def percentile(values, p: float) -> float:
+    """
+    计算分位数（线性插值，与 numpy 默认算法一致）
+
+    Args:
+        values: 数值序列
+        p: 分位数，0-100
+    """
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return float(ordered[0])
+
+    rank = (len(ordered) - 1) * p / 100.0
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return float(ordered[low])
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values) -> dict:
+    """返回 count / min / mean / p50 / p95 / p99 / max 汇总"""
+    values = list(values)
+    if not values:
+        return {"count": 0}
+
+    return {
+        "count": len(values),
+        "min": round(min(values), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2)
+    }
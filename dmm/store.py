@@ -0,0 +1,51 @@
+"""
+评估结果的进程内存储
+
+/api/evaluate 返回的每个结果都带有 evaluation_id，后续接口（例如 POST /api/image）
+按 ID 取回服务端保存的评估结果，而不是信任客户端回传的分数和提示词。
+
+环境变量:
+    EVALUATION_STORE_SIZE  保留的评估结果数量，默认 5000
+"""
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+EVALUATION_STORE_SIZE = int(os.getenv("EVALUATION_STORE_SIZE", "5000"))
+
+
+class EvaluationStore:
+    """保存最近 N 条评估结果"""
+
+    def __init__(self, maxlen=EVALUATION_STORE_SIZE):
+        self.maxlen = maxlen
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, evaluation: dict) -> str:
+        """保存评估结果并写入 evaluation_id"""
+        evaluation_id = uuid.uuid4().hex
+        evaluation['evaluation_id'] = evaluation_id
+        with self._lock:
+            self._entries[evaluation_id] = dict(evaluation)
+            while len(self._entries) > self.maxlen:
+                self._entries.popitem(last=False)
+        return evaluation_id
+
+    def get(self, evaluation_id):
+        with self._lock:
+            entry = self._entries.get(evaluation_id)
+            return dict(entry) if entry is not None else None
+
+    def update(self, evaluation_id, **fields):
+        with self._lock:
+            entry = self._entries.get(evaluation_id)
+            if entry is None:
+                return None
+            entry.update(fields)
+            return dict(entry)
+
+
+evaluations = EvaluationStore()
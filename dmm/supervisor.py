@@ -0,0 +1,367 @@
+"""
+铸造交易监督：nonce 分配与卡住交易的提价替换
+
+gas 价格只在发送时读取一次，网络费用上涨后交易可能长时间留在内存池中，
+并阻塞同一账户之后的所有 nonce。请求内没有等到收据的交易交给 MintSupervisor：
+后台线程定期查询收据，最近一次发送超过 MINT_CONFIRM_TARGET_S 仍未确认时，
+用同一个 nonce、更高的 gas 价格重新签名发送（替换交易）：
+    新价格 = max(当前网络 gas 价格, 上次价格 × (1 + MINT_FEE_BUMP))
+不超过上限 min(首次价格 × MINT_MAX_FEE_MULTIPLIER, MINT_MAX_GAS_PRICE_GWEI)；到达上限后不再替换，继续等待。
+同一 nonce 的各次发送中任何一笔上链都算成功，API 返回最终确认的交易哈希和被替换的哈希
+（replaced_tx_hashes）；等待中的重复请求返回最近一次发送的哈希。
+
+并发铸造时每个请求从 NonceAllocator 取得不同的 nonce（链上 pending 计数与本地已分配的较大值），
+没有发出的交易归还 nonce，后续请求优先复用，避免 nonce 空洞阻塞后面的交易。
+
+Agent 脚本使用 send_and_wait()：同样的替换逻辑，在当前线程中等待。
+
+环境变量:
+    MINT_REPLACEMENT_ENABLED     是否替换卡住的交易，默认 true
+    MINT_CONFIRM_TARGET_S        目标确认时间（秒），超过后替换；也是请求内等待收据的上限，默认 90
+    MINT_FEE_BUMP                每次替换的最小提价比例，默认 0.125（节点通常要求至少 10%）
+    MINT_MAX_FEE_MULTIPLIER      gas 价格上限（相对首次发送），默认 3
+    MINT_MAX_GAS_PRICE_GWEI      gas 价格的绝对上限（gwei），默认不限
+    MINT_SUPERVISOR_INTERVAL_S   后台检查间隔（秒），默认 3
+"""
+
+import math
+import os
+import threading
+import time
+
+from web3.exceptions import TimeExhausted, TransactionNotFound
+
+from dmm import accounting, breakers, metrics
+from dmm.accounting import BudgetExceeded
+from dmm.breakers import CircuitOpen
+from dmm.idempotency import MINT_PENDING_TIMEOUT_S, mint_requests
+from dmm.log import get_logger
+
+log = get_logger("supervisor")
+
+MINT_REPLACEMENT_ENABLED = os.getenv("MINT_REPLACEMENT_ENABLED", "true").lower() in ("1", "true", "yes")
+MINT_CONFIRM_TARGET_S = float(os.getenv("MINT_CONFIRM_TARGET_S", "90"))
+MINT_FEE_BUMP = float(os.getenv("MINT_FEE_BUMP", "0.125"))
+MINT_MAX_FEE_MULTIPLIER = float(os.getenv("MINT_MAX_FEE_MULTIPLIER", "3"))
+MINT_MAX_GAS_PRICE_GWEI = float(os.getenv("MINT_MAX_GAS_PRICE_GWEI", "0"))
+MINT_SUPERVISOR_INTERVAL_S = float(os.getenv("MINT_SUPERVISOR_INTERVAL_S", "3"))
+
+REPLACEMENTS = metrics.REGISTRY.counter(
+    "dmm_mint_replacements_total", "Stuck mint transaction replacements", ("chain", "outcome"))
+PENDING_MINTS = metrics.REGISTRY.gauge(
+    "dmm_mint_pending", "Mint transactions awaiting confirmation in the background", ("chain",))
+
+
+# ============== nonce 分配 ==============
+
+class NonceAllocator:
+    """
+    每个 (链, 账户) 在进程内分配 nonce
+
+    分配值为链上 pending 计数与本地下一个值中的较大者；没有发出的交易用 release() 归还，
+    之后优先分配归还的 nonce（仍不小于链上计数的那些）
+    """
+
+    def __init__(self):
+        self._next = {}
+        self._released = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, account, pending_count) -> int:
+        with self._lock:
+            released = sorted(n for n in self._released.get(account, ()) if n >= pending_count)
+            if released:
+                self._released[account] = set(released[1:])
+                return released[0]
+            self._released.pop(account, None)
+            nonce = max(pending_count, self._next.get(account, 0))
+            self._next[account] = nonce + 1
+            return nonce
+
+    def release(self, account, nonce):
+        with self._lock:
+            released = self._released.setdefault(account, set())
+            released.add(nonce)
+            # 归还的是最后分配的几个时直接回退，不留在集合中
+            while self._next.get(account, 0) - 1 in released:
+                self._next[account] -= 1
+                released.discard(self._next[account])
+
+    def reset(self, account):
+        """节点报告 nonce 过低（其他进程用同一账户发送过交易），下次按链上计数重新分配"""
+        with self._lock:
+            self._next.pop(account, None)
+            self._released.pop(account, None)
+
+
+nonces = NonceAllocator()
+
+
+def is_nonce_too_low(exc) -> bool:
+    message = str(exc).lower()
+    return "nonce too low" in message or "already been used" in message
+
+
+# ============== 替换 ==============
+
+def fee_cap(original_gas_price) -> int:
+    cap = int(original_gas_price * MINT_MAX_FEE_MULTIPLIER)
+    if MINT_MAX_GAS_PRICE_GWEI > 0:
+        cap = min(cap, int(MINT_MAX_GAS_PRICE_GWEI * 1e9))
+    return cap
+
+
+def replacement_gas_price(last, original, network):
+    """替换交易的 gas 价格；到达上限、无法满足最小提价时返回 None"""
+    required = math.ceil(last * (1 + MINT_FEE_BUMP))
+    cap = fee_cap(original)
+    if required > cap:
+        return None
+    return min(max(required, network), cap)
+
+
+class PendingMint:
+    """一次铸造的同 nonce 交易序列（首次发送和各次替换）"""
+
+    def __init__(self, key, chain, contract, transaction, evaluation_id=None, client=None):
+        self.key = key
+        self.chain = chain
+        self.contract = contract
+        self.transaction = transaction
+        self.evaluation_id = evaluation_id
+        self.client = client
+        self.created_at = time.monotonic()
+        # [{"tx_hash", "gas_price", "sent_at"}]，按发送顺序
+        self.attempts = []
+
+    @property
+    def nonce(self) -> int:
+        return self.transaction['nonce']
+
+    @property
+    def tx_hash(self) -> str:
+        return self.attempts[-1]['tx_hash']
+
+    def sending(self, tx_hash, gas_price):
+        """记下即将发送的一笔（发送前调用，和幂等记录一样先记哈希再发送）"""
+        self.attempts.append({"tx_hash": tx_hash, "gas_price": gas_price, "sent_at": time.monotonic()})
+
+    def response(self) -> dict:
+        """等待确认期间的响应：最近一次发送的交易，以及被它替换的交易"""
+        body = {"chain": self.chain.key, "tx_hash": self.tx_hash, "explorer_url": self.chain.tx_url(self.tx_hash)}
+        if len(self.attempts) > 1:
+            body["replaced_tx_hashes"] = [attempt['tx_hash'] for attempt in self.attempts[:-1]]
+        return body
+
+    def replaced(self, tx_hash) -> list:
+        """确认的交易之外的各次发送"""
+        return [attempt['tx_hash'] for attempt in self.attempts if attempt['tx_hash'] != tx_hash]
+
+
+def find_receipt(w3, pending):
+    """查询各次发送的收据（从最近一次开始），返回 (发送记录, 收据)，都未上链时返回 (None, None)"""
+    for attempt in reversed(pending.attempts):
+        try:
+            receipt = w3.eth.get_transaction_receipt(attempt['tx_hash'])
+        except TransactionNotFound:
+            continue
+        if receipt is not None:
+            return attempt, receipt
+    return None, None
+
+
+def in_pool(w3, tx_hash) -> bool:
+    """节点是否还知道这笔交易（在交易池中或已上链）"""
+    try:
+        return w3.eth.get_transaction(tx_hash) is not None
+    except TransactionNotFound:
+        return False
+
+
+def replace(w3, pending, private_key):
+    """
+    用更高的 gas 价格重新发送同一 nonce 的交易，返回新交易哈希；到达上限或节点拒绝时返回 None
+
+    超出花费预算时抛出 BudgetExceeded
+    """
+    last = pending.attempts[-1]['gas_price']
+    gas_price = replacement_gas_price(last, pending.attempts[0]['gas_price'], w3.eth.gas_price)
+    if gas_price is None:
+        REPLACEMENTS.inc(chain=pending.chain.key, outcome="capped")
+        log.warning("mint.replacement_capped", chain=pending.chain.key, tx_hash=pending.tx_hash,
+                    nonce=pending.nonce, gas_price=last)
+        return None
+    accounting.check_budget(accounting.gas_cost(pending.transaction['gas'], gas_price))
+
+    transaction = dict(pending.transaction, gasPrice=gas_price)
+    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+    tx_hash_hex = signed_txn.hash.hex()
+    pending.sending(tx_hash_hex, gas_price)
+    if pending.key is not None:
+        mint_requests.sending(pending.key, tx_hash_hex, pending.response())
+    try:
+        w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+    except ValueError as e:
+        # 节点拒绝（提价不足，或某一笔已经上链导致 nonce 过低）：下次检查时查收据或再提价
+        pending.attempts.pop()
+        if pending.key is not None:
+            mint_requests.sending(pending.key, pending.tx_hash, pending.response())
+        REPLACEMENTS.inc(chain=pending.chain.key, outcome="rejected")
+        log.warning("mint.replacement_rejected", chain=pending.chain.key, nonce=pending.nonce,
+                    gas_price=gas_price, error=str(e))
+        return None
+    REPLACEMENTS.inc(chain=pending.chain.key, outcome="sent")
+    log.warning("mint.replaced", chain=pending.chain.key, nonce=pending.nonce, replaced=pending.attempts[-2]['tx_hash'],
+                tx_hash=tx_hash_hex, gas_price=gas_price, previous_gas_price=last)
+    return tx_hash_hex
+
+
+def send_and_wait(w3, chain, transaction, private_key, timeout, target_s=MINT_CONFIRM_TARGET_S):
+    """
+    发送交易并等待确认，超过目标确认时间时提价替换（Agent 脚本使用）
+
+    返回 (PendingMint, 确认的交易哈希, 收据)；timeout 内都没有上链时抛出 TimeExhausted
+    """
+    pending = PendingMint(None, chain, None, transaction)
+    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+    pending.sending(signed_txn.hash.hex(), transaction['gasPrice'])
+    w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+    log.info("mint.sent", chain=chain.key, tx_hash=pending.tx_hash, nonce=pending.nonce)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        now = time.monotonic()
+        wait = min(deadline - now, pending.attempts[-1]['sent_at'] + target_s - now)
+        if wait > 0:
+            try:
+                receipt = w3.eth.wait_for_transaction_receipt(pending.tx_hash, timeout=wait)
+                return pending, pending.tx_hash, receipt
+            except TimeExhausted:
+                pass
+        attempt, receipt = find_receipt(w3, pending)
+        if receipt is not None:
+            return pending, attempt['tx_hash'], receipt
+        if time.monotonic() >= deadline:
+            raise TimeExhausted(f"Transaction {pending.tx_hash} is not in the chain after {timeout} seconds")
+        if MINT_REPLACEMENT_ENABLED:
+            replace(w3, pending, private_key)
+        if pending.attempts[-1]['sent_at'] + target_s <= time.monotonic():
+            # 没有替换（到达上限或被拒绝），按目标时间继续等待
+            pending.attempts[-1]['sent_at'] = time.monotonic()
+
+
+# ============== 后台监督 ==============
+
+class MintSupervisor:
+    """
+    后台线程跟踪请求内没有确认的铸造交易
+
+    settle(pending, tx_hash, receipt, gas_price) 由 Web 应用提供（核算 gas、更新归档和幂等记录）；
+    connections 为同步 Web3 的 chains.Connections
+    """
+
+    def __init__(self, connections, private_key, settle, interval=MINT_SUPERVISOR_INTERVAL_S,
+                 target_s=MINT_CONFIRM_TARGET_S, timeout=MINT_PENDING_TIMEOUT_S):
+        self.connections = connections
+        self.private_key = private_key
+        self.settle = settle
+        self.interval = interval
+        self.target_s = target_s
+        self.timeout = timeout
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def follow(self, pending):
+        with self._lock:
+            self._pending[id(pending)] = pending
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="mint-supervisor", daemon=True)
+                self._thread.start()
+        PENDING_MINTS.inc(chain=pending.chain.key)
+        log.info("mint.following", chain=pending.chain.key, tx_hash=pending.tx_hash, nonce=pending.nonce)
+
+    def _remove(self, pending):
+        with self._lock:
+            self._pending.pop(id(pending), None)
+        PENDING_MINTS.dec(chain=pending.chain.key)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                pending_mints = list(self._pending.values())
+            for pending in pending_mints:
+                with accounting.client_scope(pending.client):
+                    try:
+                        self.check(pending)
+                    except (CircuitOpen, BudgetExceeded) as e:
+                        log.warning("mint.supervise_skipped", chain=pending.chain.key, tx_hash=pending.tx_hash,
+                                    error=str(e))
+                    except Exception as e:
+                        log.warning("mint.supervise_failed", chain=pending.chain.key, tx_hash=pending.tx_hash,
+                                    error=str(e))
+
+    def check(self, pending):
+        """
+        查询一次收据，确认后结算；超过目标确认时间时替换；
+        超过 timeout 仍未上链时到链上确认交易已不可能上链后才放弃（见 _abandon）
+        """
+        w3 = self.connections.get(pending.chain)
+        rpc = breakers.rpc_name(pending.chain.key)
+        with metrics.stage("receipt", upstream="rpc"), breakers.guard(rpc):
+            attempt, receipt = find_receipt(w3, pending)
+        if receipt is not None:
+            self._remove(pending)
+            self.settle(pending, attempt['tx_hash'], receipt, attempt['gas_price'])
+            return
+
+        now = time.monotonic()
+        if now - pending.created_at > self.timeout and self._abandon(w3, rpc, pending):
+            return
+        if MINT_REPLACEMENT_ENABLED and now - pending.attempts[-1]['sent_at'] >= self.target_s:
+            with metrics.stage("replace", upstream="rpc"), breakers.guard(rpc, ignore=(ValueError,)):
+                tx_hash = replace(w3, pending, self.private_key)
+            if tx_hash is None:
+                # 没有替换：按目标时间后再试（上限不变时不会重复记日志）
+                pending.attempts[-1]['sent_at'] = now
+
+    def _abandon(self, w3, rpc, pending) -> bool:
+        """
+        超时后检查 nonce 在链上的状态，只有确定各次发送都不会再上链时才删除幂等记录（允许重新铸造）：
+        - latest 计数已超过 nonce 且各次发送都没有收据：nonce 被其他交易使用
+        - nonce 尚未使用且各次发送都已不在节点的交易池中：交易被丢弃，nonce 归还给分配器
+        仍有一笔在交易池中（例如提价到上限后继续等待）时保留 pending 记录，继续跟踪，返回 False
+        """
+        address = w3.eth.account.from_key(self.private_key).address
+        with metrics.stage("receipt", upstream="rpc"), breakers.guard(rpc):
+            used = w3.eth.get_transaction_count(address, "latest") > pending.nonce
+            # 读取计数之后再查一次收据：计数增加可能正是其中一笔刚刚上链
+            attempt, receipt = find_receipt(w3, pending)
+            waiting = receipt is None and not used and any(
+                in_pool(w3, sent['tx_hash']) for sent in pending.attempts)
+        if receipt is not None:
+            self._remove(pending)
+            self.settle(pending, attempt['tx_hash'], receipt, attempt['gas_price'])
+            return True
+        if waiting:
+            return False
+
+        self._remove(pending)
+        if used:
+            log.warning("mint.pending_superseded", chain=pending.chain.key, tx_hash=pending.tx_hash,
+                        nonce=pending.nonce, attempts=len(pending.attempts))
+        else:
+            nonces.release((pending.chain.key, address), pending.nonce)
+            log.warning("mint.pending_dropped", chain=pending.chain.key, tx_hash=pending.tx_hash,
+                        nonce=pending.nonce, attempts=len(pending.attempts))
+        mint_requests.discard(pending.key)
+        return True
+
+    def snapshot(self) -> list:
+        with self._lock:
+            pending_mints = list(self._pending.values())
+        now = time.monotonic()
+        return [{"chain": p.chain.key, "tx_hash": p.tx_hash, "nonce": p.nonce, "attempts": len(p.attempts),
+                 "gas_price_gwei": round(p.attempts[-1]['gas_price'] / 1e9, 4),
+                 "age_s": round(now - p.created_at, 1)} for p in pending_mints]
@@ -0,0 +1,98 @@
+"""
+LLM 用量记录
+
+从 Anthropic / OpenAI 兼容接口返回的 usage 中提取输入、输出以及
+提示词缓存读写的 token 数，按进程累计，用于确认缓存是否生效。
+
+耗时记录的是整次调用（total_latency_ms，含生成全部输出），不是首 token 时间：
+调用方都是非流式请求，拿不到首 token 的时刻。缓存对首 token 时间的改善会被输出耗时稀释。
+"""
+
+import threading
+
+_lock = threading.Lock()
+_totals = {}
+
+
+def _field(obj, name, default=0):
+    """兼容 SDK 对象和 dict 两种 usage 格式"""
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        value = obj.get(name, default)
+    else:
+        value = getattr(obj, name, default)
+    return default if value is None else value
+
+
+def extract_usage(usage) -> dict:
+    """
+    统一不同服务商的 usage 字段
+
+    - Anthropic: input_tokens / output_tokens / cache_read_input_tokens / cache_creation_input_tokens
+    - OpenAI: prompt_tokens / completion_tokens / prompt_tokens_details.cached_tokens
+    - DeepSeek 风格: prompt_cache_hit_tokens
+    """
+    if usage is None:
+        return {}
+
+    if _field(usage, "input_tokens", None) is not None:
+        cache_read = _field(usage, "cache_read_input_tokens")
+        cache_write = _field(usage, "cache_creation_input_tokens")
+        # Anthropic 的 input_tokens 不包含缓存部分
+        input_tokens = _field(usage, "input_tokens") + cache_read + cache_write
+        output_tokens = _field(usage, "output_tokens")
+    else:
+        details = _field(usage, "prompt_tokens_details", None)
+        cache_read = _field(details, "cached_tokens") or _field(usage, "prompt_cache_hit_tokens")
+        # OpenAI 兼容接口的缓存写入是自动的，不单独计费也不返回
+        cache_write = 0
+        input_tokens = _field(usage, "prompt_tokens")
+        output_tokens = _field(usage, "completion_tokens")
+
+    return {
+        "input_tokens": int(input_tokens),
+        "output_tokens": int(output_tokens),
+        "cache_read_tokens": int(cache_read),
+        "cache_write_tokens": int(cache_write)
+    }
+
+
+def record_usage(provider: str, usage, total_latency_ms: float = None) -> dict:
+    """记录一次 LLM 调用的用量和整次调用耗时，返回统一格式的用量字典"""
+    stats = extract_usage(usage)
+
+    with _lock:
+        totals = _totals.setdefault(provider, {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_tokens": 0,
+            "cache_write_tokens": 0,
+            "total_latency_ms": 0.0
+        })
+        totals["calls"] += 1
+        for key, value in stats.items():
+            totals[key] += value
+        if total_latency_ms is not None:
+            totals["total_latency_ms"] += total_latency_ms
+
+    return stats
+
+
+def snapshot() -> dict:
+    """返回各服务商的累计用量及缓存命中率"""
+    with _lock:
+        result = {}
+        for provider, totals in _totals.items():
+            entry = dict(totals)
+            entry["cache_hit_rate"] = (
+                round(totals["cache_read_tokens"] / totals["input_tokens"], 4)
+                if totals["input_tokens"] else 0.0
+            )
+            entry["avg_total_latency_ms"] = (
+                round(totals["total_latency_ms"] / totals["calls"], 1) if totals["calls"] else 0.0
+            )
+            entry["total_latency_ms"] = round(totals["total_latency_ms"], 1)
+            result[provider] = entry
+        return result
@@ -3,20 +3,51 @@ Digital Memory Museum (DMM) | 数字记忆博物馆 - Web 界面
 基于 Flask 的简单 Web 应用
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, g
 from flask_cors import CORS
 import os
 import sys
 import json
+import math
+import time
+import contextvars
 import requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 
-from dotenv import load_dotenv
 from web3 import Web3
+from web3.exceptions import TimeExhausted
 from openai import OpenAI
 
-# 加载环境变量
-load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
+# 将项目根目录添加到 Python 路径，以便导入共享模块（导入 dmm 时会加载 .env）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmm import accounting, breakers, cascade, chains, deadline, embeddings, feedback, idempotency, images, limits, metrics, packing, profiling, simchain, supervisor, usage
+from dmm.config import (
+    ALCHEMY_API_KEY, AGENT_PRIVATE_KEY, OPENAI_API_KEY, OPENAI_API_BASE,
+    AI_MODEL, SCORE_THRESHOLD, IMAGE_API_URL, MINT_GAS_LIMIT, has_agent_key
+)
+from dmm.accounting import BudgetExceeded
+from dmm.batching import ThreadedBatcher
+from dmm.breakers import CircuitOpen
+from dmm.contracts import CONTRACT_ABI, load_contract_abi, minted_token_id
+from dmm.deadline import DeadlineExceeded, RequestAborted
+from dmm.idempotency import KeyConflict, mint_requests
+from dmm.evaluation import (
+    IMAGE_MODEL, IMAGE_SIZE, IMAGE_STEPS, parse_evaluation, finalize_evaluation, build_image_payload,
+    extract_image_url, extract_image_urls, build_nft_metadata, encode_token_uri
+)
+from dmm.examples import EXAMPLE_STORIES
+from dmm.log import get_logger
+from dmm.prompts import (
+    EVALUATION_RUBRIC_EN, LEAN_RUBRIC_EN, SCREEN_RUBRIC_EN, build_feedback_messages, build_openai_messages,
+    build_packed_messages
+)
+from dmm.archive import search_params, stories
+from dmm.export import FORMATS, NEXT_CURSOR_HEADER, ExportUnavailable, export_params, filename, open_export
+from dmm.store import evaluations
+
+log = get_logger("web")
 
 app = Flask(__name__, 
             static_folder=os.path.join(os.path.dirname(__file__), 'static'),
@@ -25,9 +56,9 @@ app = Flask(__name__,
 # 启用 CORS - 用 try-catch 防止导入失败
 try:
     CORS(app)
-    print("✅ CORS 已启用")
+    log.info("cors.enabled")
 except Exception as e:
-    print(f"⚠️  CORS 导入失败: {e}，继续运行...")
+    log.warning("cors.failed", error=str(e))
     # 手动添加 CORS 头
     @app.after_request
     def after_request(response):
@@ -38,46 +69,111 @@ except Exception as e:
 
 # ============== 配置 ==============
 
-# Alchemy API 配置
-ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY", "")
 if not ALCHEMY_API_KEY:
-    print("⚠️  警告: ALCHEMY_API_KEY 环境变量未设置")
-SEPOLIA_RPC = f"https://eth-sepolia.g.alchemy.com/v2/{ALCHEMY_API_KEY}" if ALCHEMY_API_KEY else "https://eth-sepolia.g.alchemy.com/v2/"
+    log.warning("config.missing", name="ALCHEMY_API_KEY")
+if not OPENAI_API_KEY:
+    log.warning("config.missing", name="OPENAI_API_KEY")
 
-# 区块链配置
-AGENT_PRIVATE_KEY = os.getenv("PRIVATE_KEY", "")
-CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0000000000000000000000000000000000000000")
+# 每条链一个常驻 Web3 连接（HTTPProvider 内部复用 requests 会话），链配置见 dmm.chains；
+# sim:// 地址连接进程内模拟链，启动时即部署合约，合约地址在 /api/contract-config 中可见
+chain_connections = chains.Connections(simchain.web3)
+mint_router = chains.MintRouter(chains.mint_chains())
+DEFAULT_CHAIN = chains.default_chain()
+for _chain in chains.mint_chains():
+    chain_connections.get(_chain)
+log.info("web3.initialized", chains=chains.MINT_CHAINS, default=DEFAULT_CHAIN.key)
 
-# AI 配置
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-if not OPENAI_API_KEY:
-    print("⚠️  警告: OPENAI_API_KEY 环境变量未设置")
-OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.siliconflow.cn/v1")
-AI_MODEL = os.getenv("AI_MODEL", "Qwen/Qwen3-Next-80B-A3B-Instruct")
-SCORE_THRESHOLD = int(os.getenv("SCORE_THRESHOLD", "85"))
-
-CONTRACT_ABI = [
-    {
-        "inputs": [
-            {"internalType": "address", "name": "recipient", "type": "address"},
-            {"internalType": "string", "name": "tokenURI", "type": "string"}
-        ],
-        "name": "mintToken",
-        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
+# 归档故事的向量在后台线程中计算（启动时补算缺失的条目），见 dmm.embeddings
+embeddings.start()
+
+# ============== 请求计量 ==============
+
+@app.before_request
+def start_request_timing():
+    metrics.start_request(request.endpoint)
+    accounting.start(
+        accounting.client_id(request.headers.get(accounting.CLIENT_HEADER),
+                             request.headers.get('X-Forwarded-For'), request.remote_addr),
+        request.endpoint
+    )
+    
+    # 请求预算：各阶段以剩余时间作为超时，阶段之间检查客户端是否已断开
+    client_socket = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    deadline.start(
+        deadline.budget_for(request.endpoint, request.headers.get(deadline.TIMEOUT_HEADER)),
+        disconnected=lambda: deadline.socket_disconnected(client_socket)
+    )
+    
+    # 按需剖析：携带 X-Profile 管理令牌或被随机抽中的请求
+    if profiling.should_profile(request.headers.get(profiling.PROFILE_HEADER)):
+        g.profiler = profiling.start_profiler(request.args.get('profile_mode'))
+
+
+@app.after_request
+def add_server_timing(response):
+    server_timing = metrics.finish_request(response.status_code)
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    
+    entry = _finish_profiling(response.status_code)
+    if entry:
+        response.headers['X-Profile-Id'] = str(entry['id'])
+    return response
+
+
+@app.teardown_request
+def stop_profiling_on_error(exc):
+    # 未处理的异常不会经过 after_request，这里确保采样线程被停止
+    _finish_profiling(500)
+    deadline.finish()
+    accounting.finish()
+
+
+def _finish_profiling(status_code):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    data = profiler.stop()
+    entry = profiling.store.add(
+        profiler, data,
+        endpoint=request.endpoint,
+        method=request.method,
+        path=request.path,
+        status=status_code
+    )
+    log.info("profile.captured", profile_id=entry['id'], endpoint=request.endpoint,
+             duration_ms=entry['duration_ms'], samples=entry['samples'])
+    return entry
+
+
+def budget_response(exc):
+    """花费预算用完时的响应（在调用上游之前返回）"""
+    log.warning("request.over_budget", endpoint=request.endpoint, scope=exc.scope,
+                client=exc.client, spent_usd=round(exc.spent, 6), budget_usd=exc.limit)
+    return jsonify(exc.to_dict()), exc.status_code
 
-# 初始化 Web3 - 连接到 Ethereum Sepolia 测试网
-# 使用 try-catch 防止初始化失败导致应用崩溃
-try:
-    web3 = Web3(Web3.HTTPProvider(SEPOLIA_RPC))
-    print(f"✅ Web3 初始化成功，连接到: {SEPOLIA_RPC[:50]}...")
-except Exception as e:
-    print(f"⚠️  Web3 初始化警告: {e}")
-    # 创建一个不连接的 Web3 实例作为降级方案
-    web3 = Web3()
+
+def unavailable_response(exc):
+    """上游熔断时的响应（未调用上游），Retry-After 为熔断器进入半开的剩余时间"""
+    log.warning("request.circuit_open", endpoint=request.endpoint, upstream=exc.breaker,
+                retry_after_s=round(exc.retry_after, 1))
+    return jsonify(exc.to_dict()), exc.status_code, {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+
+
+def aborted_response(exc):
+    """预算耗尽或客户端断开时的响应，标明耗尽预算的阶段"""
+    log.warning("request.aborted", endpoint=request.endpoint, reason=exc.outcome,
+                stage=exc.stage, budget_ms=exc.budget_ms, elapsed_ms=exc.elapsed_ms)
+    return jsonify(exc.to_dict()), exc.status_code
+
+
+def require_admin():
+    """校验管理令牌，失败时返回错误响应，成功时返回 None"""
+    if not profiling.ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled"}), 404
+    if not profiling.is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
 
 # ============== 路由 ==============
 
@@ -87,75 +183,302 @@ def index():
     return render_template('index.html', threshold=SCORE_THRESHOLD)
 
 
+# 最近一次成功读取的链上状态，RPC 熔断时由 /api/status 返回
+last_chain_status = {}
+
+
 @app.route('/api/status')
 def status():
-    """检查系统状态"""
+    """检查系统状态（RPC 熔断时不访问节点，返回最近一次的链上状态）"""
     try:
-        is_connected = web3.is_connected()
+        web3 = chain_connections.get(DEFAULT_CHAIN)
+        rpc = breakers.get(breakers.rpc_name(DEFAULT_CHAIN.key))
+        is_connected = rpc.available() and web3.is_connected()
         
         status_data = {
             "web3_connected": is_connected,
-            "contract_address": CONTRACT_ADDRESS,
-            "threshold": SCORE_THRESHOLD
+            "chain": DEFAULT_CHAIN.key,
+            "chain_name": DEFAULT_CHAIN.name,
+            "contract_address": DEFAULT_CHAIN.contract_address,
+            "chains": mint_router.snapshot(),
+            "threshold": SCORE_THRESHOLD,
+            "prompt_cache": usage.snapshot(),
+            "cascade": cascade.snapshot(),
+            "breakers": breakers.snapshot(),
+            "limits": limits.snapshot(),
+            "pending_mints": mint_supervisor.snapshot()
         }
         
         if is_connected:
-            status_data["chain_id"] = web3.eth.chain_id
-            status_data["block_number"] = web3.eth.block_number
+            with metrics.stage("chain_info", upstream="rpc"), deadline.stage("chain_info"), rpc.guard():
+                status_data["chain_id"] = web3.eth.chain_id
+                status_data["block_number"] = web3.eth.block_number
             
             # 检查钱包
-            if AGENT_PRIVATE_KEY and AGENT_PRIVATE_KEY != "your_private_key_here":
+            if has_agent_key():
                 try:
                     account = web3.eth.account.from_key(AGENT_PRIVATE_KEY)
-                    balance = web3.eth.get_balance(account.address)
+                    with metrics.stage("balance", upstream="rpc"), deadline.stage("balance"), rpc.guard():
+                        balance = web3.eth.get_balance(account.address)
                     status_data["agent_address"] = account.address
                     status_data["balance"] = float(web3.from_wei(balance, 'ether'))
+                except (RequestAborted, CircuitOpen):
+                    raise
                 except Exception as e:
                     status_data["wallet_error"] = "Invalid private key configuration"
+            last_chain_status.clear()
+            last_chain_status.update({key: status_data[key] for key in ("chain_id", "block_number", "agent_address", "balance")
+                                      if key in status_data}, updated_at=datetime.now().isoformat())
+        elif rpc.state != breakers.CLOSED:
+            status_data["chain_status"] = dict(last_chain_status, stale=True)
         
         return jsonify(status_data)
+    except CircuitOpen:
+        # 本次请求中 RPC 熔断
+        return jsonify(dict(status_data, web3_connected=False, chain_status=dict(last_chain_status, stale=True)))
+    except RequestAborted as e:
+        return aborted_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def generate_image(prompt):
-    """调用 SiliconFlow API 生成图片"""
+def _image_headers():
+    return {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+def send_image_batch(key, prompt, count):
+    """微批处理器的上游调用：一次生成 count 张同一提示词的图片"""
+    model, image_size, steps = key
+    for attempt in limits.attempts("image"):
+        with attempt, metrics.stage("image_batch", upstream="image"):
+            response = requests.post(IMAGE_API_URL, headers=_image_headers(),
+                                     json=build_image_payload(prompt, image_size, steps, count), timeout=60)
+            response.raise_for_status()
+            return extract_image_urls(response.json())
+
+
+# IMAGE_BATCH_WINDOW_MS > 0 时，并发的图片请求经微批处理器合并后再调用上游
+image_batcher = ThreadedBatcher(send_image_batch)
+
+
+def generate_image(prompt, image_size=IMAGE_SIZE, steps=IMAGE_STEPS, stage_name="image"):
+    """调用 SiliconFlow API 生成图片（预算耗尽或客户端断开时抛出 RequestAborted）"""
     try:
-        url = "https://api.siliconflow.cn/v1/images/generations"
-        headers = {
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "black-forest-labs/FLUX.1-schnell",
-            "prompt": prompt,
-            "image_size": "1024x1024",
-            "batch_size": 1,
-            "num_inference_steps": 20
-        }
-        
-        print(f"🎨 生成图片，提示词: {prompt}")
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
+        log.debug("image.request", prompt=prompt, stage=stage_name)
+        # 微批处理时由 send_image_batch 占用图片的并发空位
+        for attempt in limits.attempts("image", enabled=not image_batcher.enabled):
+            with attempt, metrics.stage(stage_name, upstream="image") as stage, \
+                    deadline.stage(stage_name, cap=60) as timeout, breakers.guard("image"):
+                if image_batcher.enabled:
+                    image_url = image_batcher.submit((IMAGE_MODEL, image_size, steps), prompt).result(timeout)
+                else:
+                    payload = build_image_payload(prompt, image_size, steps)
+                    response = requests.post(IMAGE_API_URL, headers=_image_headers(), json=payload, timeout=timeout)
+                    response.raise_for_status()
+                    image_url = extract_image_url(response.json())
+                
+                if not image_url:
+                    stage.outcome = "empty"
         
-        result = response.json()
-        if result.get('images') and len(result['images']) > 0:
-            image_url = result['images'][0]['url']
-            print(f"✅ 图片生成成功: {image_url}")
+        if image_url:
+            accounting.record_image(IMAGE_MODEL)
+            log.info("image.generated", image_url=image_url, stage=stage_name)
             return image_url
         else:
-            print("❌ 图片生成失败: 没有返回图片URL")
+            log.warning("image.empty", prompt=prompt)
             return None
             
-    except requests.exceptions.Timeout:
-        print("❌ 图片生成超时")
+    except RequestAborted:
+        raise
+    except CircuitOpen as e:
+        # 图片服务熔断：跳过图片，之后可以重新调用 POST /api/image
+        log.warning("image.skipped", reason="circuit_open", retry_after_s=round(e.retry_after, 1))
+        return None
+    except (requests.exceptions.Timeout, FutureTimeoutError):
+        log.warning("image.timeout", prompt=prompt)
         return None
     except Exception as e:
-        print(f"❌ 图片生成失败: {str(e)}")
+        log.error("image.failed", error=str(e))
         return None
 
 
+# 渐进模式下在后台渲染最终图片
+_render_pool = ThreadPoolExecutor(max_workers=images.IMAGE_RENDER_WORKERS, thread_name_prefix="dmm-image")
+
+
+def render_final_image(job_id, prompt, client):
+    """后台渲染完整质量的图片，完成后写入缓存并更新任务"""
+    with accounting.client_scope(client):
+        image_url = generate_image(prompt)
+    if image_url:
+        images.cache.put(prompt, image_url)
+        images.jobs.complete(job_id, image_url)
+    else:
+        images.jobs.fail(job_id, "Image generation failed")
+
+
+def attach_image(evaluation, progressive):
+    """
+    为评估结果生成图片
+    
+    优先使用缓存的最终图片；渐进模式下后台开始渲染最终图片，同时生成预览图并立即返回，
+    客户端通过 /api/images/<job_id> 取得最终图片。
+    """
+    prompt = evaluation['image_prompt']
+    cached = images.cache.get(prompt)
+    if cached:
+        evaluation['image_url'] = cached
+        return evaluation
+    
+    if not progressive:
+        evaluation['image_url'] = generate_image(prompt)
+        images.cache.put(prompt, evaluation['image_url'])
+        return evaluation
+    
+    job, created = images.jobs.find_or_create(prompt)
+    if created:
+        _render_pool.submit(render_final_image, job['id'], prompt, accounting.current_client())
+        try:
+            preview_url = generate_image(prompt, images.IMAGE_PREVIEW_SIZE, images.IMAGE_PREVIEW_STEPS,
+                                         stage_name="image_preview")
+        except DeadlineExceeded:
+            # 预览图超出预算时最终图片仍在渲染，带上任务 ID 供客户端查询
+            images.apply_job(evaluation, job)
+            raise
+        job = images.jobs.set_preview(job['id'], preview_url) or job
+    return images.apply_job(evaluation, job)
+
+
+def generate_evaluation_image(evaluation, progressive):
+    """
+    为评估结果生成图片
+    
+    图片是可选的：预算在图片阶段耗尽时仍返回评估结果，并标明耗尽的阶段
+    """
+    try:
+        attach_image(evaluation, progressive)
+    except DeadlineExceeded as e:
+        log.warning("image.deadline", budget_ms=e.budget_ms, elapsed_ms=e.elapsed_ms)
+        evaluation['deadline_exceeded'] = e.stage
+    if not evaluation.get('image_url') and not evaluation.get('image_job'):
+        log.warning("image.missing", score=evaluation.get('score'))
+    return evaluation
+
+
+def start_background_image(evaluation):
+    """在后台渲染最终图片，不等待结果；客户端通过 image_job 查询"""
+    prompt = evaluation['image_prompt']
+    cached = images.cache.get(prompt)
+    if cached:
+        evaluation['image_url'] = cached
+        return evaluation
+    job, created = images.jobs.find_or_create(prompt)
+    if created:
+        _render_pool.submit(render_final_image, job['id'], prompt, accounting.current_client())
+    return images.apply_job(evaluation, job)
+
+
+def screen_story(client, story_text):
+    """级联评估第一步：用小模型只估一个分数，失败时返回 None（回退到完整评估）"""
+    try:
+        started = time.perf_counter()
+        for attempt in limits.attempts("llm"):
+            with attempt, metrics.stage("screen", upstream="llm"), deadline.stage("screen") as timeout, \
+                    breakers.guard("llm"):
+                response = client.chat.completions.create(
+                    model=cascade.SCREEN_MODEL,
+                    messages=build_openai_messages(story_text, SCREEN_RUBRIC_EN),
+                    temperature=0,
+                    max_tokens=cascade.SCREEN_MAX_TOKENS,
+                    timeout=timeout
+                )
+        stats = usage.record_usage("openai-screen", response.usage, (time.perf_counter() - started) * 1000)
+        accounting.record_llm(cascade.SCREEN_MODEL, stats)
+        return cascade.parse_screen_score(response.choices[0].message.content)
+    except RequestAborted:
+        raise
+    except Exception as e:
+        log.warning("screen.failed", error=str(e))
+        return None
+
+
+def request_evaluation(client, story_text, lean=False):
+    """
+    完整评估一个故事（一次 LLM 调用），返回解析后的评估结果
+    
+    lean 为 True 时使用精简评分标准，不生成 feedback（见 dmm.feedback）
+    """
+    # 评分标准放在固定的系统提示词中，用户消息只包含故事
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        with attempt, metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout, \
+                breakers.guard("llm"):
+            response = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=build_openai_messages(story_text, LEAN_RUBRIC_EN if lean else EVALUATION_RUBRIC_EN),
+                temperature=0.7,
+                max_tokens=feedback.max_tokens(lean),
+                timeout=timeout
+            )
+    stats = usage.record_usage("openai-lean" if lean else "openai", response.usage,
+                               (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+    
+    with metrics.stage("parse"):
+        evaluation = parse_evaluation(response.choices[0].message.content)
+    return feedback.defer(evaluation) if lean else evaluation
+
+
+def request_feedback(client, evaluation, story_text):
+    """按评估结果中已给出的分数生成详细反馈（一次 LLM 调用），返回反馈文本"""
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        with attempt, metrics.stage("llm_feedback", upstream="llm"), deadline.stage("llm_feedback") as timeout, \
+                breakers.guard("llm"):
+            response = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=build_feedback_messages(story_text, evaluation['score'], evaluation.get('metadata_title', '')),
+                temperature=0.7,
+                max_tokens=feedback.FEEDBACK_MAX_TOKENS,
+                timeout=timeout
+            )
+    stats = usage.record_usage("openai-feedback", response.usage, (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+    return feedback.clean_feedback(response.choices[0].message.content)
+
+
+def request_packed_evaluation(client, story_texts):
+    """打包评估一组短故事（一次 LLM 调用），返回 {组内下标: 评估结果}，缺失或无效的结果不在其中"""
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        with attempt, metrics.stage("llm_packed", upstream="llm"), deadline.stage("llm_packed") as timeout, \
+                breakers.guard("llm"):
+            response = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=build_packed_messages(story_texts),
+                temperature=0.7,
+                max_tokens=packing.max_tokens(len(story_texts)),
+                timeout=timeout
+            )
+    stats = usage.record_usage("openai-packed", response.usage, (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+    
+    with metrics.stage("parse"):
+        return packing.parse_packed(response.choices[0].message.content, len(story_texts))
+
+
+# 批量评估中的打包调用和单独调用并发执行（上游并发由 dmm.limits 控制）
+_evaluation_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="dmm-evaluate")
+
+
+def submit_in_request(fn, *args):
+    """在线程池中执行，沿用当前请求的截止时间、耗时明细和客户端"""
+    return _evaluation_pool.submit(contextvars.copy_context().run, fn, *args)
+
+
 @app.route('/api/evaluate', methods=['POST'])
 def evaluate():
     """评估故事"""
@@ -169,77 +492,382 @@ def evaluate():
         if len(story_text) < 50:
             return jsonify({"error": "Story is too short, minimum 50 characters required"}), 400
         
+        accounting.check_budget()
+        
         # AI 评估 - 使用硅基流动 API
+        # 不自动重试：重试会让一次调用超出剩余预算
         client = OpenAI(
             api_key=OPENAI_API_KEY,
-            base_url=OPENAI_API_BASE
-        )
-        
-        prompt = f"""You are a professional literary critic and cultural archivist. Please evaluate the value of the following humanistic story and return the assessment in JSON format.
-
-Scoring Criteria (0-100):
-- Emotional depth and authenticity (30 points)
-- Cultural and historical value (25 points)
-- Narrative quality and structure (20 points)
-- Originality and uniqueness (15 points)
-- Social significance and impact (10 points)
-
-Story Content:
-{story_text}
-
-Please return in strict JSON format (without any markdown formatting):
-{{
-    "score": [integer from 0-100],
-    "metadata_title": "[Brief title, max 50 characters]",
-    "metadata_description": "[Detailed description summarizing the core value and characteristics of the story, 100-200 characters]",
-    "feedback": "[Detailed evaluation feedback explaining the scoring rationale]",
-    "image_prompt": "[English image generation prompt describing the core scene, atmosphere and visual elements of the story, suitable for AI art generation, 50-100 characters]"
-}}"""
-        
-        response = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a professional literary critic. Always return valid JSON format."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=800
+            base_url=OPENAI_API_BASE,
+            max_retries=0
         )
         
-        result_text = response.choices[0].message.content.strip()
+        # 级联评估：小模型预估分明显低于阈值时直接返回轻量结果，不调用完整评估和图片生成
+        screen_score = decision = None
+        if cascade.EVALUATION_CASCADE:
+            screen_score = screen_story(client, story_text)
+            decision = cascade.decide(screen_score, SCORE_THRESHOLD)
+            if decision == "reject":
+                log.info("evaluate.screened", screen_score=screen_score)
+                screened = cascade.build_screened_evaluation(screen_score, SCORE_THRESHOLD)
+                evaluations.add(screened)
+                stories.add(screened, story_text, accounting.current_client())
+                embeddings.enqueue(screened, story_text)
+                return jsonify(screened)
         
-        # 清理可能的 markdown 格式
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
+        lean = feedback.lean_enabled(data)
+        evaluation = request_evaluation(client, story_text, lean)
+        finalize_evaluation(evaluation, SCORE_THRESHOLD)
+        if decision is not None:
+            cascade.record_outcome(decision, screen_score, evaluation['score'], SCORE_THRESHOLD)
+            evaluation['screen_score'] = screen_score
         
-        evaluation = json.loads(result_text.strip())
-        evaluation['timestamp'] = datetime.now().isoformat()
-        evaluation['should_mint'] = evaluation['score'] >= SCORE_THRESHOLD
-        
-        # 生成图片（如果有图片提示词）
-        image_url = None
+        # 图片不在评估的关键路径上：只为达到铸造标准的结果生成（见 dmm.images）
         if evaluation.get('image_prompt'):
-            image_url = generate_image(evaluation['image_prompt'])
-            if image_url:
-                evaluation['image_url'] = image_url
-                print(f"✅ NFT 图片已生成: {image_url}")
-            else:
-                print("⚠️  图片生成失败，但评估继续进行")
-                evaluation['image_url'] = None
+            if images.IMAGE_GENERATION == "eager":
+                generate_evaluation_image(evaluation, images.progressive_enabled(data))
+            elif evaluation['should_mint']:
+                if images.IMAGE_GENERATION == "background":
+                    start_background_image(evaluation)
+                else:
+                    evaluation['image_deferred'] = True
+            evaluation.setdefault('image_url', None)
+        evaluations.add(evaluation)
+        if lean:
+            # 按需生成反馈时需要故事正文，只保存在服务端
+            evaluations.update(evaluation['evaluation_id'], story_text=story_text)
+        stories.add(evaluation, story_text, accounting.current_client())
+        embeddings.enqueue(evaluation, story_text)
         
+        log.info("evaluate.done", score=evaluation['score'], should_mint=evaluation['should_mint'], lean=lean)
         return jsonify(evaluation)
         
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except RequestAborted as e:
+        return aborted_response(e)
     except json.JSONDecodeError as e:
+        log.warning("evaluate.parse_failed", error=str(e))
         return jsonify({"error": f"Failed to parse AI response: {str(e)}"}), 500
     except Exception as e:
+        log.exception("evaluate.failed")
         return jsonify({"error": f"Evaluation failed: {str(e)}"}), 500
 
 
+def batch_item_error(exc):
+    """批量评估中单个故事失败时的结果"""
+    if isinstance(exc, (RequestAborted, CircuitOpen)):
+        return exc.to_dict()
+    if isinstance(exc, json.JSONDecodeError):
+        return {"error": f"Failed to parse AI response: {str(exc)}"}
+    return {"error": f"Evaluation failed: {str(exc)}"}
+
+
+@app.route('/api/evaluate/batch', methods=['POST'])
+def evaluate_batch():
+    """
+    批量评估故事（{"stories": [...]}，见 dmm.packing）
+    
+    短故事打包进同一个提示词评估，长故事和打包结果缺失或无效的故事单独评估。
+    结果按输入顺序返回，单个故事失败时对应位置为 {"error": ...}。
+    批量评估不做级联预筛，也不在请求内生成图片：达到铸造标准的结果带 image_deferred
+    （IMAGE_GENERATION=background 时在后台渲染），之后可调用 POST /api/image
+    """
+    try:
+        data = request.json or {}
+        try:
+            story_texts = packing.story_texts(data.get('stories'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        results = [None] * len(story_texts)
+        candidates = []
+        for index, story_text in enumerate(story_texts):
+            if len(story_text) < 50:
+                results[index] = {"error": "Story is too short, minimum 50 characters required"}
+            else:
+                candidates.append(index)
+        
+        accounting.check_budget()
+        client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_API_BASE,
+            max_retries=0
+        )
+        
+        packs, singles = packing.plan([story_texts[index] for index in candidates])
+        packs = [[candidates[k] for k in pack] for pack in packs]
+        pending = {candidates[k]: submit_in_request(request_evaluation, client, story_texts[candidates[k]])
+                   for k in singles}
+        pack_futures = [(pack, submit_in_request(request_packed_evaluation, client,
+                                                 [story_texts[index] for index in pack]))
+                        for pack in packs]
+        
+        packed = 0
+        for pack, future in pack_futures:
+            try:
+                parsed = future.result()
+            except Exception as e:
+                log.warning("evaluate.pack_failed", stories=len(pack), error=str(e))
+                parsed = {}
+            packing.record_pack(len(pack), len(parsed))
+            packed += len(parsed)
+            for k, index in enumerate(pack):
+                if k in parsed:
+                    results[index] = dict(parsed[k], packed=True)
+                else:
+                    # 打包结果缺失或无效：回退为单独评估
+                    pending[index] = submit_in_request(request_evaluation, client, story_texts[index])
+        
+        failed = set()
+        for index, future in pending.items():
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                log.warning("evaluate.batch_item_failed", index=index, error=str(e))
+                results[index] = batch_item_error(e)
+                failed.add(index)
+        
+        for index in candidates:
+            if index in failed:
+                continue
+            evaluation = results[index]
+            finalize_evaluation(evaluation, SCORE_THRESHOLD)
+            if evaluation.get('image_prompt'):
+                if evaluation['should_mint']:
+                    if images.IMAGE_GENERATION == "background":
+                        start_background_image(evaluation)
+                    else:
+                        evaluation['image_deferred'] = True
+                evaluation.setdefault('image_url', None)
+            evaluations.add(evaluation)
+            stories.add(evaluation, story_texts[index], accounting.current_client())
+            embeddings.enqueue(evaluation, story_texts[index])
+        
+        log.info("evaluate.batch_done", stories=len(story_texts), packs=len(packs), packed=packed,
+                 individual=len(pending))
+        return jsonify({
+            "evaluations": results,
+            "packed": packed,
+            "individual": len(pending),
+            "llm_calls": len(packs) + len(pending)
+        })
+        
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except Exception as e:
+        log.exception("evaluate.batch_failed")
+        return jsonify({"error": f"Evaluation failed: {str(e)}"}), 500
+
+
+@app.route('/api/evaluate/<evaluation_id>/feedback')
+def evaluation_feedback(evaluation_id):
+    """
+    按需生成评估的详细反馈（精简评估的结果不含 feedback，见 dmm.feedback）
+    
+    生成的反馈保存到评估结果并写入归档，重复调用直接返回已保存的反馈；
+    进程内存储中没有该评估时从归档读取，同一条评估的并发请求只生成一次
+    """
+    try:
+        evaluation = feedback.lookup(evaluation_id)
+        if evaluation is None:
+            return jsonify({"error": "Evaluation not found"}), 404
+        if evaluation.get('feedback'):
+            feedback.FEEDBACK_REQUESTS.inc(outcome="cached")
+            return jsonify({"evaluation_id": evaluation_id, "feedback": evaluation['feedback'], "cached": True})
+        if not evaluation.get('story_text'):
+            return jsonify({"error": "Evaluation has no stored story"}), 409
+        
+        future, leader = feedback.inflight.join(evaluation_id)
+        if not leader:
+            with deadline.stage("feedback_wait") as timeout:
+                text = future.result(timeout)
+            feedback.FEEDBACK_REQUESTS.inc(outcome="joined")
+            return jsonify({"evaluation_id": evaluation_id, "feedback": text, "cached": True})
+        
+        try:
+            accounting.check_budget()
+            client = OpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=OPENAI_API_BASE,
+                max_retries=0
+            )
+            text = request_feedback(client, evaluation, evaluation['story_text'])
+            feedback.save(evaluation_id, text)
+        except BaseException as e:
+            feedback.inflight.finish(evaluation_id, error=e)
+            raise
+        feedback.inflight.finish(evaluation_id, text)
+        feedback.FEEDBACK_REQUESTS.inc(outcome="generated")
+        
+        log.info("feedback.done", evaluation_id=evaluation_id, length=len(text))
+        return jsonify({"evaluation_id": evaluation_id, "feedback": text, "cached": False})
+    
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except RequestAborted as e:
+        return aborted_response(e)
+    except Exception as e:
+        log.exception("feedback.failed")
+        return jsonify({"error": f"Feedback generation failed: {str(e)}"}), 500
+
+
+@app.route('/api/image', methods=['POST'])
+def create_image():
+    """
+    为已完成的评估生成图片（按 evaluation_id 取服务端保存的结果）
+    
+    只接受达到铸造标准的评估；已有最终图片或渲染任务时直接返回，重复调用不会再次生成
+    """
+    try:
+        data = request.json or {}
+        evaluation_id = data.get('evaluation_id')
+        if not evaluation_id:
+            return jsonify({"error": "evaluation_id is required"}), 400
+        evaluation = evaluations.get(evaluation_id)
+        if evaluation is None:
+            return jsonify({"error": "Evaluation not found"}), 404
+        if not evaluation.get('should_mint'):
+            return jsonify({"error": "Images are only generated for mint-eligible evaluations"}), 409
+        if not evaluation.get('image_prompt'):
+            return jsonify({"error": "Evaluation has no image prompt"}), 409
+        
+        accounting.check_budget()
+        job = images.jobs.get(evaluation['image_job']) if evaluation.get('image_job') else None
+        if job is not None and job['status'] != 'failed':
+            evaluation.pop('image_preview', None)
+            images.apply_job(evaluation, job)
+        elif not evaluation.get('image_url') or evaluation.get('image_preview'):
+            for field in ('image_url', 'image_preview', 'image_job', 'deadline_exceeded'):
+                evaluation.pop(field, None)
+            generate_evaluation_image(evaluation, images.progressive_enabled(data))
+        
+        result = {field: evaluation.get(field) for field in ('image_url', 'image_preview', 'image_job', 'deadline_exceeded')}
+        evaluations.update(evaluation_id, image_deferred=False, **result)
+        if result['image_url'] and not result['image_preview']:
+            stories.update(evaluation_id, image_url=result['image_url'])
+        log.info("create_image.done", evaluation_id=evaluation_id, preview=bool(result['image_preview']))
+        return jsonify(dict(result, evaluation_id=evaluation_id, image_prompt=evaluation['image_prompt']))
+    
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except RequestAborted as e:
+        return aborted_response(e)
+    except Exception as e:
+        log.exception("create_image.failed")
+        return jsonify({"error": f"Image generation failed: {str(e)}"}), 500
+
+
+@app.route('/api/images/<job_id>')
+def image_job(job_id):
+    """查询后台图片渲染任务（渐进模式）"""
+    job = images.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Image job not found"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/search')
+def search():
+    """
+    检索归档的评估结果
+    
+    q 为关键词（中英文均可，按相关度排序；为空时按时间倒序），min_score / max_score /
+    since / until / should_mint / minted 过滤，page / per_page 分页
+    """
+    try:
+        params = search_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid search parameter: {str(e)}"}), 400
+    with metrics.stage("search"):
+        result = stories.search(**params)
+    return jsonify(dict(result, query=params['query'], page=params['offset'] // params['limit'] + 1,
+                        per_page=params['limit']))
+
+
+@app.route('/api/memories/<evaluation_id>/related')
+def related_memories(evaluation_id):
+    """与某条归档评估最相似的故事（k 为返回条数），向量尚未计算完成时返回 202"""
+    try:
+        k = int(request.args.get('k', 10))
+    except ValueError:
+        return jsonify({"error": "Invalid parameter: k"}), 400
+    try:
+        with metrics.stage("related"):
+            result = embeddings.related(evaluation_id, k)
+    except KeyError:
+        return jsonify({"error": "Evaluation not found in archive"}), 404
+    return jsonify(result), 202 if result.get('pending') else 200
+
+
+def refresh_gas_prices():
+    """刷新过期的各链 gas 价格，供铸造路由比较"""
+    for chain in mint_router.stale():
+        try:
+            with metrics.stage("gas_price_probe", upstream="rpc"), deadline.stage("gas_price_probe", cap=5), \
+                    breakers.guard(breakers.rpc_name(chain.key)):
+                gas_price = chain_connections.get(chain).eth.gas_price
+            mint_router.observe_gas_price(chain.key, gas_price)
+        except RequestAborted:
+            raise
+        except CircuitOpen:
+            continue
+        except Exception as e:
+            log.warning("chain.probe_failed", chain=chain.key, error=str(e))
+            chain_connections.mark_failed(chain)
+            mint_router.observe_failure(chain.key)
+
+
+def settle_mint(idempotency_key, chain, contract, tx_hash_hex, tx_receipt, gas_price, evaluation_id, replaced=()):
+    """记录交易收据：核算 gas、更新归档和幂等记录，返回铸造结果（replaced 为被替换的同 nonce 交易）"""
+    accounting.record_gas(tx_receipt['gasUsed'], tx_receipt.get('effectiveGasPrice', gas_price), chain.key)
+    result = {
+        "success": tx_receipt['status'] == 1,
+        "chain": chain.key,
+        "chain_id": chain.chain_id,
+        "chain_name": chain.name,
+        "tx_hash": tx_hash_hex,
+        "token_id": minted_token_id(contract, tx_receipt),
+        "gas_used": tx_receipt['gasUsed'],
+        "block_number": tx_receipt['blockNumber'],
+        "explorer_url": chain.tx_url(tx_hash_hex),
+        "timestamp": datetime.now().isoformat()
+    }
+    if replaced:
+        result["replaced_tx_hashes"] = list(replaced)
+    
+    log.info("mint.confirmed", tx_hash=tx_hash_hex, success=result['success'], token_id=result['token_id'],
+             gas_used=result['gas_used'], block_number=result['block_number'], replaced=len(replaced))
+    if result['success']:
+        stories.mark_minted(evaluation_id, chain.key, tx_hash_hex, result['token_id'])
+        mint_requests.complete(idempotency_key, result)
+    else:
+        # 交易回滚：不占用幂等键，允许重新铸造
+        mint_requests.discard(idempotency_key)
+    return result
+
+
+def settle_pending_mint(pending, tx_hash_hex, tx_receipt, gas_price):
+    """后台确认的交易（可能是替换后的那一笔）"""
+    settle_mint(pending.key, pending.chain, pending.contract, tx_hash_hex, tx_receipt, gas_price,
+                pending.evaluation_id, pending.replaced(tx_hash_hex))
+
+
+# 请求内没有等到收据的交易交给后台监督：继续查询收据，卡住时提价替换
+mint_supervisor = supervisor.MintSupervisor(chain_connections, AGENT_PRIVATE_KEY, settle_pending_mint)
+
+
 @app.route('/api/mint', methods=['POST'])
 def mint():
     """铸造 NFT"""
+    chain = None
+    idempotency_key = None
+    nonce_lease = None
+    pending = None
     try:
         data = request.json
         metadata = data.get('metadata', {})
@@ -247,85 +875,144 @@ def mint():
         if not metadata.get('metadata_title') or not metadata.get('metadata_description'):
             return jsonify({"error": "Incomplete metadata"}), 400
         
+        # 构建符合 NFT 标准的元数据
+        nft_metadata = build_nft_metadata(metadata)
+        
+        # 幂等：同一个 Idempotency-Key（或同一份元数据）只铸造一次，重复请求直接返回已有结果，不访问 RPC
+        request_hash = idempotency.metadata_hash(nft_metadata)
+        try:
+            key = idempotency.request_key(request.headers.get(idempotency.HEADER), accounting.current_client(),
+                                          request_hash)
+            record = mint_requests.claim(key, request_hash)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except KeyConflict as e:
+            return jsonify(e.to_dict()), e.status_code
+        if record is not None:
+            log.info("mint.replayed", status=record['status'], tx_hash=record['tx_hash'])
+            body, status_code = idempotency.replay(record)
+            return jsonify(body), status_code, {idempotency.REPLAY_HEADER: "true"}
+        idempotency_key = key
+        
+        # 选择目标链：请求可以用 chain 指定，否则按观测到的费用和确认时间路由
+        refresh_gas_prices()
+        try:
+            chain = mint_router.choose(data.get('chain'))
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 400
+        web3 = chain_connections.get(chain)
+        rpc = breakers.get(breakers.rpc_name(chain.key))
+        
         # 获取账户
         account = web3.eth.account.from_key(AGENT_PRIVATE_KEY)
         agent_address = account.address
         
         # 创建合约实例
         contract = web3.eth.contract(
-            address=Web3.to_checksum_address(CONTRACT_ADDRESS),
+            address=Web3.to_checksum_address(chain.contract_address),
             abi=CONTRACT_ABI
         )
         
-        # 构建符合 NFT 标准的元数据
-        nft_metadata = {
-            "name": metadata.get('metadata_title', 'Untitled Memory'),
-            "description": metadata.get('metadata_description', ''),
-            "image": metadata.get('image_url', ''),
-            "attributes": [
-                {
-                    "trait_type": "Score",
-                    "value": metadata.get('score', 0)
-                },
-                {
-                    "trait_type": "Timestamp",
-                    "value": metadata.get('timestamp', '')
-                }
-            ]
-        }
+        # 元数据转换为 base64 编码的 data URI
+        token_uri = encode_token_uri(nft_metadata)
         
-        # 如果有图片提示词，也加入属性
-        if metadata.get('image_prompt'):
-            nft_metadata['attributes'].append({
-                "trait_type": "Image Prompt",
-                "value": metadata.get('image_prompt', '')
-            })
+        # 完整元数据只在 DEBUG 级别输出，序列化在日志线程中完成
+        log.debug("mint.metadata", metadata=nft_metadata)
+        log.info("mint.prepared", token_uri_length=len(token_uri))
         
-        # 将元数据转换为 base64 编码的 data URI
-        import base64
-        metadata_json = json.dumps(nft_metadata, ensure_ascii=False)
-        metadata_base64 = base64.b64encode(metadata_json.encode('utf-8')).decode('utf-8')
-        token_uri = f"data:application/json;base64,{metadata_base64}"
+        # 构建交易：并发请求各自分配 nonce，没有发出的交易在结束时归还
+        with metrics.stage("nonce", upstream="rpc"), deadline.stage("nonce"), rpc.guard():
+            pending_count = web3.eth.get_transaction_count(agent_address, 'pending')
+        nonce = supervisor.nonces.allocate((chain.key, agent_address), pending_count)
+        nonce_lease = (chain.key, agent_address), nonce
         
-        print(f"📝 NFT 元数据: {json.dumps(nft_metadata, ensure_ascii=False, indent=2)}")
-        print(f"🔗 Token URI 长度: {len(token_uri)} 字符")
-        
-        # 构建交易
-        nonce = web3.eth.get_transaction_count(agent_address)
+        with metrics.stage("gas_price", upstream="rpc"), deadline.stage("gas_price"), rpc.guard():
+            gas_price = web3.eth.gas_price
+        mint_router.observe_gas_price(chain.key, gas_price)
+        accounting.check_budget(accounting.gas_cost(MINT_GAS_LIMIT, gas_price))
         
         transaction = contract.functions.mintToken(
             Web3.to_checksum_address(agent_address),
             token_uri
         ).build_transaction({
-            'chainId': 11155111,  # Ethereum Sepolia 测试网
-            'gas': 300000,
-            'gasPrice': web3.eth.gas_price,
+            'chainId': chain.chain_id,
+            'gas': MINT_GAS_LIMIT,
+            'gasPrice': gas_price,
             'nonce': nonce,
         })
         
         # 签名交易
-        signed_txn = web3.eth.account.sign_transaction(transaction, AGENT_PRIVATE_KEY)
-        
-        # 发送交易
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
-        tx_hash_hex = tx_hash.hex()
-        
-        # 等待确认
-        tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-        
-        result = {
-            "success": tx_receipt['status'] == 1,
-            "tx_hash": tx_hash_hex,
-            "gas_used": tx_receipt['gasUsed'],
-            "block_number": tx_receipt['blockNumber'],
-            "explorer_url": f"https://sepolia.etherscan.io/tx/{tx_hash_hex}",  # Ethereum Sepolia 浏览器
-            "timestamp": datetime.now().isoformat()
-        }
+        with metrics.stage("sign"):
+            signed_txn = web3.eth.account.sign_transaction(transaction, AGENT_PRIVATE_KEY)
         
+        # 发送交易（发送前最后一次检查预算和客户端连接，发送后交易不可撤回）
+        # 发送前先记下交易哈希：此后重复请求返回 pending，不会再发送第二笔
+        tx_hash_hex = signed_txn.hash.hex()
+        with metrics.stage("send", upstream="rpc"), deadline.stage("send"), rpc.guard(ignore=(ValueError,)):
+            pending = supervisor.PendingMint(idempotency_key, chain, contract, transaction,
+                                             metadata.get('evaluation_id'), accounting.current_client())
+            pending.sending(tx_hash_hex, gas_price)
+            mint_requests.sending(idempotency_key, tx_hash_hex, pending.response())
+            # 交易可能已经发出，nonce 不再归还
+            lease, nonce_lease = nonce_lease, None
+            try:
+                tx_hash = web3.eth.send_raw_transaction(signed_txn.rawTransaction)
+            except ValueError as e:
+                # 节点返回 JSON-RPC 错误，交易没有被接受
+                mint_requests.discard(idempotency_key)
+                pending = None
+                if supervisor.is_nonce_too_low(e):
+                    supervisor.nonces.reset(lease[0])
+                else:
+                    nonce_lease = lease
+                raise
+        sent_at = time.perf_counter()
+        log.info("mint.sent", chain=chain.key, tx_hash=tx_hash_hex, nonce=nonce, gas_price=gas_price)
+        
+        # 等待确认；超出预算时交易仍可能上链，响应中带上交易哈希供客户端跟踪
+        try:
+            # 等待确认本身耗时取决于出块，不计慢调用；等待超时也不计为 RPC 故障
+            with metrics.stage("receipt", upstream="rpc"), \
+                    deadline.stage("receipt", cap=supervisor.MINT_CONFIRM_TARGET_S) as timeout, \
+                    rpc.guard(slow=False, ignore=(TimeExhausted,)):
+                tx_receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=timeout)
+        except TimeExhausted:
+            # 目标确认时间内没有上链：交给后台监督（必要时提价替换），重复请求返回 pending
+            log.warning("mint.slow_confirmation", chain=chain.key, tx_hash=tx_hash_hex, nonce=nonce)
+            return jsonify(dict(pending.response(), pending=True)), 202
+        except RequestAborted as e:
+            e.details.update(tx_hash=tx_hash_hex, explorer_url=chain.tx_url(tx_hash_hex), chain=chain.key, pending=True)
+            raise
+        
+        mint_router.observe_mint(chain.key, tx_receipt['gasUsed'], time.perf_counter() - sent_at)
+        pending = None
+        result = settle_mint(idempotency_key, chain, contract, tx_hash_hex, tx_receipt, gas_price,
+                             metadata.get('evaluation_id'))
         return jsonify(result)
         
+    except BudgetExceeded as e:
+        return budget_response(e)
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except RequestAborted as e:
+        return aborted_response(e)
     except Exception as e:
+        if chain is not None and isinstance(e, requests.exceptions.RequestException):
+            # RPC 不可用：切换到地址池中的下一个节点，路由暂时避开该链
+            chain_connections.mark_failed(chain)
+            mint_router.observe_failure(chain.key)
+        log.exception("mint.failed")
         return jsonify({"error": f"Minting failed: {str(e)}"}), 500
+    finally:
+        if nonce_lease is not None:
+            supervisor.nonces.release(*nonce_lease)
+        if idempotency_key is not None:
+            if pending is not None:
+                # 交易可能已经发出：幂等记录保持 pending，由后台监督等待收据
+                mint_supervisor.follow(pending)
+            else:
+                # 交易没有发出：释放幂等键（已完成或已删除的记录不受影响）
+                mint_requests.release(idempotency_key)
 
 
 @app.route('/api/contract-config')
@@ -333,66 +1020,93 @@ def contract_config():
     """获取合约配置"""
     try:
         # 读取合约 ABI
-        abi_path = os.path.join(os.path.dirname(__file__), '..', 'contracts', 'MemoryToken_ABI.json')
-        
-        if os.path.exists(abi_path):
-            with open(abi_path, 'r') as f:
-                contract_abi = json.load(f)
-        else:
-            # 返回最小 ABI
-            contract_abi = [
-                {
-                    "inputs": [{"internalType": "string", "name": "tokenURI", "type": "string"}],
-                    "name": "mint",
-                    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-                    "stateMutability": "payable",
-                    "type": "function"
-                }
-            ]
+        contract_abi = load_contract_abi()
         
+        # 顶层字段为默认链（前端钱包铸造使用），chains 列出所有可铸造的链
         return jsonify({
-            "address": CONTRACT_ADDRESS,
+            "address": DEFAULT_CHAIN.contract_address,
             "abi": contract_abi,
-            "chain_id": 11155111,  # Sepolia
-            "chain_name": "Ethereum Sepolia"
+            "chain": DEFAULT_CHAIN.key,
+            "chain_id": DEFAULT_CHAIN.chain_id,
+            "chain_name": DEFAULT_CHAIN.name,
+            "chain_config": DEFAULT_CHAIN.to_dict(),
+            "chains": [chain.to_dict() for chain in chains.mint_chains()]
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/examples')
-def examples():
-    """获取示例故事"""
-    example_stories = [
-        {
-            "title": "The Potter's Final Masterpiece",
-            "content": """In an ancient village lived an elderly potter. He had spent a lifetime shaping clay into vessels, firing memories into each creation. His hands were covered with cracks, like the textures on the pottery he crafted. All the young people had left for the cities, leaving only him to guard this dying craft.
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 格式的分阶段耗时指标"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
-On a rainy night, he lit his kiln for the last time. In the firelight, he saw his entire life—the wonder of first touching clay as a child, the hardships of apprenticeship in his youth, and the solitude of his twilight years as a guardian. When villagers found him the next day, the pottery in the kiln had been perfectly fired, smooth as jade. The old man sat there quietly, a contented smile on his face, as if he himself had become his final masterpiece.
 
-The story spread throughout the region, and that last piece of pottery was sent to a museum. People say if you listen carefully, you can still hear the sound of the kiln fire burning within the vessel—a craftsman's most gentle conversation with time."""
-        },
-        {
-            "title": "The Library Night Watchman",
-            "content": """In the old quarter of the city stood a century-old library. Each night after closing, the watchman, Old Zhang, would patrol among the bookshelves. He said these books also needed company.
+@app.route('/admin/profiles')
+def list_profiles():
+    """列出环形缓冲区中的剖析结果"""
+    denied = require_admin()
+    if denied:
+        return denied
+    return jsonify(profiling.store.list())
 
-One day, he discovered a yellowed diary tucked between two thick history books. The diary belonged to a young librarian who had protected books during wartime, risking her life to move precious ancient texts to safety. The last page read: "Knowledge is humanity's most precious treasure, worth protecting with our lives."
 
-Old Zhang placed this diary in the library's most prominent position. From then on, every visitor could read this story. People began to understand that protecting knowledge is not just a job—it's a legacy to be passed down."""
-        },
-        {
-            "title": "Grandmother's Recipe Book",
-            "content": """After my grandmother passed away, I found a handwritten recipe book in her old trunk. Each page recorded a dish's preparation method, with small drawings she had sketched herself. But what moved me most were the notes written after each recipe.
+@app.route('/admin/usage')
+def usage_report():
+    """滚动窗口内的花费汇总（按服务类型和客户端），需要管理令牌"""
+    denied = require_admin()
+    if denied:
+        return denied
+    try:
+        window = float(request.args.get('window', accounting.BUDGET_WINDOW_S))
+    except ValueError:
+        return jsonify({"error": "window must be a number of seconds"}), 400
+    return jsonify(accounting.snapshot(window))
 
-"Braised pork—your grandfather's favorite. He'd always have an extra bowl of rice when I made this."
-"Sweet and sour ribs—your father was a picky eater as a child, so I made this to coax him."
-"Tomato and eggs—I made this specially to celebrate the day you were born."
 
-Each dish carried a story, a memory. I decided to learn all these recipes, not just because they were delicious, but because they were grandmother's code of love, left for me to decipher."""
-        }
-    ]
-    
-    return jsonify(example_stories)
+@app.route('/admin/export')
+def export_memories():
+    """
+    流式导出归档（format 为 ndjson / csv / parquet），需要管理令牌
+
+    cursor 从某条之后继续，limit 分页（下一页的 cursor 在 X-Export-Next-Cursor 响应头中），
+    since / until / min_score / max_score / should_mint / minted 过滤
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    try:
+        params = export_params(request.args)
+        stream, next_cursor = open_export(params)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid export parameter: {str(e)}"}), 400
+    except ExportUnavailable as e:
+        return jsonify(e.to_dict()), e.status_code
+    headers = {'Content-Disposition': f'attachment; filename="{filename(params["format"])}"'}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    return Response(iter(stream), content_type=FORMATS[params['format']], headers=headers)
+
+
+@app.route('/admin/profiles/<int:profile_id>')
+def get_profile(profile_id):
+    """下载单个剖析结果（折叠栈文本或 pstats 文件）"""
+    denied = require_admin()
+    if denied:
+        return denied
+    item = profiling.store.get(profile_id)
+    if item is None:
+        return jsonify({"error": "Profile not found"}), 404
+    entry, data, content_type = item
+    return Response(data, content_type=content_type, headers={
+        "Content-Disposition": f"attachment; filename={entry['filename']}"
+    })
+
+
+@app.route('/api/examples')
+def examples():
+    """获取示例故事"""
+    return jsonify(EXAMPLE_STORIES)
 
 
 # ============== 启动应用 ==============
@@ -406,9 +1120,9 @@ if __name__ == '__main__':
     print(f"\n📱 访问地址: http://localhost:{port}")
     print(f"🤖 AI 模型: {AI_MODEL}")
     print(f"🔗 AI 服务: 硅基流动 (SiliconFlow)")
-    print(f"⛓️  区块链: Ethereum Sepolia (Alchemy)")
+    print(f"⛓️  区块链: {', '.join(chain.name for chain in chains.mint_chains())}")
     print(f"📊 评分阈值: {SCORE_THRESHOLD}")
-    print(f"📝 合约地址: {CONTRACT_ADDRESS[:10]}...{CONTRACT_ADDRESS[-4:]}")
+    print(f"📝 合约地址: {DEFAULT_CHAIN.contract_address[:10]}...{DEFAULT_CHAIN.contract_address[-4:]}")
     print(f"\n按 Ctrl+C 停止服务器\n")
     
     app.run(debug=True, host='0.0.0.0', port=port)
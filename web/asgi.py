@@ -0,0 +1,1233 @@
+"""
+Digital Memory Museum (DMM) | 数字记忆博物馆 - ASGI 版本
+
+与 web/app.py 提供相同的接口，但所有上游调用都是异步的：
+AsyncOpenAI（评估）、aiohttp（图片生成）、AsyncWeb3（链上读写）。
+等待上游时不占用线程，单个进程即可同时挂起大量评估和铸造请求。
+Vercel 部署（api/index.py）仍使用 Flask 版本。
+
+运行（在项目根目录）:
+    uvicorn web.asgi:app --host 0.0.0.0 --port 5001
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import contextvars
+import functools
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime
+
+import aiohttp
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from web3 import Web3
+from web3.exceptions import TimeExhausted
+
+# 将项目根目录添加到 Python 路径，以便导入共享模块（导入 dmm 时会加载 .env）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dmm import accounting, breakers, cascade, chains, deadline, embeddings, feedback, idempotency, images, limits, metrics, packing, profiling, simchain, supervisor, usage
+from dmm.config import (
+    AGENT_PRIVATE_KEY, OPENAI_API_KEY, OPENAI_API_BASE, AI_MODEL, SCORE_THRESHOLD,
+    IMAGE_API_URL, MINT_GAS_LIMIT, has_agent_key
+)
+from dmm.accounting import BudgetExceeded
+from dmm.batching import AsyncBatcher
+from dmm.breakers import CircuitOpen
+from dmm.contracts import CONTRACT_ABI, load_contract_abi, minted_token_id
+from dmm.deadline import ClientDisconnected, DeadlineExceeded, RequestAborted
+from dmm.idempotency import KeyConflict, mint_requests
+from dmm.evaluation import (
+    IMAGE_MODEL, IMAGE_SIZE, IMAGE_STEPS, parse_evaluation, finalize_evaluation, build_image_payload,
+    extract_image_url, extract_image_urls, build_nft_metadata, encode_token_uri
+)
+from dmm.examples import EXAMPLE_STORIES
+from dmm.log import get_logger
+from dmm.prompts import (
+    EVALUATION_RUBRIC_EN, LEAN_RUBRIC_EN, SCREEN_RUBRIC_EN, build_feedback_messages, build_openai_messages,
+    build_packed_messages
+)
+from dmm.archive import search_params, stories
+from dmm.export import FORMATS, NEXT_CURSOR_HEADER, ExportUnavailable, export_params, filename, open_export
+from dmm.store import evaluations
+
+log = get_logger("asgi")
+
+WEB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 图片生成连接池上限（0 表示不限制）
+IMAGE_CONNECTION_LIMIT = int(os.getenv("IMAGE_CONNECTION_LIMIT", "0"))
+
+# 各阶段按剩余预算自行超时；监视协程在预算之后再等一小段时间才强制取消，
+# 以便阶段内的超时先触发并给出完整的错误信息（例如已发送交易的哈希）
+DEADLINE_GRACE_S = 0.5
+
+templates = Jinja2Templates(directory=os.path.join(WEB_DIR, 'templates'))
+# 模板沿用 Flask 的 url_for('static', filename=...) 写法
+templates.env.globals['url_for'] = lambda endpoint, filename: f"/static/{filename}"
+
+# 进程级共享的异步客户端，在 lifespan 中创建和关闭
+clients = {}
+mint_router = chains.MintRouter(chains.mint_chains())
+DEFAULT_CHAIN = chains.default_chain()
+# 后台任务的强引用，避免任务在完成前被垃圾回收
+background_tasks = set()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    clients['http'] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=IMAGE_CONNECTION_LIMIT),
+        timeout=aiohttp.ClientTimeout(total=60)
+    )
+    # 每条链一个常驻 AsyncWeb3 连接，链配置见 dmm.chains；sim:// 地址连接进程内模拟链
+    clients['chains'] = chains.Connections(simchain.async_web3)
+    for chain in chains.mint_chains():
+        clients['chains'].get(chain)
+    embeddings.start()
+    log.info("asgi.started", chains=chains.MINT_CHAINS, default=DEFAULT_CHAIN.key)
+    try:
+        yield
+    finally:
+        for task in list(background_tasks):
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await image_batcher.close()
+        await clients['http'].close()
+        if 'openai' in clients:
+            await clients.pop('openai').close()
+        log.info("asgi.stopped")
+
+
+# ============== 请求计量 ==============
+
+class TimingMiddleware:
+    """记录请求耗时并写入 Server-Timing 响应头（纯 ASGI 中间件，不额外创建任务）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = _endpoint_name(scope)
+        metrics.start_request(endpoint)
+        headers = Headers(scope=scope)
+        accounting.start(
+            accounting.client_id(headers.get(accounting.CLIENT_HEADER), headers.get('x-forwarded-for'),
+                                 scope['client'][0] if scope.get('client') else None),
+            endpoint
+        )
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                server_timing = metrics.finish_request(message['status'])
+                if server_timing:
+                    headers = list(message.get('headers', []))
+                    headers.append((b'server-timing', server_timing.encode('latin-1')))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            accounting.finish()
+
+
+def _endpoint_name(scope):
+    """按路由名称标记指标，与 Flask 的 request.endpoint 保持一致"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.name
+    return None
+
+
+# ============== 截止时间与取消 ==============
+
+def budget_response(exc, endpoint):
+    """花费预算用完时的响应（在调用上游之前返回）"""
+    log.warning("request.over_budget", endpoint=endpoint, scope=exc.scope,
+                client=exc.client, spent_usd=round(exc.spent, 6), budget_usd=exc.limit)
+    return JSONResponse(exc.to_dict(), status_code=exc.status_code)
+
+
+async def check_budget(estimate_usd=0.0):
+    """预算检查要读取 SQLite 明细，在线程池中执行，不阻塞事件循环；未配置预算时直接返回"""
+    if accounting.budgets_enabled():
+        await run_in_threadpool(accounting.check_budget, estimate_usd, accounting.current_client())
+
+
+def require_admin(request):
+    """校验管理令牌，失败时返回错误响应，成功时返回 None"""
+    if not profiling.ADMIN_TOKEN:
+        return JSONResponse({"error": "Admin endpoints are disabled"}, status_code=404)
+    if not profiling.is_admin(request.headers.get('X-Admin-Token')):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return None
+
+
+def unavailable_response(exc, endpoint):
+    """上游熔断时的响应（未调用上游），Retry-After 为熔断器进入半开的剩余时间"""
+    log.warning("request.circuit_open", endpoint=endpoint, upstream=exc.breaker,
+                retry_after_s=round(exc.retry_after, 1))
+    return JSONResponse(exc.to_dict(), status_code=exc.status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
+
+
+def aborted_response(exc, endpoint):
+    """预算耗尽或客户端断开时的响应，标明耗尽预算的阶段"""
+    log.warning("request.aborted", endpoint=endpoint, reason=exc.outcome,
+                stage=exc.stage, budget_ms=exc.budget_ms, elapsed_ms=exc.elapsed_ms)
+    return JSONResponse(exc.to_dict(), status_code=exc.status_code)
+
+
+def with_deadline(endpoint):
+    """
+    在请求预算内运行接口，并在客户端断开时取消
+
+    接口在独立任务中运行，同时等待连接断开消息；客户端断开或预算（加宽限）耗尽时
+    取消任务，正在等待的上游调用随之中止。
+    """
+    name = endpoint.__name__
+
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        # 先读完请求体，之后 receive() 只会收到断开消息，监视协程不会与接口抢读请求体
+        await request.body()
+        current = deadline.start(deadline.budget_for(name, request.headers.get(deadline.TIMEOUT_HEADER)))
+        task = asyncio.ensure_future(endpoint(request))
+        watcher = asyncio.ensure_future(_wait_for_disconnect(request.receive))
+        try:
+            timeout = current.remaining() + DEADLINE_GRACE_S if current is not None else None
+            await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if task.done():
+                return task.result()
+
+            stage_name = (current and current.current_stage) or name
+            if watcher.done():
+                if current is not None:
+                    current.cancel()
+                exc = ClientDisconnected(stage_name, current)
+            else:
+                exc = DeadlineExceeded(stage_name, current)
+
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return aborted_response(exc, name)
+        finally:
+            for pending in (task, watcher):
+                if not pending.done():
+                    pending.cancel()
+            deadline.finish()
+
+    return wrapper
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def within(stage_name, awaitable, cap=None, guard=None):
+    """在剩余预算内等待一个上游调用；guard 为熔断器的 guard()，熔断时不发出调用"""
+    try:
+        with deadline.stage(stage_name, cap) as timeout, guard or nullcontext():
+            return await asyncio.wait_for(awaitable, timeout)
+    finally:
+        # 预算检查未通过时协程从未被调度，显式关闭以免产生 "never awaited" 警告
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+
+
+# ============== 上游调用 ==============
+
+def openai_client():
+    """
+    进程共享的 AsyncOpenAI，第一次调用模型时创建
+
+    没有配置 OPENAI_API_KEY 时创建会抛出 OpenAIError：应用照常启动（状态、检索、铸造可用），
+    评估接口与 Flask 版本一样返回错误
+    """
+    client = clients.get('openai')
+    if client is None:
+        # 不自动重试：重试会让一次调用超出剩余预算
+        client = clients['openai'] = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, max_retries=0)
+    return client
+
+
+def spawn_background(coro):
+    """
+    在空白上下文中启动后台任务
+
+    create_task 会复制当前上下文，直接在请求中创建会继承请求的截止时间和耗时明细；
+    在新的 Context 中创建，后台任务不受请求预算约束，指标按 background 记录。
+    """
+    task = contextvars.Context().run(asyncio.ensure_future, coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def _image_headers():
+    return {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+
+async def send_image_batch(key, prompt, count):
+    """微批处理器的上游调用：一次生成 count 张同一提示词的图片"""
+    model, image_size, steps = key
+    for attempt in limits.attempts("image"):
+        async with attempt:
+            with metrics.stage("image_batch", upstream="image"):
+                async with clients['http'].post(IMAGE_API_URL, headers=_image_headers(),
+                                                json=build_image_payload(prompt, image_size, steps, count)) as response:
+                    response.raise_for_status()
+                    return extract_image_urls(await response.json())
+
+
+# IMAGE_BATCH_WINDOW_MS > 0 时，并发的图片请求经微批处理器合并后再调用上游
+image_batcher = AsyncBatcher(send_image_batch)
+
+
+async def generate_image(prompt, image_size=IMAGE_SIZE, steps=IMAGE_STEPS, stage_name="image"):
+    """调用 SiliconFlow API 生成图片（异步，预算耗尽时抛出 RequestAborted）"""
+    try:
+        log.debug("image.request", prompt=prompt, stage=stage_name)
+        # 微批处理时由 send_image_batch 占用图片的并发空位
+        for attempt in limits.attempts("image", enabled=not image_batcher.enabled):
+            async with attempt:
+                with metrics.stage(stage_name, upstream="image") as stage, \
+                        deadline.stage(stage_name, cap=60) as timeout, breakers.guard("image"):
+                    if image_batcher.enabled:
+                        image_url = await asyncio.wait_for(
+                            image_batcher.submit((IMAGE_MODEL, image_size, steps), prompt), timeout)
+                    else:
+                        payload = build_image_payload(prompt, image_size, steps)
+                        async with clients['http'].post(IMAGE_API_URL, headers=_image_headers(), json=payload,
+                                                        timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                            response.raise_for_status()
+                            image_url = extract_image_url(await response.json())
+
+                    if not image_url:
+                        stage.outcome = "empty"
+
+        if image_url:
+            accounting.record_image(IMAGE_MODEL)
+            log.info("image.generated", image_url=image_url, stage=stage_name)
+        else:
+            log.warning("image.empty", prompt=prompt)
+        return image_url
+
+    except RequestAborted:
+        raise
+    except CircuitOpen as e:
+        # 图片服务熔断：跳过图片，之后可以重新调用 POST /api/image
+        log.warning("image.skipped", reason="circuit_open", retry_after_s=round(e.retry_after, 1))
+        return None
+    except asyncio.TimeoutError:
+        log.warning("image.timeout", prompt=prompt)
+        return None
+    except Exception as e:
+        log.error("image.failed", error=str(e))
+        return None
+
+
+async def render_final_image(job_id, prompt, client):
+    """后台渲染完整质量的图片，完成后写入缓存并更新任务"""
+    with accounting.client_scope(client):
+        image_url = await generate_image(prompt)
+    if image_url:
+        images.cache.put(prompt, image_url)
+        images.jobs.complete(job_id, image_url)
+    else:
+        images.jobs.fail(job_id, "Image generation failed")
+
+
+async def attach_image(evaluation, progressive):
+    """
+    为评估结果生成图片
+
+    优先使用缓存的最终图片；渐进模式下后台开始渲染最终图片，同时生成预览图并立即返回，
+    客户端通过 /api/images/{job_id} 取得最终图片。
+    """
+    prompt = evaluation['image_prompt']
+    cached = images.cache.get(prompt)
+    if cached:
+        evaluation['image_url'] = cached
+        return evaluation
+
+    if not progressive:
+        evaluation['image_url'] = await generate_image(prompt)
+        images.cache.put(prompt, evaluation['image_url'])
+        return evaluation
+
+    job, created = images.jobs.find_or_create(prompt)
+    if created:
+        spawn_background(render_final_image(job['id'], prompt, accounting.current_client()))
+        try:
+            preview_url = await generate_image(prompt, images.IMAGE_PREVIEW_SIZE, images.IMAGE_PREVIEW_STEPS,
+                                               stage_name="image_preview")
+        except DeadlineExceeded:
+            # 预览图超出预算时最终图片仍在渲染，带上任务 ID 供客户端查询
+            images.apply_job(evaluation, job)
+            raise
+        job = images.jobs.set_preview(job['id'], preview_url) or job
+    return images.apply_job(evaluation, job)
+
+
+async def generate_evaluation_image(evaluation, progressive):
+    """
+    为评估结果生成图片
+
+    图片是可选的：预算在图片阶段耗尽时仍返回评估结果，并标明耗尽的阶段
+    """
+    try:
+        await attach_image(evaluation, progressive)
+    except DeadlineExceeded as e:
+        log.warning("image.deadline", budget_ms=e.budget_ms, elapsed_ms=e.elapsed_ms)
+        evaluation['deadline_exceeded'] = e.stage
+    if not evaluation.get('image_url') and not evaluation.get('image_job'):
+        log.warning("image.missing", score=evaluation.get('score'))
+    return evaluation
+
+
+def start_background_image(evaluation):
+    """在后台渲染最终图片，不等待结果；客户端通过 image_job 查询"""
+    prompt = evaluation['image_prompt']
+    cached = images.cache.get(prompt)
+    if cached:
+        evaluation['image_url'] = cached
+        return evaluation
+    job, created = images.jobs.find_or_create(prompt)
+    if created:
+        spawn_background(render_final_image(job['id'], prompt, accounting.current_client()))
+    return images.apply_job(evaluation, job)
+
+
+async def screen_story(story_text):
+    """级联评估第一步：用小模型只估一个分数，失败时返回 None（回退到完整评估）"""
+    client = openai_client()
+    try:
+        started = time.perf_counter()
+        for attempt in limits.attempts("llm"):
+            async with attempt:
+                with metrics.stage("screen", upstream="llm"), deadline.stage("screen") as timeout, \
+                        breakers.guard("llm"):
+                    response = await asyncio.wait_for(client.chat.completions.create(
+                        model=cascade.SCREEN_MODEL,
+                        messages=build_openai_messages(story_text, SCREEN_RUBRIC_EN),
+                        temperature=0,
+                        max_tokens=cascade.SCREEN_MAX_TOKENS,
+                        timeout=timeout
+                    ), timeout)
+        stats = usage.record_usage("openai-screen", response.usage, (time.perf_counter() - started) * 1000)
+        accounting.record_llm(cascade.SCREEN_MODEL, stats)
+        return cascade.parse_screen_score(response.choices[0].message.content)
+    except RequestAborted:
+        raise
+    except Exception as e:
+        log.warning("screen.failed", error=str(e))
+        return None
+
+
+async def request_evaluation(story_text, lean=False):
+    """
+    完整评估一个故事（一次 LLM 调用），返回解析后的评估结果
+
+    lean 为 True 时使用精简评分标准，不生成 feedback（见 dmm.feedback）
+    """
+    # 评分标准放在固定的系统提示词中，用户消息只包含故事
+    client = openai_client()
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        async with attempt:
+            with metrics.stage("llm", upstream="llm"), deadline.stage("llm") as timeout, breakers.guard("llm"):
+                response = await asyncio.wait_for(client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=build_openai_messages(story_text, LEAN_RUBRIC_EN if lean else EVALUATION_RUBRIC_EN),
+                    temperature=0.7,
+                    max_tokens=feedback.max_tokens(lean),
+                    timeout=timeout
+                ), timeout)
+    stats = usage.record_usage("openai-lean" if lean else "openai", response.usage,
+                               (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+
+    with metrics.stage("parse"):
+        evaluation = parse_evaluation(response.choices[0].message.content)
+    return feedback.defer(evaluation) if lean else evaluation
+
+
+async def request_feedback(evaluation, story_text):
+    """按评估结果中已给出的分数生成详细反馈（一次 LLM 调用），返回反馈文本"""
+    client = openai_client()
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        async with attempt:
+            with metrics.stage("llm_feedback", upstream="llm"), deadline.stage("llm_feedback") as timeout, \
+                    breakers.guard("llm"):
+                response = await asyncio.wait_for(client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=build_feedback_messages(story_text, evaluation['score'],
+                                                     evaluation.get('metadata_title', '')),
+                    temperature=0.7,
+                    max_tokens=feedback.FEEDBACK_MAX_TOKENS,
+                    timeout=timeout
+                ), timeout)
+    stats = usage.record_usage("openai-feedback", response.usage, (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+    return feedback.clean_feedback(response.choices[0].message.content)
+
+
+async def request_packed_evaluation(story_texts):
+    """打包评估一组短故事（一次 LLM 调用），返回 {组内下标: 评估结果}，缺失或无效的结果不在其中"""
+    client = openai_client()
+    started = time.perf_counter()
+    for attempt in limits.attempts("llm"):
+        async with attempt:
+            with metrics.stage("llm_packed", upstream="llm"), deadline.stage("llm_packed") as timeout, \
+                    breakers.guard("llm"):
+                response = await asyncio.wait_for(client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=build_packed_messages(story_texts),
+                    temperature=0.7,
+                    max_tokens=packing.max_tokens(len(story_texts)),
+                    timeout=timeout
+                ), timeout)
+    stats = usage.record_usage("openai-packed", response.usage, (time.perf_counter() - started) * 1000)
+    accounting.record_llm(AI_MODEL, stats)
+
+    with metrics.stage("parse"):
+        return packing.parse_packed(response.choices[0].message.content, len(story_texts))
+
+
+# ============== 路由 ==============
+
+async def index(request):
+    """主页"""
+    return templates.TemplateResponse(request, 'index.html', {"threshold": SCORE_THRESHOLD})
+
+
+# 最近一次成功读取的链上状态，RPC 熔断时由 /api/status 返回
+last_chain_status = {}
+
+
+@with_deadline
+async def status(request):
+    """检查系统状态（RPC 熔断时不访问节点，返回最近一次的链上状态）"""
+    try:
+        w3 = clients['chains'].get(DEFAULT_CHAIN)
+        rpc = breakers.get(breakers.rpc_name(DEFAULT_CHAIN.key))
+        is_connected = rpc.available() and await w3.is_connected()
+
+        status_data = {
+            "web3_connected": is_connected,
+            "chain": DEFAULT_CHAIN.key,
+            "chain_name": DEFAULT_CHAIN.name,
+            "contract_address": DEFAULT_CHAIN.contract_address,
+            "chains": mint_router.snapshot(),
+            "threshold": SCORE_THRESHOLD,
+            "prompt_cache": usage.snapshot(),
+            "cascade": cascade.snapshot(),
+            "breakers": breakers.snapshot(),
+            "limits": limits.snapshot(),
+            "pending_mints": mint_supervisor.snapshot()
+        }
+
+        if is_connected:
+            with metrics.stage("chain_info", upstream="rpc"):
+                status_data["chain_id"] = await within("chain_info", w3.eth.chain_id, guard=rpc.guard())
+                status_data["block_number"] = await within("chain_info", w3.eth.block_number, guard=rpc.guard())
+
+            # 检查钱包
+            if has_agent_key():
+                try:
+                    account = w3.eth.account.from_key(AGENT_PRIVATE_KEY)
+                    with metrics.stage("balance", upstream="rpc"):
+                        balance = await within("balance", w3.eth.get_balance(account.address), guard=rpc.guard())
+                    status_data["agent_address"] = account.address
+                    status_data["balance"] = float(Web3.from_wei(balance, 'ether'))
+                except (RequestAborted, CircuitOpen):
+                    raise
+                except Exception:
+                    status_data["wallet_error"] = "Invalid private key configuration"
+            last_chain_status.clear()
+            last_chain_status.update({key: status_data[key] for key in ("chain_id", "block_number", "agent_address", "balance")
+                                      if key in status_data}, updated_at=datetime.now().isoformat())
+        elif rpc.state != breakers.CLOSED:
+            status_data["chain_status"] = dict(last_chain_status, stale=True)
+
+        return JSONResponse(status_data)
+    except CircuitOpen:
+        # 本次请求中 RPC 熔断
+        return JSONResponse(dict(status_data, web3_connected=False, chain_status=dict(last_chain_status, stale=True)))
+    except RequestAborted as e:
+        return aborted_response(e, "status")
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@with_deadline
+async def evaluate(request):
+    """评估故事"""
+    try:
+        data = await request.json()
+        story_text = data.get('story_text', '').strip()
+
+        if not story_text:
+            return JSONResponse({"error": "Story content cannot be empty"}, status_code=400)
+
+        if len(story_text) < 50:
+            return JSONResponse({"error": "Story is too short, minimum 50 characters required"}, status_code=400)
+
+        await check_budget()
+
+        # 级联评估：小模型预估分明显低于阈值时直接返回轻量结果，不调用完整评估和图片生成
+        screen_score = decision = None
+        if cascade.EVALUATION_CASCADE:
+            screen_score = await screen_story(story_text)
+            decision = cascade.decide(screen_score, SCORE_THRESHOLD)
+            if decision == "reject":
+                log.info("evaluate.screened", screen_score=screen_score)
+                screened = cascade.build_screened_evaluation(screen_score, SCORE_THRESHOLD)
+                evaluations.add(screened)
+                stories.add(screened, story_text, accounting.current_client())
+                embeddings.enqueue(screened, story_text)
+                return JSONResponse(screened)
+
+        lean = feedback.lean_enabled(data)
+        evaluation = await request_evaluation(story_text, lean)
+        finalize_evaluation(evaluation, SCORE_THRESHOLD)
+        if decision is not None:
+            cascade.record_outcome(decision, screen_score, evaluation['score'], SCORE_THRESHOLD)
+            evaluation['screen_score'] = screen_score
+
+        # 图片不在评估的关键路径上：只为达到铸造标准的结果生成（见 dmm.images）
+        if evaluation.get('image_prompt'):
+            if images.IMAGE_GENERATION == "eager":
+                await generate_evaluation_image(evaluation, images.progressive_enabled(data))
+            elif evaluation['should_mint']:
+                if images.IMAGE_GENERATION == "background":
+                    start_background_image(evaluation)
+                else:
+                    evaluation['image_deferred'] = True
+            evaluation.setdefault('image_url', None)
+        evaluations.add(evaluation)
+        if lean:
+            # 按需生成反馈时需要故事正文，只保存在服务端
+            evaluations.update(evaluation['evaluation_id'], story_text=story_text)
+        stories.add(evaluation, story_text, accounting.current_client())
+        embeddings.enqueue(evaluation, story_text)
+
+        log.info("evaluate.done", score=evaluation['score'], should_mint=evaluation['should_mint'], lean=lean)
+        return JSONResponse(evaluation)
+
+    except BudgetExceeded as e:
+        return budget_response(e, "evaluate")
+    except CircuitOpen as e:
+        return unavailable_response(e, "evaluate")
+    except RequestAborted as e:
+        return aborted_response(e, "evaluate")
+    except json.JSONDecodeError as e:
+        log.warning("evaluate.parse_failed", error=str(e))
+        return JSONResponse({"error": f"Failed to parse AI response: {str(e)}"}, status_code=500)
+    except Exception as e:
+        log.exception("evaluate.failed")
+        return JSONResponse({"error": f"Evaluation failed: {str(e)}"}, status_code=500)
+
+
+def batch_item_error(exc):
+    """批量评估中单个故事失败时的结果"""
+    if isinstance(exc, (RequestAborted, CircuitOpen)):
+        return exc.to_dict()
+    if isinstance(exc, json.JSONDecodeError):
+        return {"error": f"Failed to parse AI response: {str(exc)}"}
+    return {"error": f"Evaluation failed: {str(exc)}"}
+
+
+@with_deadline
+async def evaluate_batch(request):
+    """
+    批量评估故事（{"stories": [...]}，见 dmm.packing）
+
+    短故事打包进同一个提示词评估，长故事和打包结果缺失或无效的故事单独评估。
+    结果按输入顺序返回，单个故事失败时对应位置为 {"error": ...}。
+    批量评估不做级联预筛，也不在请求内生成图片：达到铸造标准的结果带 image_deferred
+    （IMAGE_GENERATION=background 时在后台渲染），之后可调用 POST /api/image
+    """
+    try:
+        data = await request.json()
+        try:
+            story_texts = packing.story_texts(data.get('stories') if isinstance(data, dict) else None)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        results = [None] * len(story_texts)
+        candidates = []
+        for index, story_text in enumerate(story_texts):
+            if len(story_text) < 50:
+                results[index] = {"error": "Story is too short, minimum 50 characters required"}
+            else:
+                candidates.append(index)
+
+        await check_budget()
+        openai_client()
+
+        packs, singles = packing.plan([story_texts[index] for index in candidates])
+        packs = [[candidates[k] for k in pack] for pack in packs]
+        individual = [candidates[k] for k in singles]
+        pack_results, single_results = await asyncio.gather(
+            asyncio.gather(*(request_packed_evaluation([story_texts[index] for index in pack]) for pack in packs),
+                           return_exceptions=True),
+            asyncio.gather(*(request_evaluation(story_texts[index]) for index in individual),
+                           return_exceptions=True)
+        )
+
+        packed = 0
+        fallback = []
+        for pack, parsed in zip(packs, pack_results):
+            if isinstance(parsed, BaseException):
+                log.warning("evaluate.pack_failed", stories=len(pack), error=str(parsed))
+                parsed = {}
+            packing.record_pack(len(pack), len(parsed))
+            packed += len(parsed)
+            for k, index in enumerate(pack):
+                if k in parsed:
+                    results[index] = dict(parsed[k], packed=True)
+                else:
+                    fallback.append(index)
+
+        # 打包结果缺失或无效：回退为单独评估
+        fallback_results = await asyncio.gather(*(request_evaluation(story_texts[index]) for index in fallback),
+                                                return_exceptions=True)
+        failed = set()
+        for index, result in zip(individual + fallback, list(single_results) + list(fallback_results)):
+            if isinstance(result, BaseException):
+                log.warning("evaluate.batch_item_failed", index=index, error=str(result))
+                results[index] = batch_item_error(result)
+                failed.add(index)
+            else:
+                results[index] = result
+
+        for index in candidates:
+            if index in failed:
+                continue
+            evaluation = results[index]
+            finalize_evaluation(evaluation, SCORE_THRESHOLD)
+            if evaluation.get('image_prompt'):
+                if evaluation['should_mint']:
+                    if images.IMAGE_GENERATION == "background":
+                        start_background_image(evaluation)
+                    else:
+                        evaluation['image_deferred'] = True
+                evaluation.setdefault('image_url', None)
+            evaluations.add(evaluation)
+            stories.add(evaluation, story_texts[index], accounting.current_client())
+            embeddings.enqueue(evaluation, story_texts[index])
+
+        log.info("evaluate.batch_done", stories=len(story_texts), packs=len(packs), packed=packed,
+                 individual=len(individual) + len(fallback))
+        return JSONResponse({
+            "evaluations": results,
+            "packed": packed,
+            "individual": len(individual) + len(fallback),
+            "llm_calls": len(packs) + len(individual) + len(fallback)
+        })
+
+    except BudgetExceeded as e:
+        return budget_response(e, "evaluate_batch")
+    except Exception as e:
+        log.exception("evaluate.batch_failed")
+        return JSONResponse({"error": f"Evaluation failed: {str(e)}"}, status_code=500)
+
+
+async def _probe_gas_price(chain):
+    try:
+        with metrics.stage("gas_price_probe", upstream="rpc"):
+            gas_price = await within("gas_price_probe", clients['chains'].get(chain).eth.gas_price, cap=5,
+                                     guard=breakers.guard(breakers.rpc_name(chain.key)))
+        mint_router.observe_gas_price(chain.key, gas_price)
+    except RequestAborted:
+        raise
+    except CircuitOpen:
+        pass
+    except Exception as e:
+        log.warning("chain.probe_failed", chain=chain.key, error=str(e))
+        clients['chains'].mark_failed(chain)
+        mint_router.observe_failure(chain.key)
+
+
+async def refresh_gas_prices():
+    """并发刷新过期的各链 gas 价格，供铸造路由比较"""
+    stale = mint_router.stale()
+    if stale:
+        await asyncio.gather(*(_probe_gas_price(chain) for chain in stale))
+
+
+async def record_write(func, *args):
+    """
+    在线程池中执行幂等记录的写入（SQLite 同步事务，可能等待锁和 fsync），不阻塞事件循环
+
+    请求被取消时线程中的写入不会中止：等写入完成后再抛出 CancelledError，
+    之后 finally 中看到的状态（pending、nonce 租约、幂等键）与已写入的记录一致
+    """
+    future = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait({future})
+        raise
+
+
+def settle_mint(idempotency_key, chain, contract, tx_hash_hex, tx_receipt, gas_price, evaluation_id, replaced=()):
+    """记录交易收据：核算 gas、更新归档和幂等记录，返回铸造结果（replaced 为被替换的同 nonce 交易）"""
+    accounting.record_gas(tx_receipt['gasUsed'], tx_receipt.get('effectiveGasPrice', gas_price), chain.key)
+    result = {
+        "success": tx_receipt['status'] == 1,
+        "chain": chain.key,
+        "chain_id": chain.chain_id,
+        "chain_name": chain.name,
+        "tx_hash": tx_hash_hex,
+        "token_id": minted_token_id(contract, tx_receipt),
+        "gas_used": tx_receipt['gasUsed'],
+        "block_number": tx_receipt['blockNumber'],
+        "explorer_url": chain.tx_url(tx_hash_hex),
+        "timestamp": datetime.now().isoformat()
+    }
+    if replaced:
+        result["replaced_tx_hashes"] = list(replaced)
+
+    log.info("mint.confirmed", tx_hash=tx_hash_hex, success=result['success'], token_id=result['token_id'],
+             gas_used=result['gas_used'], block_number=result['block_number'], replaced=len(replaced))
+    if result['success']:
+        stories.mark_minted(evaluation_id, chain.key, tx_hash_hex, result['token_id'])
+        mint_requests.complete(idempotency_key, result)
+    else:
+        # 交易回滚：不占用幂等键，允许重新铸造
+        mint_requests.discard(idempotency_key)
+    return result
+
+
+def settle_pending_mint(pending, tx_hash_hex, tx_receipt, gas_price):
+    """后台确认的交易（可能是替换后的那一笔）"""
+    settle_mint(pending.key, pending.chain, pending.contract, tx_hash_hex, tx_receipt, gas_price,
+                pending.evaluation_id, pending.replaced(tx_hash_hex))
+
+
+# 请求内没有等到收据的交易交给后台监督：独立线程使用同步 Web3 查询收据，卡住时提价替换
+mint_supervisor = supervisor.MintSupervisor(chains.Connections(simchain.web3), AGENT_PRIVATE_KEY,
+                                            settle_pending_mint)
+
+
+@with_deadline
+async def mint(request):
+    """铸造 NFT"""
+    chain = None
+    idempotency_key = None
+    nonce_lease = None
+    pending = None
+    try:
+        data = await request.json()
+        metadata = data.get('metadata', {})
+
+        if not metadata.get('metadata_title') or not metadata.get('metadata_description'):
+            return JSONResponse({"error": "Incomplete metadata"}, status_code=400)
+
+        nft_metadata = build_nft_metadata(metadata)
+
+        # 幂等：同一个 Idempotency-Key（或同一份元数据）只铸造一次，重复请求直接返回已有结果，不访问 RPC
+        request_hash = idempotency.metadata_hash(nft_metadata)
+        try:
+            key = idempotency.request_key(request.headers.get(idempotency.HEADER), accounting.current_client(),
+                                          request_hash)
+            claim = asyncio.ensure_future(run_in_threadpool(mint_requests.claim, key, request_hash))
+            try:
+                record = await asyncio.shield(claim)
+            except asyncio.CancelledError:
+                # 请求被取消：等占用写完，占用成功时由 finally 释放，不留到 MINT_CLAIM_STALE_S 过期
+                await asyncio.wait({claim})
+                if claim.exception() is None and claim.result() is None:
+                    idempotency_key = key
+                raise
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        except KeyConflict as e:
+            return JSONResponse(e.to_dict(), status_code=e.status_code)
+        if record is not None:
+            log.info("mint.replayed", status=record['status'], tx_hash=record['tx_hash'])
+            body, status_code = idempotency.replay(record)
+            return JSONResponse(body, status_code=status_code, headers={idempotency.REPLAY_HEADER: "true"})
+        idempotency_key = key
+
+        # 选择目标链：请求可以用 chain 指定，否则按观测到的费用和确认时间路由
+        await refresh_gas_prices()
+        try:
+            chain = mint_router.choose(data.get('chain'))
+        except KeyError as e:
+            return JSONResponse({"error": str(e.args[0])}, status_code=400)
+        w3 = clients['chains'].get(chain)
+        rpc = breakers.get(breakers.rpc_name(chain.key))
+        account = w3.eth.account.from_key(AGENT_PRIVATE_KEY)
+        agent_address = account.address
+
+        contract = w3.eth.contract(
+            address=Web3.to_checksum_address(chain.contract_address),
+            abi=CONTRACT_ABI
+        )
+
+        token_uri = encode_token_uri(nft_metadata)
+        log.debug("mint.metadata", metadata=nft_metadata)
+        log.info("mint.prepared", token_uri_length=len(token_uri))
+
+        # 构建交易：并发请求各自分配 nonce，没有发出的交易在结束时归还
+        with metrics.stage("nonce", upstream="rpc"):
+            pending_count = await within("nonce", w3.eth.get_transaction_count(agent_address, 'pending'),
+                                         guard=rpc.guard())
+        nonce = supervisor.nonces.allocate((chain.key, agent_address), pending_count)
+        nonce_lease = (chain.key, agent_address), nonce
+
+        with metrics.stage("gas_price", upstream="rpc"):
+            gas_price = await within("gas_price", w3.eth.gas_price, guard=rpc.guard())
+        mint_router.observe_gas_price(chain.key, gas_price)
+        await check_budget(accounting.gas_cost(MINT_GAS_LIMIT, gas_price))
+
+        transaction = await contract.functions.mintToken(
+            Web3.to_checksum_address(agent_address),
+            token_uri
+        ).build_transaction({
+            'chainId': chain.chain_id,
+            'gas': MINT_GAS_LIMIT,
+            'gasPrice': gas_price,
+            'nonce': nonce,
+        })
+
+        # 签名交易
+        with metrics.stage("sign"):
+            signed_txn = w3.eth.account.sign_transaction(transaction, AGENT_PRIVATE_KEY)
+
+        # 发送交易（发送前最后一次检查预算和客户端连接，发送后交易不可撤回）
+        # 发送前先记下交易哈希：此后重复请求返回 pending，不会再发送第二笔
+        tx_hash_hex = signed_txn.hash.hex()
+        # 预算、客户端连接和熔断检查未通过时交易没有发出，不记录 pending，nonce 在 finally 中归还
+        with metrics.stage("send", upstream="rpc"), deadline.stage("send") as timeout, \
+                rpc.guard(ignore=(ValueError,)):
+            sending = supervisor.PendingMint(idempotency_key, chain, contract, transaction,
+                                             metadata.get('evaluation_id'), accounting.current_client())
+            sending.sending(tx_hash_hex, gas_price)
+            try:
+                await record_write(mint_requests.sending, idempotency_key, tx_hash_hex, sending.response())
+            except asyncio.CancelledError:
+                # 记录已写入但交易没有发出：删除记录，nonce 在 finally 中归还
+                spawn_background(run_in_threadpool(mint_requests.discard, idempotency_key))
+                idempotency_key = None
+                raise
+            pending = sending
+            # 交易可能已经发出，nonce 不再归还
+            lease, nonce_lease = nonce_lease, None
+            try:
+                tx_hash = await asyncio.wait_for(w3.eth.send_raw_transaction(signed_txn.rawTransaction), timeout)
+            except ValueError as e:
+                # 节点返回 JSON-RPC 错误，交易没有被接受
+                pending = None
+                if supervisor.is_nonce_too_low(e):
+                    supervisor.nonces.reset(lease[0])
+                else:
+                    nonce_lease = lease
+                await record_write(mint_requests.discard, idempotency_key)
+                raise
+        sent_at = time.perf_counter()
+        log.info("mint.sent", chain=chain.key, tx_hash=tx_hash_hex, nonce=nonce, gas_price=gas_price)
+
+        # 等待确认；超出预算时交易仍可能上链，响应中带上交易哈希供客户端跟踪
+        try:
+            # 等待确认本身耗时取决于出块，不计慢调用；等待超时也不计为 RPC 故障
+            with metrics.stage("receipt", upstream="rpc"):
+                tx_receipt = await within("receipt", w3.eth.wait_for_transaction_receipt(tx_hash),
+                                          cap=supervisor.MINT_CONFIRM_TARGET_S,
+                                          guard=rpc.guard(slow=False, ignore=(asyncio.TimeoutError, TimeExhausted)))
+        except (asyncio.TimeoutError, TimeExhausted):
+            # 目标确认时间内没有上链：交给后台监督（必要时提价替换），重复请求返回 pending
+            log.warning("mint.slow_confirmation", chain=chain.key, tx_hash=tx_hash_hex, nonce=nonce)
+            return JSONResponse(dict(pending.response(), pending=True), status_code=202)
+        except RequestAborted as e:
+            e.details.update(tx_hash=tx_hash_hex, explorer_url=chain.tx_url(tx_hash_hex), chain=chain.key, pending=True)
+            raise
+
+        mint_router.observe_mint(chain.key, tx_receipt['gasUsed'], time.perf_counter() - sent_at)
+        pending = None
+        result = await record_write(settle_mint, idempotency_key, chain, contract, tx_hash_hex, tx_receipt,
+                                    gas_price, metadata.get('evaluation_id'))
+        return JSONResponse(result)
+
+    except BudgetExceeded as e:
+        return budget_response(e, "mint")
+    except CircuitOpen as e:
+        return unavailable_response(e, "mint")
+    except RequestAborted as e:
+        return aborted_response(e, "mint")
+    except Exception as e:
+        if chain is not None and isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+            # RPC 不可用：切换到地址池中的下一个节点，路由暂时避开该链
+            clients['chains'].mark_failed(chain)
+            mint_router.observe_failure(chain.key)
+        log.exception("mint.failed")
+        return JSONResponse({"error": f"Minting failed: {str(e)}"}, status_code=500)
+    finally:
+        # 请求被取消（客户端断开）时同样执行
+        if nonce_lease is not None:
+            supervisor.nonces.release(*nonce_lease)
+        if idempotency_key is not None:
+            if pending is not None:
+                # 交易可能已经发出：幂等记录保持 pending，由后台监督等待收据
+                mint_supervisor.follow(pending)
+            else:
+                # 交易没有发出：释放幂等键（已完成或已删除的记录不受影响）
+                await record_write(mint_requests.release, idempotency_key)
+
+
+@with_deadline
+async def evaluation_feedback(request):
+    """
+    按需生成评估的详细反馈（精简评估的结果不含 feedback，见 dmm.feedback）
+
+    生成的反馈保存到评估结果并写入归档，重复调用直接返回已保存的反馈；
+    进程内存储中没有该评估时从归档读取，同一条评估的并发请求只生成一次
+    """
+    evaluation_id = request.path_params['evaluation_id']
+    try:
+        evaluation = await run_in_threadpool(feedback.lookup, evaluation_id)
+        if evaluation is None:
+            return JSONResponse({"error": "Evaluation not found"}, status_code=404)
+        if evaluation.get('feedback'):
+            feedback.FEEDBACK_REQUESTS.inc(outcome="cached")
+            return JSONResponse({"evaluation_id": evaluation_id, "feedback": evaluation['feedback'], "cached": True})
+        if not evaluation.get('story_text'):
+            return JSONResponse({"error": "Evaluation has no stored story"}, status_code=409)
+
+        future, leader = feedback.inflight.join(evaluation_id)
+        if not leader:
+            # shield：等待方被取消时不取消共享的 Future
+            with deadline.stage("feedback_wait") as timeout:
+                text = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            feedback.FEEDBACK_REQUESTS.inc(outcome="joined")
+            return JSONResponse({"evaluation_id": evaluation_id, "feedback": text, "cached": True})
+
+        try:
+            await check_budget()
+            text = await request_feedback(evaluation, evaluation['story_text'])
+            feedback.save(evaluation_id, text)
+        except BaseException as e:
+            feedback.inflight.finish(evaluation_id, error=e)
+            raise
+        feedback.inflight.finish(evaluation_id, text)
+        feedback.FEEDBACK_REQUESTS.inc(outcome="generated")
+
+        log.info("feedback.done", evaluation_id=evaluation_id, length=len(text))
+        return JSONResponse({"evaluation_id": evaluation_id, "feedback": text, "cached": False})
+
+    except BudgetExceeded as e:
+        return budget_response(e, "evaluation_feedback")
+    except CircuitOpen as e:
+        return unavailable_response(e, "evaluation_feedback")
+    except RequestAborted as e:
+        return aborted_response(e, "evaluation_feedback")
+    except Exception as e:
+        log.exception("feedback.failed")
+        return JSONResponse({"error": f"Feedback generation failed: {str(e)}"}, status_code=500)
+
+
+@with_deadline
+async def create_image(request):
+    """
+    为已完成的评估生成图片（按 evaluation_id 取服务端保存的结果）
+
+    只接受达到铸造标准的评估；已有最终图片或渲染任务时直接返回，重复调用不会再次生成
+    """
+    try:
+        data = await request.json()
+        evaluation_id = data.get('evaluation_id')
+        if not evaluation_id:
+            return JSONResponse({"error": "evaluation_id is required"}, status_code=400)
+        evaluation = evaluations.get(evaluation_id)
+        if evaluation is None:
+            return JSONResponse({"error": "Evaluation not found"}, status_code=404)
+        if not evaluation.get('should_mint'):
+            return JSONResponse({"error": "Images are only generated for mint-eligible evaluations"}, status_code=409)
+        if not evaluation.get('image_prompt'):
+            return JSONResponse({"error": "Evaluation has no image prompt"}, status_code=409)
+
+        await check_budget()
+        job = images.jobs.get(evaluation['image_job']) if evaluation.get('image_job') else None
+        if job is not None and job['status'] != 'failed':
+            evaluation.pop('image_preview', None)
+            images.apply_job(evaluation, job)
+        elif not evaluation.get('image_url') or evaluation.get('image_preview'):
+            for field in ('image_url', 'image_preview', 'image_job', 'deadline_exceeded'):
+                evaluation.pop(field, None)
+            await generate_evaluation_image(evaluation, images.progressive_enabled(data))
+
+        result = {field: evaluation.get(field) for field in ('image_url', 'image_preview', 'image_job', 'deadline_exceeded')}
+        evaluations.update(evaluation_id, image_deferred=False, **result)
+        if result['image_url'] and not result['image_preview']:
+            stories.update(evaluation_id, image_url=result['image_url'])
+        log.info("create_image.done", evaluation_id=evaluation_id, preview=bool(result['image_preview']))
+        return JSONResponse(dict(result, evaluation_id=evaluation_id, image_prompt=evaluation['image_prompt']))
+
+    except BudgetExceeded as e:
+        return budget_response(e, "create_image")
+    except RequestAborted as e:
+        return aborted_response(e, "create_image")
+    except Exception as e:
+        log.exception("create_image.failed")
+        return JSONResponse({"error": f"Image generation failed: {str(e)}"}, status_code=500)
+
+
+async def image_job(request):
+    """查询后台图片渲染任务（渐进模式）"""
+    job = images.jobs.get(request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({"error": "Image job not found"}, status_code=404)
+    return JSONResponse(job)
+
+
+async def search(request):
+    """
+    检索归档的评估结果
+
+    q 为关键词（中英文均可，按相关度排序；为空时按时间倒序），min_score / max_score /
+    since / until / should_mint / minted 过滤，page / per_page 分页
+    """
+    try:
+        params = search_params(request.query_params)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid search parameter: {str(e)}"}, status_code=400)
+    # SQLite 查询是阻塞调用，放到线程池中执行
+    with metrics.stage("search"):
+        result = await run_in_threadpool(stories.search, **params)
+    return JSONResponse(dict(result, query=params['query'], page=params['offset'] // params['limit'] + 1,
+                             per_page=params['limit']))
+
+
+async def related_memories(request):
+    """与某条归档评估最相似的故事（k 为返回条数），向量尚未计算完成时返回 202"""
+    evaluation_id = request.path_params['evaluation_id']
+    try:
+        k = int(request.query_params.get('k', 10))
+    except ValueError:
+        return JSONResponse({"error": "Invalid parameter: k"}, status_code=400)
+    try:
+        with metrics.stage("related"):
+            result = await run_in_threadpool(embeddings.related, evaluation_id, k)
+    except KeyError:
+        return JSONResponse({"error": "Evaluation not found in archive"}, status_code=404)
+    return JSONResponse(result, status_code=202 if result.get('pending') else 200)
+
+
+async def contract_config(request):
+    """获取合约配置"""
+    try:
+        # 顶层字段为默认链（前端钱包铸造使用），chains 列出所有可铸造的链
+        return JSONResponse({
+            "address": DEFAULT_CHAIN.contract_address,
+            "abi": load_contract_abi(),
+            "chain": DEFAULT_CHAIN.key,
+            "chain_id": DEFAULT_CHAIN.chain_id,
+            "chain_name": DEFAULT_CHAIN.name,
+            "chain_config": DEFAULT_CHAIN.to_dict(),
+            "chains": [chain.to_dict() for chain in chains.mint_chains()]
+        })
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def metrics_endpoint(request):
+    """Prometheus 格式的分阶段耗时指标"""
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def usage_report(request):
+    """滚动窗口内的花费汇总（按服务类型和客户端），需要管理令牌"""
+    denied = require_admin(request)
+    if denied:
+        return denied
+    try:
+        window = float(request.query_params.get('window', accounting.BUDGET_WINDOW_S))
+    except ValueError:
+        return JSONResponse({"error": "window must be a number of seconds"}, status_code=400)
+    return JSONResponse(await run_in_threadpool(accounting.snapshot, window))
+
+
+async def export_memories(request):
+    """
+    流式导出归档（format 为 ndjson / csv / parquet），需要管理令牌
+
+    cursor 从某条之后继续，limit 分页（下一页的 cursor 在 X-Export-Next-Cursor 响应头中），
+    since / until / min_score / max_score / should_mint / minted 过滤
+    """
+    denied = require_admin(request)
+    if denied:
+        return denied
+    try:
+        params = export_params(request.query_params)
+        stream, next_cursor = await run_in_threadpool(open_export, params)
+    except ValueError as e:
+        return JSONResponse({"error": f"Invalid export parameter: {str(e)}"}, status_code=400)
+    except ExportUnavailable as e:
+        return JSONResponse(e.to_dict(), status_code=e.status_code)
+    headers = {'Content-Disposition': f'attachment; filename="{filename(params["format"])}"'}
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    # 同步迭代器由 StreamingResponse 逐段放到线程池中读取，SQLite 查询不阻塞事件循环
+    return StreamingResponse(iter(stream), media_type=FORMATS[params['format']], headers=headers)
+
+
+async def examples(request):
+    """获取示例故事"""
+    return JSONResponse(EXAMPLE_STORIES)
+
+
+routes = [
+    Route('/', index, name='index'),
+    Route('/api/status', status, name='status'),
+    Route('/api/evaluate', evaluate, methods=['POST'], name='evaluate'),
+    Route('/api/evaluate/batch', evaluate_batch, methods=['POST'], name='evaluate_batch'),
+    Route('/api/evaluate/{evaluation_id}/feedback', evaluation_feedback, name='evaluation_feedback'),
+    Route('/api/image', create_image, methods=['POST'], name='create_image'),
+    Route('/api/images/{job_id}', image_job, name='image_job'),
+    Route('/api/search', search, name='search'),
+    Route('/api/memories/{evaluation_id}/related', related_memories, name='related_memories'),
+    Route('/api/mint', mint, methods=['POST'], name='mint'),
+    Route('/api/contract-config', contract_config, name='contract_config'),
+    Route('/metrics', metrics_endpoint, name='metrics_endpoint'),
+    Route('/admin/usage', usage_report, name='usage_report'),
+    Route('/admin/export', export_memories, name='export_memories'),
+    Route('/api/examples', examples, name='examples'),
+    Mount('/static', StaticFiles(directory=os.path.join(WEB_DIR, 'static')), name='static'),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'OPTIONS'],
+                   allow_headers=['Content-Type', idempotency.HEADER, deadline.TIMEOUT_HEADER]),
+        Middleware(TimingMiddleware),
+    ],
+    lifespan=lifespan
+)
@@ -84,10 +84,10 @@ function updateStatusUI(data) {
     if (data.error || !data.web3_connected) {
         indicator.classList.add('error');
         text.textContent = '❌ Connection Failed';
-        showNotification('Unable to connect to Base Sepolia', 'error');
+        showNotification(`Unable to connect to ${data.chain_name || 'blockchain'}`, 'error');
     } else {
         indicator.classList.remove('error');
-        text.innerHTML = `✅ Base Sepolia <span style="opacity: 0.8;">(Chain ${data.chain_id})</span>`;
+        text.innerHTML = `✅ ${escapeHtml(data.chain_name || 'Connected')} <span style="opacity: 0.8;">(Chain ${data.chain_id})</span>`;
         
         if (data.balance !== undefined) {
             const balanceValue = parseFloat(data.balance);
@@ -192,8 +192,11 @@ async function evaluateStory() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                // 服务端预算比前端超时少留 5 秒，超时时返回是哪个阶段耗尽了预算
+                'X-Request-Timeout-Ms': '115000',
             },
-            body: JSON.stringify({ story_text: storyText }),
+            // 精简评估：详细反馈在用户查看时再生成
+            body: JSON.stringify({ story_text: storyText, lean: true }),
             signal: controller.signal
         });
 
@@ -258,10 +261,21 @@ function displayResults(data) {
     // 显示详情
     updateElement('resultTitle', data.metadata_title);
     updateElement('resultDescription', data.metadata_description);
-    updateElement('resultFeedback', data.feedback || 'No detailed feedback available');
+    if (data.feedback_deferred) {
+        // 详细反馈不在评估请求内生成，需要时单独请求
+        showFeedbackButton(data);
+    } else {
+        updateElement('resultFeedback', data.feedback || 'No detailed feedback available');
+    }
     
-    // 显示图片（如果有）
-    displayGeneratedImage(data.image_url, data.image_prompt);
+    // 显示图片（如果有）；预览图会在最终图片渲染完成后被替换
+    displayGeneratedImage(data.image_url, data.image_prompt, data.image_preview);
+    if (data.image_deferred) {
+        // 图片不在评估请求内生成，达到铸造标准后单独请求
+        requestImage(data);
+    } else if (data.image_job) {
+        pollImageJob(data.image_job, data);
+    }
 
     // 显示/隐藏铸造区域
     updateMintSection(data);
@@ -270,15 +284,45 @@ function displayResults(data) {
     resultsSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
 }
 
+// 精简评估：点击后按需生成详细反馈（服务端保存，重复请求直接返回）
+function showFeedbackButton(evaluation) {
+    const feedbackElement = document.getElementById('resultFeedback');
+    if (!feedbackElement) return;
+    feedbackElement.innerHTML = '<button type="button" class="btn-secondary" id="feedbackBtn">💭 Show detailed feedback</button>';
+    document.getElementById('feedbackBtn').addEventListener('click', () => requestFeedback(evaluation));
+}
+
+async function requestFeedback(evaluation) {
+    updateElement('resultFeedback', 'Generating detailed feedback...');
+    
+    try {
+        const response = await fetch(`/api/evaluate/${encodeURIComponent(evaluation.evaluation_id)}/feedback`);
+        const result = await response.json();
+        if (currentEvaluation !== evaluation) return;
+        if (!response.ok) {
+            throw new Error(result.error || 'Feedback generation failed');
+        }
+        
+        evaluation.feedback = result.feedback;
+        evaluation.feedback_deferred = false;
+        updateElement('resultFeedback', result.feedback);
+    } catch (error) {
+        console.warn('Feedback generation failed:', error);
+        if (currentEvaluation === evaluation) {
+            showFeedbackButton(evaluation);
+        }
+    }
+}
+
 // 显示生成的图片
-function displayGeneratedImage(imageUrl, imagePrompt) {
+function displayGeneratedImage(imageUrl, imagePrompt, isPreview = false) {
     const imageContainer = document.getElementById('generatedImageContainer');
     if (!imageContainer) return;
     
     if (imageUrl) {
         imageContainer.innerHTML = `
             <div class="generated-image-wrapper">
-                <h4>🎨 AI Generated NFT Image</h4>
+                <h4>🎨 AI Generated NFT Image${isPreview ? ' (preview, rendering full quality...)' : ''}</h4>
                 <img src="${escapeHtml(imageUrl)}" alt="Generated NFT Image" class="generated-image">
                 ${imagePrompt ? `<p class="image-prompt"><strong>Image Prompt:</strong> ${escapeHtml(imagePrompt)}</p>` : ''}
             </div>
@@ -290,6 +334,74 @@ function displayGeneratedImage(imageUrl, imagePrompt) {
     }
 }
 
+// 为达到铸造标准的评估请求图片（渐进模式：先返回预览图，最终图片在后台渲染）
+async function requestImage(evaluation) {
+    const imageContainer = document.getElementById('generatedImageContainer');
+    if (imageContainer) {
+        imageContainer.innerHTML = '<div class="generated-image-wrapper"><h4>🎨 Generating NFT image...</h4></div>';
+        imageContainer.style.display = 'block';
+    }
+    
+    try {
+        const response = await fetch('/api/image', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ evaluation_id: evaluation.evaluation_id, progressive: true })
+        });
+        const result = await response.json();
+        if (currentEvaluation !== evaluation) return;
+        if (!response.ok) {
+            throw new Error(result.error || 'Image generation failed');
+        }
+        
+        evaluation.image_url = result.image_url;
+        evaluation.image_preview = result.image_preview;
+        evaluation.image_deferred = false;
+        displayGeneratedImage(result.image_url, evaluation.image_prompt, result.image_preview);
+        if (result.image_job) {
+            pollImageJob(result.image_job, evaluation);
+        }
+    } catch (error) {
+        console.warn('Image generation failed:', error);
+        if (currentEvaluation === evaluation) {
+            displayGeneratedImage(null);
+        }
+    }
+}
+
+// 轮询后台图片渲染任务，完成后用最终图片替换预览图
+async function pollImageJob(jobId, evaluation) {
+    const giveUpAt = Date.now() + 120000;
+    
+    while (Date.now() < giveUpAt) {
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        
+        // 已经开始了新的评估
+        if (currentEvaluation !== evaluation) return;
+        
+        try {
+            const response = await fetch(`/api/images/${encodeURIComponent(jobId)}`);
+            if (!response.ok) return;
+            
+            const job = await response.json();
+            if (job.status === 'done') {
+                evaluation.image_url = job.image_url;
+                evaluation.image_preview = false;
+                displayGeneratedImage(job.image_url, evaluation.image_prompt);
+                return;
+            }
+            if (job.status === 'failed') {
+                // 保留预览图
+                displayGeneratedImage(evaluation.image_url, evaluation.image_prompt);
+                return;
+            }
+        } catch (error) {
+            console.warn('Image job polling failed:', error);
+            return;
+        }
+    }
+}
+
 // 更新铸造区域
 function updateMintSection(data) {
     const mintSection = document.getElementById('mintSection');
@@ -12,7 +12,14 @@ window.web3State = {
 // Contract configuration (will be fetched from server)
 let CONTRACT_ADDRESS = null;
 let CONTRACT_ABI = null;
-const SEPOLIA_CHAIN_ID = '0xaa36a7'; // 11155111 in hexadecimal
+// Target chain for wallet minting (server default chain, overridden by /api/contract-config)
+let TARGET_CHAIN = {
+    chain_id_hex: '0xaa36a7', // 11155111 in hexadecimal
+    name: 'Ethereum Sepolia',
+    currency: 'ETH',
+    wallet_rpc_url: 'https://ethereum-sepolia-rpc.publicnode.com',
+    explorer_url: 'https://sepolia.etherscan.io'
+};
 
 // Initialize Web3
 async function initWeb3() {
@@ -50,6 +57,9 @@ async function loadContractConfig() {
         
         CONTRACT_ADDRESS = config.address;
         CONTRACT_ABI = config.abi;
+        if (config.chain_config) {
+            TARGET_CHAIN = config.chain_config;
+        }
         
         console.log('📝 Contract address:', CONTRACT_ADDRESS);
     } catch (error) {
@@ -98,9 +108,9 @@ async function connectWallet() {
         window.web3State.chainId = chainId;
         window.web3State.isConnected = true;
 
-        // Check if on Sepolia network
-        if (chainId !== SEPOLIA_CHAIN_ID) {
-            await switchToSepolia();
+        // Check if on the target network
+        if (chainId !== TARGET_CHAIN.chain_id_hex) {
+            await switchToTargetChain();
         } else {
             initContract();
         }
@@ -119,15 +129,15 @@ async function connectWallet() {
     }
 }
 
-// Switch to Sepolia network
-async function switchToSepolia() {
+// Switch to the target network
+async function switchToTargetChain() {
     try {
         await window.ethereum.request({
             method: 'wallet_switchEthereumChain',
-            params: [{ chainId: SEPOLIA_CHAIN_ID }],
+            params: [{ chainId: TARGET_CHAIN.chain_id_hex }],
         });
         
-        showNotification('✅ Switched to Sepolia testnet', 'success');
+        showNotification(`✅ Switched to ${TARGET_CHAIN.name}`, 'success');
         initContract();
     } catch (error) {
         // If network doesn't exist, add it
@@ -136,20 +146,20 @@ async function switchToSepolia() {
                 await window.ethereum.request({
                     method: 'wallet_addEthereumChain',
                     params: [{
-                        chainId: SEPOLIA_CHAIN_ID,
-                        chainName: 'Sepolia Test Network',
+                        chainId: TARGET_CHAIN.chain_id_hex,
+                        chainName: TARGET_CHAIN.name,
                         nativeCurrency: {
-                            name: 'SepoliaETH',
-                            symbol: 'ETH',
+                            name: TARGET_CHAIN.currency,
+                            symbol: TARGET_CHAIN.currency,
                             decimals: 18
                         },
-                        rpcUrls: ['https://sepolia.infura.io/v3/'],
-                        blockExplorerUrls: ['https://sepolia.etherscan.io']
+                        rpcUrls: [TARGET_CHAIN.wallet_rpc_url],
+                        blockExplorerUrls: [TARGET_CHAIN.explorer_url]
                     }]
                 });
                 initContract();
             } catch (addError) {
-                showNotification('Failed to add Sepolia network', 'error');
+                showNotification(`Failed to add ${TARGET_CHAIN.name} network`, 'error');
             }
         } else {
             showNotification('Failed to switch network: ' + error.message, 'error');
@@ -239,7 +249,7 @@ async function mintNFTWithWallet(metadata) {
             tx_hash: tx.transactionHash,
             gas_used: tx.gasUsed,
             block_number: tx.blockNumber,
-            explorer_url: `https://sepolia.etherscan.io/tx/${tx.transactionHash}`,
+            explorer_url: `${TARGET_CHAIN.explorer_url}/tx/${tx.transactionHash}`,
             from: window.web3State.account
         };
 
@@ -283,11 +293,11 @@ function handleAccountsChanged(accounts) {
 function handleChainChanged(chainId) {
     window.web3State.chainId = chainId;
     
-    if (chainId !== SEPOLIA_CHAIN_ID) {
-        showNotification('⚠️ Please switch to Sepolia testnet', 'warning');
+    if (chainId !== TARGET_CHAIN.chain_id_hex) {
+        showNotification(`⚠️ Please switch to ${TARGET_CHAIN.name}`, 'warning');
     } else {
         initContract();
-        showNotification('✅ Connected to Sepolia testnet', 'success');
+        showNotification(`✅ Connected to ${TARGET_CHAIN.name}`, 'success');
     }
     
     updateWalletUI();
@@ -307,7 +317,7 @@ function updateWalletUI() {
         if (walletInfo) {
             walletInfo.style.display = 'block';
             walletInfo.innerHTML = `
-                <span>🔗 ${window.web3State.chainId === SEPOLIA_CHAIN_ID ? 'Sepolia' : 'Wrong Network'}</span>
+                <span>🔗 ${window.web3State.chainId === TARGET_CHAIN.chain_id_hex ? escapeHtml(TARGET_CHAIN.name) : 'Wrong Network'}</span>
             `;
         }
     } else {